@@ -1,10 +1,12 @@
 import os
 import logging
 from datetime import datetime
-from flask import Flask, render_template, request, flash, redirect, url_for, send_from_directory, jsonify, send_file
+from itertools import chain, groupby
+from flask import Flask, render_template, request, flash, redirect, url_for, send_from_directory, jsonify, send_file, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from sqlalchemy import text
+from sqlalchemy import delete, select, text, update
 from werkzeug.utils import secure_filename
+from subidas import RequestSubida, descartar_subidas
 
 # Set up logging with more detail
 logging.basicConfig(
@@ -15,6 +17,7 @@ logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = RequestSubida
 
 # Configuración segura de la clave secreta
 if not os.environ.get("SESSION_SECRET"):
@@ -28,7 +31,17 @@ from database import db, init_db
 init_db(app)
 
 # Import models after database initialization
-from models import User, Sede, Escaneo, Host, Vulnerabilidad, ActivityLog
+from models import User, Sede, Escaneo, Host, Vulnerabilidad, ActivityLog, TrabajoIngesta
+from cache import en_cache, incrementar_version, obtener_backend
+from compresion import EXTENSIONES_COMPRIMIDAS
+from consultas import (PAGINA_VULNERABILIDADES, consulta_hosts, consulta_vulnerabilidades, detalle_vulnerabilidad,
+                       inventario_escaneos, iterar_filas, pagina_escaneos, pagina_hosts, pagina_vulnerabilidades)
+from exportar import exportar_a_csv, exportar_a_pdf
+from ingesta import buscar_duplicado, eliminar_escaneos
+from resumen import COLUMNAS_ESTADO, COLUMNAS_NIVEL, ajustar_estado, calcular_totales, tendencias_por_fecha
+from retencion import eliminar_archivo
+from trabajos import (ELIMINACION_UMBRAL, buscar_eliminacion_en_curso, buscar_trabajo_en_curso, encolar_eliminacion,
+                      encolar_trabajo, iniciar_trabajadores, trabajo_a_dict)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -175,42 +188,26 @@ def dashboard():
     fecha_fin = request.args.get('fecha_fin')
     riesgo = request.args.get('riesgo')
 
-    # Query base
-    query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
-
-    # Aplicar filtros
-    if sede:
-        query = query.filter(Sede.nombre == sede)
-    if fecha_inicio:
-        query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-    if fecha_fin:
-        query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
-
-    vulnerabilidades = query.all()
-    total_vulnerabilidades = len(vulnerabilidades)
-
-    # Calcular riesgo promedio (CVSS)
-    vulnerabilidades_con_cvss = [v for v in vulnerabilidades if v.cvss and v.cvss.replace('.','').isdigit()]
-    if vulnerabilidades_con_cvss:
-        riesgo_total = sum(float(v.cvss) for v in vulnerabilidades_con_cvss)
-        riesgo_promedio = round(riesgo_total / len(vulnerabilidades_con_cvss), 1)
-    else:
-        riesgo_promedio = 0.0
+    # Los conteos se agregan en la base de datos, sin traer filas de vulnerabilidades
+    totales = en_cache(
+        'totales', calcular_totales,
+        sede,
+        datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None,
+        datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None,
+        riesgo
+    )
+    total_vulnerabilidades = totales['vulnerabilidades']
+    riesgo_promedio = totales['riesgo_promedio']
 
     # Contar estados
     estados = {
-        'mitigada': len([v for v in vulnerabilidades if v.estado == 'MITIGADA']),
-        'asumida': len([v for v in vulnerabilidades if v.estado == 'ASUMIDA']),
-        'vigente': len([v for v in vulnerabilidades if v.estado == 'ACTIVA'])
+        'mitigada': totales['estados']['MITIGADA'],
+        'asumida': totales['estados']['ASUMIDA'],
+        'vigente': totales['estados']['ACTIVA']
     }
 
     # Contar por criticidad
-    criticidad = {
-        'Critical': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Critical']),
-        'High': len([v for v in vulnerabilidades if v.nivel_amenaza == 'High']),
-        'Medium': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Medium']),
-        'Low': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Low'])
-    }
+    criticidad = totales['criticidad']
 
     return render_template('dashboard.html',
                          riesgo_promedio=riesgo_promedio,
@@ -224,6 +221,9 @@ def dashboard():
 
 def obtener_sedes():
     """Obtiene la lista única de sedes activas que tienen escaneos"""
+    return en_cache('sedes', _consultar_sedes)
+
+def _consultar_sedes():
     # Query para obtener solo las sedes que tienen escaneos
     sql = text("""
         SELECT DISTINCT s.nombre
@@ -243,43 +243,73 @@ def configuracion():
     sedes_activas = [s for s in sedes if s.activa]
     usuarios = User.query.all()  # Agregamos la consulta de usuarios
 
-    # Obtener todos los escaneos organizados por sede
-    escaneos_por_sede = {}
-    for sede in sedes:
-        escaneos = Escaneo.query.filter_by(sede_id=sede.id)\
-            .order_by(Escaneo.fecha_escaneo.desc())\
-            .all()
-        if escaneos:
-            escaneos_por_sede[sede.nombre] = [
-                {
-                    'id': e.id,
-                    'fecha': e.fecha_escaneo.strftime('%Y-%m-%d'),
-                    'total_hosts': len(e.hosts),
-                    'total_vulnerabilidades': sum(len(h.vulnerabilidades) for h in e.hosts)
-                } for e in escaneos
-            ]
+    # Primera página de escaneos de cada sede, con sus conteos, en una sola consulta
+    escaneos_por_sede = inventario_escaneos()
+
+    trabajos = TrabajoIngesta.query.order_by(TrabajoIngesta.id.desc()).limit(10).all()
 
     return render_template('configuracion.html', 
                          today=datetime.now().strftime('%Y-%m-%d'),
                          sedes=sedes,
                          sedes_activas=sedes_activas,
                          escaneos_por_sede=escaneos_por_sede,
-                         usuarios=usuarios)  # Agregamos los usuarios al contexto
+                         usuarios=usuarios,  # Agregamos los usuarios al contexto
+                         trabajos=[trabajo_a_dict(t) for t in trabajos])
+
+@app.route('/configuracion/escaneos/<int:sede_id>')
+@login_required
+def escaneos_de_sede(sede_id):
+    """Siguiente página del inventario de escaneos de una sede, pedida con "Ver más" en configuración"""
+    despues = request.args.get('despues', type=int)
+    if despues is None:
+        return jsonify({'success': False, 'error': 'Falta el parámetro despues'}), 400
+    try:
+        escaneos, siguiente = pagina_escaneos(sede_id, despues)
+        return jsonify({'escaneos': escaneos, 'siguiente': siguiente})
+    except Exception as e:
+        logger.error(f"Error al obtener los escaneos de la sede {sede_id}: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/hosts')
 @login_required
 def hosts():
+    """Hosts escaneados con sus conteos por nivel, por páginas; el detalle se pide al expandir cada host"""
     sede = request.args.get('sede')
     fecha_inicio = request.args.get('fecha_inicio')
     fecha_fin = request.args.get('fecha_fin')
     riesgo = request.args.get('riesgo')
+    # Clave del último host de la página anterior: "<escaneo_id>:<ip>"
+    despues = request.args.get('despues')
 
     try:
-        resultados_filtrados = filtrar_resultados(sede, fecha_inicio, fecha_fin, riesgo)
-        logger.debug(f"Resultados filtrados para hosts: {len(resultados_filtrados) if resultados_filtrados else 0} registros")
+        clave = None
+        if despues:
+            escaneo_id, ip = despues.split(':', 1)
+            clave = (int(escaneo_id), ip)
+        filas, siguiente = pagina_hosts(
+            sede,
+            datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None,
+            datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None,
+            riesgo,
+            clave
+        )
+        logger.debug(f"Hosts en la página: {len(filas)}")
+
+        # Un bloque por escaneo, en el orden de la página
+        resultados = []
+        for escaneo_id, hosts_escaneo in groupby(filas, key=lambda h: h['escaneo_id']):
+            hosts_escaneo = list(hosts_escaneo)
+            resultados.append({
+                'sede': hosts_escaneo[0]['sede'],
+                'fecha_escaneo': hosts_escaneo[0]['fecha_escaneo'].strftime('%Y-%m-%d'),
+                'escaneo_id': escaneo_id,
+                'hosts': hosts_escaneo
+            })
 
-        return render_template('hosts.html', 
-                            resultados=resultados_filtrados,
+        return render_template('hosts.html',
+                            resultados=resultados,
+                            siguiente=f'{siguiente[0]}:{siguiente[1]}' if siguiente else None,
+                            primera_pagina=not despues,
                             sedes=obtener_sedes(),
                             sede_seleccionada=sede,
                             fecha_inicio=fecha_inicio,
@@ -288,118 +318,112 @@ def hosts():
     except Exception as e:
         logger.error(f"Error en la vista de hosts: {str(e)}", exc_info=True)
         flash('Error al cargar la página de hosts', 'error')
-        return render_template('hosts.html', 
+        return render_template('hosts.html',
                             resultados=[],
+                            siguiente=None,
+                            primera_pagina=True,
                             sedes=obtener_sedes(),
                             sede_seleccionada=sede,
                             fecha_inicio=fecha_inicio,
                             fecha_fin=fecha_fin,
                             riesgo=riesgo)
 
-def filtrar_resultados(sede=None, fecha_inicio=None, fecha_fin=None, riesgo=None):
-    """Filtra los resultados según los criterios especificados"""
-    query = Escaneo.query.join(Sede)
-
-    if sede and sede != 'Todas las sedes':
-        query = query.filter(Sede.nombre == sede)
-
-    if fecha_inicio:
-        fecha_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-        query = query.filter(Escaneo.fecha_escaneo >= fecha_inicio_obj)
-
-    if fecha_fin:
-        fecha_fin_obj = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-        query = query.filter(Escaneo.fecha_escaneo <= fecha_fin_obj)
-
-    # Ordenar por fecha de escaneo descendente (más reciente primero)
-    escaneos = query.order_by(Escaneo.fecha_escaneo.desc()).all()
-    resultados = []
-
-    for escaneo in escaneos:
-        hosts_detalle = {}
-        for host in escaneo.hosts:
-            vulns = host.vulnerabilidades
-            if riesgo and riesgo != 'all':
-                vulns = [v for v in vulns if v.nivel_amenaza == riesgo]
-                if not vulns:
-                    continue
-
-            hosts_detalle[host.ip] = {
-                'nombre_host': host.nombre_host,
-                'vulnerabilidades': [{
-                    'nvt': v.nvt,
-                    'oid': v.oid,
-                    'nivel_amenaza': v.nivel_amenaza,
-                    'cvss': v.cvss,
-                    'puerto': v.puerto,
-                    'resumen': v.resumen,
-                    'impacto': v.impacto,
-                    'solucion': v.solucion,
-                    'metodo_deteccion': v.metodo_deteccion,
-                    'referencias': v.referencias,
-                    'estado': v.estado
-                } for v in vulns]
-            }
-
-        if hosts_detalle:
-            resultados.append({
-                'sede': escaneo.sede.nombre,
-                'fecha_escaneo': escaneo.fecha_escaneo.strftime('%Y-%m-%d'),
-                'escaneo_id': escaneo.id,
-                'hosts_detalle': hosts_detalle
-            })
-
-    return resultados
+@app.route('/hosts/<int:host_id>/vulnerabilidades')
+@login_required
+def vulnerabilidades_host(host_id):
+    """Vulnerabilidades de un host escaneado, pedidas al expandir su fila en la vista de hosts"""
+    riesgo = request.args.get('riesgo')
+    try:
+        # La fila expandida solo muestra el resumen y la solución del NVT
+        filas = iterar_filas(consulta_vulnerabilidades(riesgo=riesgo, host_id=host_id,
+                                                       detalle=('resumen', 'solucion')))
+        return jsonify([{
+            'nvt': fila.nvt,
+            'oid': fila.oid,
+            'nivel_amenaza': fila.nivel_amenaza,
+            'cvss': fila.cvss if fila.cvss is not None else '',
+            'puerto': fila.puerto,
+            'estado': fila.estado or 'ACTIVA',
+            'resumen': fila.resumen,
+            'solucion': fila.solucion
+        } for fila in filas])
+    except Exception as e:
+        logger.error(f"Error al obtener las vulnerabilidades del host {host_id}: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/vulnerabilidades')
 @login_required
 def vulnerabilidades():
+    """Tabla de vulnerabilidades; las filas las pide la página a /vulnerabilidades/datos"""
+    return render_template('vulnerabilidades.html',
+                        sedes=obtener_sedes(),
+                        sede_seleccionada=request.args.get('sede'),
+                        fecha_inicio=request.args.get('fecha_inicio'),
+                        fecha_fin=request.args.get('fecha_fin'),
+                        riesgo=request.args.get('riesgo'),
+                        estado=request.args.get('estado'),
+                        por_pagina=PAGINA_VULNERABILIDADES)
+
+@app.route('/vulnerabilidades/datos')
+@login_required
+def datos_vulnerabilidades():
+    """Una página de la tabla de vulnerabilidades, con orden y búsqueda resueltos en la base de datos"""
     try:
         sede = request.args.get('sede')
         fecha_inicio = request.args.get('fecha_inicio')
         fecha_fin = request.args.get('fecha_fin')
         riesgo = request.args.get('riesgo')
         estado = request.args.get('estado')
+        cvss_min = request.args.get('cvss_min', type=float)
+        buscar = request.args.get('buscar', '').strip()
+        orden = request.args.get('orden')
+        descendente = request.args.get('direccion') == 'desc'
+        pagina = request.args.get('pagina', 1, type=int)
+        por_pagina = request.args.get('por_pagina', PAGINA_VULNERABILIDADES, type=int)
+
+        logger.debug(f"Filtros recibidos - sede: {sede}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}, riesgo: {riesgo}, estado: {estado}, cvss_min: {cvss_min}, buscar: {buscar}, orden: {orden}, pagina: {pagina}")
+
+        filas, total = pagina_vulnerabilidades(
+            sede,
+            datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None,
+            datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None,
+            riesgo, estado, cvss_min, buscar, orden, descendente, pagina, por_pagina
+        )
+        return jsonify({
+            'total': total,
+            'pagina': pagina,
+            'filas': [{
+                'id': fila.id,
+                'ip': fila.ip,
+                'nombre_host': fila.nombre_host,
+                'oid': fila.oid,
+                'nvt': fila.nvt,
+                'nivel_amenaza': fila.nivel_amenaza,
+                'fecha_escaneo': fila.fecha_escaneo.strftime('%Y-%m-%d'),
+                'cvss': fila.cvss if fila.cvss is not None else '',
+                'estado': fila.estado or 'ACTIVA'
+            } for fila in filas]
+        })
+    except Exception as e:
+        logger.error(f"Error al obtener las vulnerabilidades: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        logger.debug(f"Filtros recibidos - sede: {sede}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}, riesgo: {riesgo}, estado: {estado}")
-
-        query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
-
-        # Aplicar filtros
-        if sede and sede != 'Todas las sedes':
-            query = query.filter(Sede.nombre == sede)
-        if fecha_inicio:
-            query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-        if fecha_fin:
-            query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
-        if riesgo and riesgo != 'all':
-            query = query.filter(Vulnerabilidad.nivel_amenaza == riesgo)
-        if estado and estado != 'all':
-            query = query.filter(Vulnerabilidad.estado == estado)
-
-        vulnerabilidades = query.all()
-        logger.debug(f"Total de vulnerabilidades encontradas: {len(vulnerabilidades)}")
-
-        return render_template('vulnerabilidades.html', 
-                            resultados=vulnerabilidades,
-                            sedes=obtener_sedes(),
-                            sede_seleccionada=sede,
-                            fecha_inicio=fecha_inicio,
-                            fecha_fin=fecha_fin,
-                            riesgo=riesgo,
-                            estado=estado)
-
+@app.route('/vulnerabilidades/<int:vulnerabilidad_id>/detalle')
+@login_required
+def detalle_de_vulnerabilidad(vulnerabilidad_id):
+    """Resumen, impacto, solución y referencias de una vulnerabilidad, pedidos al expandir su fila"""
+    fecha_escaneo = request.args.get('fecha_escaneo')
+    try:
+        detalle = detalle_vulnerabilidad(
+            vulnerabilidad_id,
+            datetime.strptime(fecha_escaneo, '%Y-%m-%d').date() if fecha_escaneo else None
+        )
+        if detalle is None:
+            return jsonify({'success': False, 'error': 'Vulnerabilidad no encontrada'}), 404
+        return jsonify({**detalle._asdict(), 'referencias': detalle.referencias or []})
     except Exception as e:
-        logger.error(f"Error en la vista de vulnerabilidades: {str(e)}", exc_info=True)
-        flash('Error al cargar la página de vulnerabilidades', 'error')
-        return render_template('vulnerabilidades.html',
-                            resultados=[],
-                            sedes=obtener_sedes(),
-                            sede_seleccionada=sede if 'sede' in locals() else None,
-                            fecha_inicio=fecha_inicio if 'fecha_inicio' in locals() else None,
-                            fecha_fin=fecha_fin if 'fecha_fin' in locals() else None,
-                            riesgo=riesgo if 'riesgo' in locals() else None,
-                            estado=estado if 'estado' in locals() else None)
+        logger.error(f"Error al obtener el detalle de la vulnerabilidad {vulnerabilidad_id}: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/comparacion')
 @login_required
@@ -450,63 +474,13 @@ def comparacion():
             fecha1_obj = datetime.strptime(fecha1, '%Y-%m-%d').date()
             fecha2_obj = datetime.strptime(fecha2, '%Y-%m-%d').date()
 
-            # Consulta SQL para obtener los conteos
-            sql_query = text("""
-            SELECT 
-                s.nombre,
-                e.fecha_escaneo,
-                v.nivel_amenaza,
-                COUNT(*) as total
-            FROM escaneos e
-            JOIN hosts h ON h.escaneo_id = e.id
-            JOIN vulnerabilidades v ON v.host_id = h.id
-            JOIN sedes s ON e.sede_id = s.id
-            WHERE (s.nombre = :sede1 AND e.fecha_escaneo = :fecha1)
-               OR (s.nombre = :sede2 AND e.fecha_escaneo = :fecha2)
-            GROUP BY s.nombre, e.fecha_escaneo, v.nivel_amenaza
-            ORDER BY e.fecha_escaneo, v.nivel_amenaza;
-            """)
-
-            result = db.session.execute(sql_query, {
-                'sede1': sede1,
-                'fecha1': fecha1_obj,
-                'sede2': sede2,
-                'fecha2': fecha2_obj
-            })
-
-            # Procesar resultados
-            primer_conteo = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0}
-            segundo_conteo = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0}
-            primer_total = 0
-            segundo_total = 0
-
-            # Almacenar los resultados para procesarlos
-            resultados_sql = list(result)
-            logger.debug(f"Resultados SQL obtenidos: {resultados_sql}")
-
-            # Si es el mismo escaneo, usar los mismos datos para ambos
-            if sede1 == sede2 and fecha1_obj == fecha2_obj:
-                for row in resultados_sql:
-                    nivel_amenaza = row[2]
-                    total = row[3]
-                    primer_conteo[nivel_amenaza] = total
-                    segundo_conteo[nivel_amenaza] = total
-                    primer_total += total
-                    segundo_total += total
-            else:
-                # Procesar normalmente para escaneos diferentes
-                for row in resultados_sql:
-                    sede = row[0]
-                    fecha_escaneo = row[1]
-                    nivel_amenaza = row[2]
-                    total = row[3]
-
-                    if sede == sede1 and fecha_escaneo == fecha1_obj:
-                        primer_conteo[nivel_amenaza] = total
-                        primer_total += total
-                    elif sede == sede2 and fecha_escaneo == fecha2_obj:
-                        segundo_conteo[nivel_amenaza] = total
-                        segundo_total += total
+            # Conteos por nivel de los escaneos de cada sede y fecha
+            primer_resumen = en_cache('totales', calcular_totales, sede1, fecha1_obj, fecha1_obj, None)
+            segundo_resumen = en_cache('totales', calcular_totales, sede2, fecha2_obj, fecha2_obj, None)
+            primer_conteo = primer_resumen['criticidad']
+            segundo_conteo = segundo_resumen['criticidad']
+            primer_total = primer_resumen['vulnerabilidades']
+            segundo_total = segundo_resumen['vulnerabilidades']
 
             # Calcular variación
             variacion = segundo_total - primer_total
@@ -559,107 +533,97 @@ def obtener_tendencias():
 
     logger.debug(f"Filtros recibidos - sede: {sede}, fecha_inicio: {fecha_inicio}, fecha_fin: {fecha_fin}")
 
-    # Construir la consulta SQL base
-    sql_base = """
-        SELECT 
-            e.fecha_escaneo,
-            v.nivel_amenaza,
-            COUNT(*) as total_vulnerabilidades
-        FROM escaneos e
-        JOIN hosts h ON h.escaneo_id = e.id
-        JOIN vulnerabilidades v ON v.host_id = h.id
-        JOIN sedes s ON e.sede_id = s.id
-        WHERE 1=1
-    """
-    params = {}
-
-    # Agregar condiciones según los filtros
-    if sede and sede != 'Todas las sedes':
-        sql_base += " AND s.nombre = :sede"
-        params['sede'] = sede
-    if fecha_inicio:
-        sql_base += " AND e.fecha_escaneo >= :fecha_inicio"
-        params['fecha_inicio'] = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-    if fecha_fin:
-        sql_base += " AND e.fecha_escaneo <= :fecha_fin"
-        params['fecha_fin'] = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-
-    # Agregar agrupación y ordenamiento
-    sql_base += " GROUP BY e.fecha_escaneo, v.nivel_amenaza ORDER BY e.fecha_escaneo, v.nivel_amenaza"
-
-    logger.debug(f"SQL Query: {sql_base}")
-    logger.debug(f"Params: {params}")
-
-    # Ejecutar consulta
-    result = db.session.execute(text(sql_base), params)
-
-    # Procesar resultados
-    tendencias = {}
-    for row in result:
-        fecha = row[0].strftime('%Y-%m-%d')
-        nivel = row[1]
-        total = row[2]
-
-        if fecha not in tendencias:
-            tendencias[fecha] = {
-                'fecha': fecha,
-                'Critical': 0,
-                'High': 0,
-                'Medium': 0,
-                'Low': 0
-            }
-        tendencias[fecha][nivel] = total
+    tendencias = en_cache(
+        'tendencias', tendencias_por_fecha,
+        sede,
+        datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None,
+        datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None
+    )
 
     logger.debug(f"Tendencias calculadas: {tendencias}")
-    return jsonify(list(tendencias.values()))
+    return jsonify(tendencias)
 
 @app.route('/actualizar_estado', methods=['POST'])
 @login_required
 def actualizar_estado():
     data = request.get_json()
-    ip = data.get('ip')
-    oid = data.get('oid')
+    vulnerabilidad_id = data.get('id')
     nuevo_estado = data.get('estado')
 
-    if not all([ip, oid, nuevo_estado]):
+    if not all([vulnerabilidad_id, nuevo_estado]):
         return jsonify({'success': False, 'error': 'Datos incompletos'}), 400
+    if nuevo_estado not in COLUMNAS_ESTADO:
+        return jsonify({'success': False, 'error': f'Estado no válido: {nuevo_estado}'}), 400
 
     try:
-        # Buscar la vulnerabilidad por IP y OID
-        host = Host.query.filter_by(ip=ip).first()
-        if host:
-            vulnerabilidad = Vulnerabilidad.query.filter_by(
-                host_id=host.id,
-                oid=oid
-            ).first()
-
-            if vulnerabilidad:
-                vulnerabilidad.estado = nuevo_estado
-                db.session.commit()
-                log_activity('update_vulnerability_status', f'Actualizó el estado de la vulnerabilidad {oid} a {nuevo_estado}')
-                return jsonify({'success': True})
+        fila = db.session.execute(
+            select(Vulnerabilidad.estado, Vulnerabilidad.severidad, Vulnerabilidad.oid, Host.escaneo_id)
+            .join(Host, Host.id == Vulnerabilidad.host_id)
+            .where(Vulnerabilidad.id == vulnerabilidad_id)
+        ).first()
+        if fila is None:
+            return jsonify({'success': False, 'error': 'Vulnerabilidad no encontrada'}), 404
+
+        # El UPDATE solo aplica si el estado sigue siendo el leído: si otra petición lo
+        # cambió entre medio, no se toca la fila ni el resumen de su escaneo
+        resultado = db.session.execute(
+            update(Vulnerabilidad)
+            .where(Vulnerabilidad.id == vulnerabilidad_id,
+                   Vulnerabilidad.estado.is_not_distinct_from(fila.estado))
+            .values(estado=nuevo_estado)
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount != 1:
+            db.session.rollback()
+            return jsonify({'success': False,
+                            'error': 'El estado de la vulnerabilidad cambió mientras tanto, recargue la lista'}), 409
 
-        return jsonify({'success': False, 'error': 'Vulnerabilidad no encontrada'}), 404
+        ajustar_estado(fila.escaneo_id, fila.severidad, fila.estado, nuevo_estado)
+        incrementar_version()
+        db.session.commit()
+        log_activity('update_vulnerability_status', f'Actualizó el estado de la vulnerabilidad {fila.oid} a {nuevo_estado}')
+        return jsonify({'success': True})
 
     except Exception as e:
+        db.session.rollback()
         logger.error(f"Error al actualizar estado: {str(e)}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/eliminar_escaneo/<int:escaneo_id>', methods=['POST'])
 @login_required
 def eliminar_escaneo(escaneo_id):
-    """Elimina un escaneo y sus datos relacionados"""
+    """
+    Elimina un escaneo y sus datos relacionados con DELETEs por conjunto, sin
+    cargar hosts ni vulnerabilidades. Los escaneos grandes se eliminan por lotes
+    en la cola de trabajos.
+    """
     try:
         escaneo = Escaneo.query.get_or_404(escaneo_id)
         sede_nombre = escaneo.sede.nombre
         fecha = escaneo.fecha_escaneo.strftime('%Y-%m-%d')
+        archivo = escaneo.archivo
+
+        if buscar_eliminacion_en_curso(escaneo.id):
+            flash(f'La eliminación del escaneo de {sede_nombre} del {fecha} ya está en curso', 'warning')
+            return redirect(url_for('configuracion'))
+
+        # La eliminación por lotes borra primero el resumen: un escaneo sin resumen es una
+        # eliminación interrumpida de un escaneo grande y se retoma en la cola, no aquí
+        if escaneo.resumen is None or escaneo.resumen.vulnerabilidades > ELIMINACION_UMBRAL:
+            trabajo = encolar_eliminacion(escaneo, current_user.id)
+            log_activity('delete_scan', f'Programó la eliminación del escaneo {escaneo_id} de la sede {sede_nombre}')
+            flash(f'El escaneo de {sede_nombre} del {fecha} se eliminará en segundo plano (trabajo {trabajo.id})', 'info')
+            return redirect(url_for('configuracion'))
 
-        db.session.delete(escaneo)
+        eliminar_escaneos([escaneo.id])
+        incrementar_version()
         db.session.commit()
+        eliminar_archivo(archivo)
         log_activity('delete_scan', f'Eliminó el escaneo {escaneo_id} de la sede {sede_nombre}')
         flash(f'Escaneo de {sede_nombre} del {fecha} eliminado exitosamente', 'success')
     except Exception as e:
         logger.error(f"Error al eliminar escaneo: {str(e)}", exc_info=True)
+        db.session.rollback()
         flash('Error al eliminar el escaneo', 'error')
 
     return redirect(url_for('configuracion'))
@@ -673,27 +637,17 @@ def informes():
     fecha_fin = request.args.get('fecha_fin')
     riesgo = request.args.get('riesgo')
 
-    # Query base para obtener estadísticas
-    query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
-
-    # Aplicar filtros
-    if sede:
-        query = query.filter(Sede.nombre == sede)
-    if fecha_inicio:
-        query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-    if fecha_fin:
-        query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
-
-    # Obtener todas las vulnerabilidades que cumplen los filtros
-    vulnerabilidades = query.all()
+    # Estadísticas agregadas en la base de datos
+    totales = en_cache(
+        'totales', calcular_totales,
+        sede,
+        datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None,
+        datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None,
+        riesgo
+    )
 
     # Contar por criticidad
-    criticidad = {
-        'Critical': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Critical']),
-        'High': len([v for v in vulnerabilidades if v.nivel_amenaza == 'High']),
-        'Medium': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Medium']),
-        'Low': len([v for v in vulnerabilidades if v.nivel_amenaza == 'Low'])
-    }
+    criticidad = totales['criticidad']
 
     return render_template('informes.html',
                          criticidad=list(criticidad.values()),
@@ -702,6 +656,11 @@ def informes():
                          fecha_inicio=fecha_inicio,
                          fecha_fin=fecha_fin)
 
+def respuesta_csv(bloques, nombre_archivo):
+    """Respuesta que envía el CSV a medida que se genera, con el contexto de la petición abierto"""
+    return Response(stream_with_context(bloques), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nombre_archivo}'})
+
 @app.route('/generar_informe/<tipo>/<formato>')
 @login_required
 def generar_informe(tipo, formato):
@@ -728,26 +687,34 @@ def generar_informe(tipo, formato):
             flash('Formato de informe no válido', 'error')
             return redirect(url_for('informes'))
 
-        # Obtener datos filtrados
-        resultados = filtrar_resultados(sede, fecha_inicio, fecha_fin, riesgo)
-        logger.debug(f"Resultados obtenidos: {len(resultados)} registros")
-
-        if not resultados:
-            flash('No hay datos disponibles para generar el informe. Por favor, seleccione otros filtros.', 'warning')
-            return redirect(url_for('informes'))
-
-        # Preparar datos para el informe
+        fecha_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None
+        fecha_fin_obj = datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None
         datos_informe = {
             'sede': sede,
             'fecha_inicio': fecha_inicio,
-            'fecha_fin': fecha_fin,
-            'hosts_detalle': {}
+            'fecha_fin': fecha_fin
         }
 
-        for resultado in resultados:
-            datos_informe['hosts_detalle'].update(resultado['hosts_detalle'])
+        # Obtener datos filtrados, leyendo las filas con un cursor del servidor
+        if tipo == 'ejecutivo':
+            ips = set()
+            niveles = {nivel: 0 for nivel in COLUMNAS_NIVEL}
+            for fila in iterar_filas(consulta_hosts(sede, fecha_inicio_obj, fecha_fin_obj, riesgo)):
+                ips.add(fila.ip)
+                for nivel, columna in COLUMNAS_NIVEL.items():
+                    niveles[nivel] += getattr(fila, columna)
+            datos_informe.update(total_hosts=len(ips), niveles=niveles)
+            hay_datos = bool(ips)
+            logger.debug(f"Datos preparados: {len(ips)} hosts")
+        else:
+            filas = iterar_filas(consulta_vulnerabilidades(sede, fecha_inicio_obj, fecha_fin_obj, riesgo))
+            primera = next(filas, None)
+            hay_datos = primera is not None
+            datos_informe['vulnerabilidades'] = chain([primera], filas) if hay_datos else []
 
-        logger.debug(f"Datos preparados: {len(datos_informe['hosts_detalle'])} hosts")
+        if not hay_datos:
+            flash('No hay datos disponibles para generar el informe. Por favor, seleccione otros filtros.', 'warning')
+            return redirect(url_for('informes'))
 
         # Generar el informe según el tipo y formato
         try:
@@ -768,6 +735,8 @@ def generar_informe(tipo, formato):
                 return redirect(url_for('informes'))
 
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            if tipo == 'tecnico' and formato == 'csv':
+                return respuesta_csv(output, f'informe_{tipo}_{timestamp}.csv')
             return send_file(
                 output,
                 mimetype='application/pdf' if formato == 'pdf' else 'text/csv',
@@ -810,36 +779,33 @@ def exportar(tipo, formato):
             flash('Formato de exportación no válido', 'error')
             return redirect(url_for('dashboard'))
 
-        # Obtener datos filtrados
+        fecha_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else None
+        fecha_fin_obj = datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else None
+
+        # Obtener datos filtrados como filas planas, leídas con un cursor del servidor
         if tipo == 'hosts':
-            resultados = filtrar_resultados(sede, fecha_inicio, fecha_fin, riesgo)
-            if not resultados:
-                flash('No hay datos disponibles para exportar', 'warning')
-                return redirect(url_for('hosts'))
-            if formato == 'csv':
-                return exportar_a_csv(resultados, tipo_reporte='hosts')
-            else:  # pdf
-                return exportar_a_pdf(resultados, tipo_reporte='hosts')
+            consulta = consulta_hosts(sede, fecha_inicio_obj, fecha_fin_obj, riesgo)
         else:  # vulnerabilidades
-            query = Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
-            if sede and sede != 'Todas las sedes':
-                query = query.filter(Sede.nombre == sede)
-            if fecha_inicio:
-                query = query.filter(Escaneo.fecha_escaneo >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-            if fecha_fin:
-                query = query.filter(Escaneo.fecha_escaneo <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
-            if riesgo and riesgo != 'all':
-                query = query.filter(Vulnerabilidad.nivel_amenaza == riesgo)
-
-            vulnerabilidades = query.all()
-            if not vulnerabilidades:
-                flash('No hay datos disponibles para exportar', 'warning')
-                return redirect(url_for('vulnerabilidades'))
-
-            if formato == 'csv':
-                return exportar_a_csv(vulnerabilidades, tipo_reporte='vulnerabilidades')
-            else:  # pdf
-                return exportar_a_pdf(vulnerabilidades, tipo_reporte='vulnerabilidades')
+            consulta = consulta_vulnerabilidades(sede, fecha_inicio_obj, fecha_fin_obj, riesgo,
+                                                 request.args.get('estado'),
+                                                 request.args.get('cvss_min', type=float),
+                                                 detalle=formato == 'csv')
+        filas = iterar_filas(consulta)
+        primera = next(filas, None)
+        if primera is None:
+            flash('No hay datos disponibles para exportar', 'warning')
+            return redirect(url_for(tipo))
+        filas = chain([primera], filas)
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if formato == 'csv':
+            return respuesta_csv(exportar_a_csv(filas, tipo_reporte=tipo), f'{tipo}_{timestamp}.csv')
+        return send_file(
+            exportar_a_pdf(filas, tipo_reporte=tipo),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f'{tipo}_{timestamp}.pdf'
+        )
 
     except Exception as e:
         logger.error(f"Error al exportar datos: {str(e)}")
@@ -909,6 +875,8 @@ def editar_sede(sede_id):
         sede.nombre = nombre
         sede.descripcion = descripcion
         sede.activa = activa
+        # El nombre y el estado de la sede forman parte de los resultados en caché
+        incrementar_version()
 
         db.session.commit()
         log_activity('update_sede', f'Actualizó la sede {nombre}')
@@ -928,14 +896,18 @@ def eliminar_sede(sede_id):
     try:
         sede = Sede.query.get_or_404(sede_id)
 
-        # Verificar si tiene escaneos
-        if sede.escaneos:
+        # Verificar si tiene escaneos (EXISTS, sin cargar la lista de escaneos)
+        if db.session.query(Escaneo.query.filter_by(sede_id=sede.id).exists()).scalar():
             flash('No se puede eliminar la sede porque tiene escaneos asociados', 'error')
             return redirect(url_for('configuracion'))
 
-        db.session.delete(sede)
+        nombre = sede.nombre
+        # Sus trabajos se borran explícitamente además del ON DELETE CASCADE (SQLite no lo aplica)
+        db.session.execute(delete(TrabajoIngesta).where(TrabajoIngesta.sede_id == sede.id))
+        db.session.execute(delete(Sede).where(Sede.id == sede.id))
+        incrementar_version()
         db.session.commit()
-        log_activity('delete_sede', f'Eliminó la sede {sede.nombre}')
+        log_activity('delete_sede', f'Eliminó la sede {nombre}')
         flash('Sede eliminada exitosamente', 'success')
 
     except Exception as e:
@@ -964,6 +936,7 @@ def subir_reporte():
         archivo = request.files['archivo']
         sede_id = request.form.get('sede_id')  # Cambiado de 'sede' a 'sede_id'
         fecha_escaneo = request.form.get('fecha_escaneo')
+        reemplazar = request.form.get('reemplazar') == '1'
 
         logger.debug(f"Sede ID: {sede_id}, Fecha escaneo: {fecha_escaneo}")
         logger.debug(f"Nombre del archivo: {archivo.filename}")
@@ -980,92 +953,58 @@ def subir_reporte():
 
         if not allowed_file(archivo.filename):
             logger.error(f"Tipo de archivo no permitido: {archivo.filename}")
-            flash('Tipo de archivo no permitido. Solo se permiten archivos .txt', 'error')
+            flash('Tipo de archivo no permitido. Solo se permiten archivos .txt, .xml, .csv o .nessus (opcionalmente comprimidos en .gz, .zip o .xz)', 'error')
             return redirect(url_for('configuracion'))
 
         try:
+            filepath = None
             filename = secure_filename(archivo.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            archivo.save(filepath)
-            logger.debug(f"Archivo guardado en: {filepath}")
-
-            # Procesar el reporte
-            logger.debug("Iniciando análisis de vulnerabilidades")
-            resultados = analizar_vulnerabilidades(filepath)
-            logger.debug(f"Resultados del análisis: {resultados is not None}")
-
-            if not resultados:
-                logger.error("No se encontraron resultados al analizar el archivo")
-                flash('No se encontraron vulnerabilidades en el archivo', 'warning')
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+            # RequestSubida ya recibió el archivo en memoria o en un temporal único, con su hash
+            subida = archivo.stream
+            hash_contenido = subida.hash
+            logger.debug(f"Archivo recibido: {subida.tamano} bytes "
+                         f"{'en memoria' if subida.en_memoria else 'en ' + subida.ruta} (sha256 {hash_contenido})")
+
+            # Un archivo idéntico ya cargado para la sede no se vuelve a analizar ni se guarda
+            duplicado = buscar_duplicado(sede_id, hash_contenido)
+            en_curso = buscar_trabajo_en_curso(sede_id, hash_contenido)
+            if (duplicado and not reemplazar) or en_curso:
+                if en_curso:
+                    mensaje = f'Este reporte ya se está procesando para la sede (trabajo #{en_curso.id})'
+                else:
+                    mensaje = (f'Este reporte ya fue cargado para la sede en el escaneo del '
+                               f'{duplicado.fecha_escaneo.strftime("%Y-%m-%d")}. '
+                               'Marque "Reemplazar escaneo existente" para volver a cargarlo.')
+                logger.info(f"Reporte duplicado descartado: {filename} (sha256 {hash_contenido})")
+                flash(mensaje, 'warning')
+                if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                    return jsonify({'success': False, 'error': mensaje}), 409
                 return redirect(url_for('configuracion'))
 
-            try:
-                # Crear el escaneo
-                escaneo = Escaneo(
-                    sede_id=sede_id,
-                    fecha_escaneo=datetime.strptime(fecha_escaneo, '%Y-%m-%d').date()
-                )
-                db.session.add(escaneo)
-                db.session.flush()
-                logger.debug(f"Escaneo creado con ID: {escaneo.id}")
-
-                # Procesar cada host y sus vulnerabilidades
-                total_hosts = 0
-                total_vulns = 0
-                for ip, host_data in resultados['hosts_detalle'].items():
-                    logger.debug(f"Procesando host: {ip}")
-                    host = Host(
-                        ip=ip,
-                        nombre_host=host_data.get('nombre_host', ''),
-                        escaneo_id=escaneo.id
-                    )
-                    db.session.add(host)
-                    db.session.flush()
-                    total_hosts += 1
-
-                    for vuln_data in host_data.get('vulnerabilidades', []):
-                        vulnerabilidad = Vulnerabilidad(
-                            host_id=host.id,
-                            nvt=vuln_data.get('nvt', ''),
-                            oid=vuln_data.get('oid', ''),
-                            nivel_amenaza=vuln_data.get('nivel_amenaza', ''),
-                            cvss=vuln_data.get('cvss', ''),
-                            puerto=vuln_data.get('puerto', ''),
-                            resumen=vuln_data.get('resumen', ''),
-                            impacto=vuln_data.get('impacto', ''),
-                            solucion=vuln_data.get('solucion', ''),
-                            metodo_deteccion=vuln_data.get('metodo_deteccion', ''),
-                            referencias=vuln_data.get('referencias', []),
-                            estado='ACTIVA'
-                        )
-                        db.session.add(vulnerabilidad)
-                        total_vulns += 1
-
-                db.session.commit()
-                logger.info(f"Datos guardados exitosamente: {total_hosts} hosts, {total_vulns} vulnerabilidades")
-                log_activity('upload_report', f'Subió reporte para sede ID {sede_id}: {total_hosts} hosts, {total_vulns} vulnerabilidades')
-                flash('Reporte procesado exitosamente', 'success')
-
-            except Exception as db_error:
-                logger.error(f"Error al guardar en la base de datos: {str(db_error)}", exc_info=True)
-                db.session.rollback()
-                flash('Error al guardar los datos en la base de datos', 'error')
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                return redirect(url_for('configuracion'))
-
-            # Limpiar el archivo temporal
-            if os.path.exists(filepath):
-                os.remove(filepath)
-                logger.debug("Archivo temporal eliminado")
+            # El archivo queda en disco hasta que lo procese la cola
+            filepath = subida.persistir()
+            trabajo = encolar_trabajo(
+                sede_id=sede_id,
+                fecha_escaneo=datetime.strptime(fecha_escaneo, '%Y-%m-%d').date(),
+                archivo=filepath,
+                nombre_archivo=filename,
+                user_id=current_user.id,
+                hash_contenido=hash_contenido,
+                reemplazar=reemplazar
+            )
+            log_activity('queue_report', f'Encoló el reporte {filename} para sede ID {sede_id} (trabajo {trabajo.id})'
+                         + (' reemplazando el escaneo existente' if reemplazar else ''))
+            flash(f'Reporte recibido. Se está procesando en segundo plano (trabajo #{trabajo.id})', 'info')
 
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return jsonify({'success': True, 'trabajo_id': trabajo.id,
+                                'url': url_for('estado_trabajo', trabajo_id=trabajo.id)}), 202
             return redirect(url_for('configuracion'))
 
         except Exception as file_error:
-            logger.error(f"Error al procesar el archivo: {str(file_error)}", exc_info=True)
-            if os.path.exists(filepath):
+            logger.error(f"Error al encolar el archivo: {str(file_error)}", exc_info=True)
+            db.session.rollback()
+            if filepath and os.path.exists(filepath):
                 os.remove(filepath)
             flash('Error al procesar el archivo', 'error')
             return redirect(url_for('configuracion'))
@@ -1075,6 +1014,15 @@ def subir_reporte():
         flash('Error al procesar el reporte', 'error')
         return redirect(url_for('configuracion'))
 
+@app.route('/jobs/<int:trabajo_id>')
+@login_required
+def estado_trabajo(trabajo_id):
+    """Estado de un trabajo de carga de reporte, consultado periódicamente desde configuración"""
+    trabajo = db.session.get(TrabajoIngesta, trabajo_id)
+    if not trabajo:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify(trabajo_a_dict(trabajo))
+
 @app.route('/toggle_sede/<int:sede_id>', methods=['POST'])
 @login_required
 def toggle_sede(sede_id):
@@ -1082,6 +1030,7 @@ def toggle_sede(sede_id):
     try:
         sede = Sede.query.get_or_404(sede_id)
         sede.activa = not sede.activa
+        incrementar_version()
         db.session.commit()
         log_activity('toggle_sede', f'Cambió el estado de la sede {sede.nombre} a {"Activa" if sede.activa else "Inactiva"}')
         flash(f'Sede {sede.nombre} {"activada" if sede.activa else "desactivada"} exitosamente', 'success')
@@ -1206,20 +1155,23 @@ def eliminar_usuario(user_id):
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-ALLOWED_EXTENSIONS = {'txt'}
+ALLOWED_EXTENSIONS = {'txt', 'xml', 'csv', 'nessus'} | EXTENSIONES_COMPRIMIDAS
 UPLOAD_FOLDER = '/tmp'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limitar subidas a 16MB
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limitar subidas a 16MB (tamaño comprimido)
 
-def analizar_vulnerabilidades(filepath):
-    """Analiza el archivo de reporte de vulnerabilidades"""
-    try:
-        from parser import analizar_vulnerabilidades as parser_analizar
-        return parser_analizar(filepath)
-    except Exception as e:
-        logger.error(f"Error al analizar vulnerabilidades: {str(e)}")
-        raise
+# La caché se prepara al iniciar: un CACHE_BACKEND inválido o un CACHE_DIR ajeno impiden arrancar
+obtener_backend()
+
+@app.teardown_request
+def limpiar_subidas(error=None):
+    """Borra los archivos subidos que la petición no dejó en la cola"""
+    descartar_subidas(request)
 
+@app.before_request
+def arrancar_cola_trabajos():
+    """Arranca los hilos de la cola de reportes en el primer request de cada proceso"""
+    iniciar_trabajadores(app)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
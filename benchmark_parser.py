@@ -0,0 +1,170 @@
+"""
+Benchmark del parser de reportes OpenVAS TXT.
+
+Genera reportes sintéticos deterministas (generador_reportes.py) y mide el
+rendimiento de parser.analizar_vulnerabilidades y parser.extraer_vulnerabilidad:
+issues por segundo, MB por segundo y memoria pico. Los resultados se guardan
+en JSON para comparar ejecuciones.
+
+Uso:
+    python benchmark_parser.py --hosts 10 1000 50000 --salida bench.json
+    python benchmark_parser.py --hosts 1000 --salida nuevo.json --comparar bench.json
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+import parser
+from generador_reportes import generar_issue, generar_reporte
+
+MB = 1024 * 1024
+
+def _medir(funcion: Callable, repeticiones: int, memoria: bool) -> Tuple[float, float, object]:
+    """
+    Ejecuta `funcion` `repeticiones` veces y retorna el mejor tiempo en
+    segundos, la memoria pico en MB (medida en una ejecución aparte con
+    tracemalloc, que agrega sobrecarga) y el último resultado.
+    """
+    mejor = float('inf')
+    resultado = None
+    for _ in range(repeticiones):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+
+    pico = None
+    if memoria:
+        gc.collect()
+        tracemalloc.start()
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1] / MB
+        tracemalloc.stop()
+    return mejor, pico, resultado
+
+def _registro(funcion: str, modo: str, hosts: int, issues: int, bytes_: int,
+              segundos: float, pico_mb) -> Dict:
+    return {
+        'funcion': funcion,
+        'modo': modo,
+        'hosts': hosts,
+        'issues': issues,
+        'bytes': bytes_,
+        'segundos': round(segundos, 4),
+        'issues_por_segundo': round(issues / segundos, 1) if segundos else None,
+        'mb_por_segundo': round(bytes_ / MB / segundos, 2) if segundos else None,
+        'memoria_pico_mb': round(pico_mb, 2) if pico_mb is not None else None,
+    }
+
+def preparar_reporte(directorio: str, hosts: int, issues_min: int, issues_max: int, semilla: int) -> Dict:
+    """Genera el reporte sintético o reutiliza uno ya generado con los mismos parámetros"""
+    ruta = os.path.join(directorio, f'openvas_{hosts}h_{issues_min}-{issues_max}_s{semilla}.txt')
+    ruta_stats = ruta + '.json'
+    if os.path.exists(ruta) and os.path.exists(ruta_stats):
+        with open(ruta_stats, encoding='utf-8') as f:
+            stats = json.load(f)
+    else:
+        print(f"Generando reporte sintético de {hosts} hosts...")
+        stats = generar_reporte(ruta, hosts, issues_min, issues_max, semilla)
+        with open(ruta_stats, 'w', encoding='utf-8') as f:
+            json.dump(stats, f)
+    stats['ruta'] = ruta
+    return stats
+
+def benchmark_analizar(reporte: Dict, modo: str, workers: int, repeticiones: int, memoria: bool) -> Dict:
+    """Mide analizar_vulnerabilidades sobre un reporte completo"""
+    streaming = modo != 'completo'
+    segundos, pico, resultado = _medir(
+        lambda: parser.analizar_vulnerabilidades(reporte['ruta'], streaming=streaming, workers=workers),
+        repeticiones, memoria and workers <= 1)
+    issues = sum(len(h['vulnerabilidades']) for h in resultado['hosts_detalle'].values()) if resultado else 0
+    if issues != reporte['issues']:
+        print(f"⚠️  Se esperaban {reporte['issues']} issues y el parser retornó {issues}")
+    return _registro('analizar_vulnerabilidades', modo, reporte['hosts'], issues, reporte['bytes'], segundos, pico)
+
+def benchmark_extraer(cantidad: int, semilla: int, repeticiones: int, memoria: bool) -> Dict:
+    """Mide extraer_vulnerabilidad sobre textos de issues ya separados"""
+    r = random.Random(semilla)
+    textos = ['\n'.join(generar_issue(r, '10.0.0.1')[2:]) for _ in range(cantidad)]
+    bytes_ = sum(len(t.encode('utf-8')) for t in textos)
+    segundos, pico, _ = _medir(lambda: [parser.extraer_vulnerabilidad(t) for t in textos], repeticiones, memoria)
+    return _registro('extraer_vulnerabilidad', 'texto', 0, cantidad, bytes_, segundos, pico)
+
+def comparar(actual: List[Dict], anterior_path: str) -> None:
+    """Imprime la variación de throughput respecto de una ejecución anterior"""
+    with open(anterior_path, encoding='utf-8') as f:
+        anterior = {(r['funcion'], r['modo'], r['hosts']): r for r in json.load(f)['resultados']}
+
+    print(f"\nComparación con {anterior_path}:")
+    for r in actual:
+        base = anterior.get((r['funcion'], r['modo'], r['hosts']))
+        if not base or not base['issues_por_segundo'] or not r['issues_por_segundo']:
+            continue
+        variacion = (r['issues_por_segundo'] / base['issues_por_segundo'] - 1) * 100
+        print(f"  {r['funcion']:<26} {r['modo']:<10} {r['hosts']:>7} hosts: "
+              f"{base['issues_por_segundo']:>10.0f} -> {r['issues_por_segundo']:>10.0f} issues/s ({variacion:+.1f}%)")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark del parser de reportes OpenVAS')
+    arg_parser.add_argument('--hosts', type=int, nargs='+', default=[10, 1000, 50000],
+                            help='Tamaños de reporte a medir (cantidad de hosts)')
+    arg_parser.add_argument('--issues-min', type=int, default=1, help='Mínimo de issues por host')
+    arg_parser.add_argument('--issues-max', type=int, default=5, help='Máximo de issues por host')
+    arg_parser.add_argument('--semilla', type=int, default=1234, help='Semilla del generador')
+    arg_parser.add_argument('--modos', nargs='+', default=['streaming'], choices=['streaming', 'completo'],
+                            help='Modos de analizar_vulnerabilidades a medir')
+    arg_parser.add_argument('--workers', type=int, default=1, help='Procesos para el análisis en paralelo')
+    arg_parser.add_argument('--repeticiones', type=int, default=3, help='Repeticiones por medición (se toma la mejor)')
+    arg_parser.add_argument('--issues-extraer', type=int, default=5000,
+                            help='Issues para medir extraer_vulnerabilidad')
+    arg_parser.add_argument('--sin-memoria', action='store_true', help='No medir la memoria pico')
+    arg_parser.add_argument('--directorio', default=os.path.join(tempfile.gettempdir(), 'sectracker_bench'),
+                            help='Directorio para los reportes generados')
+    arg_parser.add_argument('--salida', default='bench_resultados.json', help='Archivo JSON de resultados')
+    arg_parser.add_argument('--comparar', help='JSON de una ejecución anterior para comparar')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(args.directorio, exist_ok=True)
+    memoria = not args.sin_memoria
+
+    resultados = []
+    for hosts in args.hosts:
+        reporte = preparar_reporte(args.directorio, hosts, args.issues_min, args.issues_max, args.semilla)
+        for modo in args.modos:
+            registro = benchmark_analizar(reporte, modo, args.workers, args.repeticiones, memoria)
+            resultados.append(registro)
+            print(f"analizar_vulnerabilidades [{modo}] {hosts} hosts: {registro['issues_por_segundo']} issues/s, "
+                  f"{registro['mb_por_segundo']} MB/s, pico {registro['memoria_pico_mb']} MB")
+
+    registro = benchmark_extraer(args.issues_extraer, args.semilla, args.repeticiones, memoria)
+    resultados.append(registro)
+    print(f"extraer_vulnerabilidad: {registro['issues_por_segundo']} issues/s, "
+          f"{registro['mb_por_segundo']} MB/s, pico {registro['memoria_pico_mb']} MB")
+
+    salida = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'comparar')},
+        'resultados': resultados,
+    }
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(salida, f, indent=2, ensure_ascii=False)
+    print(f"✅ Resultados guardados en {args.salida}")
+
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""
+Caché de resultados agregados (dashboard, informes, tendencias y sedes).
+
+Los datos solo cambian al guardar o eliminar escaneos, al cambiar el estado de
+una vulnerabilidad o al modificar una sede. Cada uno de esos cambios sube el
+contador de version_datos justo antes de su commit (incrementar_version), y la
+versión forma parte de la clave de cada resultado: tras un cambio las claves
+anteriores dejan de usarse y el backend las descarta al llenarse.
+
+El backend se elige con CACHE_BACKEND:
+    archivo     un archivo por resultado en CACHE_DIR, compartido por los
+                procesos de gunicorn de la misma máquina (por defecto)
+    base_datos  tabla cache_resultados, compartida por todos los servidores
+    memoria     dentro de cada proceso (desarrollo)
+    ninguno     sin caché
+Todos guardan como máximo CACHE_MAX_ENTRADAS resultados y descartan los usados
+hace más tiempo. Un backend nuevo hereda de BackendCache y se agrega a BACKENDS.
+
+Los resultados se guardan como JSON: leer de la caché nunca ejecuta código,
+aunque alguien más pueda escribir en el directorio o en la tabla. CACHE_DIR
+debe pertenecer al usuario de la aplicación; se crea con permisos 0700 y la
+aplicación no arranca si es de otro usuario o un enlace simbólico.
+"""
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update
+
+from database import db
+from models import CacheResultado, VersionDatos
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'archivo')
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+CACHE_MAX_ENTRADAS = int(os.environ.get('CACHE_MAX_ENTRADAS', 500))
+# El backend base_datos actualiza la fecha de acceso como mucho una vez por este intervalo
+ACCESO_INTERVALO = timedelta(seconds=60)
+
+def version_datos() -> Tuple:
+    """
+    Versión actual de los datos: el contador y la fecha del último cambio. La
+    fecha distingue una base nueva o restaurada de un respaldo, donde el
+    contador puede repetir un valor que ya está en la caché.
+    """
+    fila = db.session.execute(select(VersionDatos.version, VersionDatos.fecha_actualizacion)
+                              .where(VersionDatos.id == 1)).first()
+    return tuple(fila) if fila else (0, None)
+
+def incrementar_version() -> None:
+    """
+    Invalida los resultados en caché. No hace commit: va en la transacción del
+    cambio, como última sentencia antes del commit, para que el bloqueo de la
+    única fila de version_datos dure solo lo que dura el commit
+    """
+    db.session.execute(update(VersionDatos).where(VersionDatos.id == 1)
+                       .values(version=VersionDatos.version + 1, fecha_actualizacion=datetime.utcnow()))
+
+def _a_json(valor: Any):
+    # Las sumas de columnas numéricas llegan como Decimal en PostgreSQL
+    if isinstance(valor, Decimal):
+        return float(valor)
+    raise TypeError(f"Tipo no admitido en la caché: {type(valor).__name__}")
+
+def serializar(resultado: Any) -> bytes:
+    return json.dumps(resultado, default=_a_json, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def deserializar(valor: bytes) -> Any:
+    return json.loads(valor.decode('utf-8'))
+
+def preparar_directorio(directorio: str) -> None:
+    """
+    Crea el directorio de la caché con permisos 0700, o verifica uno existente:
+    debe ser un directorio (no un enlace) del usuario de la aplicación. Si el
+    grupo u otros usuarios tienen permisos sobre él, se le quitan.
+    """
+    os.makedirs(directorio, mode=0o700, exist_ok=True)
+    estado = os.lstat(directorio)
+    if not stat.S_ISDIR(estado.st_mode):
+        raise PermissionError(f"CACHE_DIR debe ser un directorio, no un archivo ni un enlace simbólico: {directorio}")
+    if estado.st_uid != os.getuid():
+        raise PermissionError(f"CACHE_DIR {directorio} pertenece a otro usuario (uid {estado.st_uid}); "
+                              "use un directorio propio de la aplicación")
+    if stat.S_IMODE(estado.st_mode) & 0o077:
+        os.chmod(directorio, 0o700)
+        logger.warning(f"Permisos de CACHE_DIR {directorio} restringidos a 0700")
+
+class BackendCache:
+    """Almacén de resultados serializados por clave, limitado a max_entradas"""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+
+    def obtener(self, clave: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def guardar(self, clave: str, valor: bytes) -> None:
+        raise NotImplementedError
+
+class CacheMemoria(BackendCache):
+    """LRU en memoria del proceso; cada proceso de gunicorn tiene la suya"""
+
+    def __init__(self, max_entradas: int):
+        super().__init__(max_entradas)
+        self._entradas = OrderedDict()
+        self._bloqueo = threading.Lock()
+
+    def obtener(self, clave: str) -> Optional[bytes]:
+        with self._bloqueo:
+            if clave not in self._entradas:
+                return None
+            self._entradas.move_to_end(clave)
+            return self._entradas[clave]
+
+    def guardar(self, clave: str, valor: bytes) -> None:
+        with self._bloqueo:
+            self._entradas[clave] = valor
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+class CacheArchivos(BackendCache):
+    """
+    Un archivo por clave en un directorio compartido. La fecha de modificación
+    marca el último acceso; al pasar de max_entradas se borran los más antiguos.
+    """
+
+    def __init__(self, max_entradas: int, directorio: str = CACHE_DIR):
+        super().__init__(max_entradas)
+        self.directorio = directorio
+        preparar_directorio(directorio)
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, f'{clave}.json')
+
+    def obtener(self, clave: str) -> Optional[bytes]:
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                valor = f.read()
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return valor
+
+    def guardar(self, clave: str, valor: bytes) -> None:
+        # Se escribe a un temporal propio y se renombra: otro proceso nunca lee un archivo a medias
+        descriptor, temporal = tempfile.mkstemp(dir=self.directorio, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                f.write(valor)
+            os.replace(temporal, self._ruta(clave))
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        self._descartar()
+
+    def _descartar(self) -> None:
+        entradas = []
+        for entrada in os.scandir(self.directorio):
+            if entrada.name.endswith('.json'):
+                try:
+                    entradas.append((entrada.stat().st_mtime, entrada.path))
+                except FileNotFoundError:
+                    pass
+        if len(entradas) <= self.max_entradas:
+            return
+        entradas.sort()
+        for _, ruta in entradas[:len(entradas) - self.max_entradas]:
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+class CacheBaseDatos(BackendCache):
+    """
+    Tabla cache_resultados, en una conexión propia para no mezclarse con la
+    transacción de la petición.
+    """
+
+    def obtener(self, clave: str) -> Optional[bytes]:
+        with db.engine.begin() as conexion:
+            fila = conexion.execute(select(CacheResultado.valor, CacheResultado.fecha_acceso)
+                                    .where(CacheResultado.clave == clave)).first()
+            if fila is None:
+                return None
+            ahora = datetime.utcnow()
+            if fila.fecha_acceso is None or ahora - fila.fecha_acceso > ACCESO_INTERVALO:
+                conexion.execute(update(CacheResultado).where(CacheResultado.clave == clave)
+                                 .values(fecha_acceso=ahora))
+            return fila.valor
+
+    def guardar(self, clave: str, valor: bytes) -> None:
+        with db.engine.begin() as conexion:
+            conexion.execute(delete(CacheResultado).where(CacheResultado.clave == clave))
+            conexion.execute(insert(CacheResultado).values(clave=clave, valor=valor,
+                                                           fecha_acceso=datetime.utcnow()))
+            recientes = select(CacheResultado.clave)\
+                .order_by(CacheResultado.fecha_acceso.desc())\
+                .limit(self.max_entradas)
+            conexion.execute(delete(CacheResultado).where(CacheResultado.clave.notin_(recientes)))
+
+BACKENDS = {
+    'archivo': CacheArchivos,
+    'base_datos': CacheBaseDatos,
+    'memoria': CacheMemoria,
+}
+
+_backend = None
+_bloqueo = threading.Lock()
+
+def obtener_backend() -> Optional[BackendCache]:
+    """
+    Backend configurado en CACHE_BACKEND, creado la primera vez; None sin caché.
+    La aplicación lo crea al iniciar, así que una configuración inválida o un
+    CACHE_DIR inseguro impiden arrancar.
+    """
+    global _backend
+    if CACHE_BACKEND == 'ninguno':
+        return None
+    with _bloqueo:
+        if _backend is None:
+            if CACHE_BACKEND not in BACKENDS:
+                raise ValueError(f"CACHE_BACKEND desconocido: {CACHE_BACKEND} "
+                                 f"(opciones: {', '.join(BACKENDS)}, ninguno)")
+            _backend = BACKENDS[CACHE_BACKEND](CACHE_MAX_ENTRADAS)
+        return _backend
+
+def en_cache(nombre: str, funcion: Callable, *argumentos):
+    """
+    Retorna funcion(*argumentos) desde la caché si ya se calculó con los mismos
+    argumentos y la misma versión de los datos; si no, lo calcula y lo guarda.
+    La versión se lee antes de calcular, así que un resultado nunca queda bajo
+    una versión más nueva que la de sus datos. Un error de la caché no impide
+    responder: se registra y se calcula directamente.
+    """
+    backend = obtener_backend()
+    if backend is None:
+        return funcion(*argumentos)
+
+    clave = hashlib.sha256(repr((nombre, version_datos(), argumentos)).encode()).hexdigest()
+    try:
+        valor = backend.obtener(clave)
+        if valor is not None:
+            return deserializar(valor)
+    except Exception as e:
+        logger.warning(f"No se pudo leer la caché de {nombre}: {str(e)}")
+
+    resultado = funcion(*argumentos)
+    try:
+        backend.guardar(clave, serializar(resultado))
+    except Exception as e:
+        logger.warning(f"No se pudo guardar en la caché el resultado de {nombre}: {str(e)}")
+    return resultado
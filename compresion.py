@@ -0,0 +1,108 @@
+import gzip
+import io
+import logging
+import lzma
+import os
+import zipfile
+import zlib
+from typing import BinaryIO, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Límite de bytes descomprimidos por reporte, para cortar bombas de compresión.
+# El tamaño del archivo comprimido lo limita MAX_CONTENT_LENGTH en app.py
+REPORTE_MAX_DESCOMPRIMIDO = int(os.environ.get('REPORTE_MAX_DESCOMPRIMIDO', 1024 * 1024 * 1024))
+
+EXTENSIONES_COMPRIMIDAS = {'gz', 'zip', 'xz'}
+
+FIRMA_GZIP = b'\x1f\x8b'
+FIRMA_XZ = b'\xfd7zXZ\x00'
+FIRMA_ZIP = b'PK\x03\x04'
+
+class ErrorReporteComprimido(ValueError):
+    """El reporte comprimido está dañado, no es válido o excede el límite descomprimido"""
+
+class _LectorLimitado(io.RawIOBase):
+    """Flujo de lectura que corta al superar `limite` bytes descomprimidos"""
+
+    def __init__(self, stream: BinaryIO, limite: int, cerrar: Optional[List] = None):
+        self._stream = stream
+        self._limite = limite
+        self._leidos = 0
+        self._cerrar = cerrar or [stream]
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        try:
+            datos = self._stream.read(len(buffer))
+        except (OSError, EOFError, lzma.LZMAError, zipfile.BadZipFile, zlib.error) as e:
+            raise ErrorReporteComprimido(f"El archivo comprimido está dañado: {str(e)}") from e
+
+        self._leidos += len(datos)
+        if self._leidos > self._limite:
+            raise ErrorReporteComprimido(
+                f"El reporte descomprimido supera el límite de {self._limite // (1024 * 1024)} MB")
+        buffer[:len(datos)] = datos
+        return len(datos)
+
+    def close(self) -> None:
+        if not self.closed:
+            for recurso in self._cerrar:
+                recurso.close()
+        super().close()
+
+def _abrir_zip(filepath: str, limite: int) -> _LectorLimitado:
+    """Abre el único reporte contenido en un archivo .zip"""
+    try:
+        archivo_zip = zipfile.ZipFile(filepath)
+    except zipfile.BadZipFile as e:
+        raise ErrorReporteComprimido(f"El archivo .zip no es válido: {str(e)}") from e
+
+    miembros = [info for info in archivo_zip.infolist() if not info.is_dir()]
+    if len(miembros) != 1:
+        archivo_zip.close()
+        raise ErrorReporteComprimido("El archivo .zip debe contener un único reporte")
+    if miembros[0].file_size > limite:
+        archivo_zip.close()
+        raise ErrorReporteComprimido(
+            f"El reporte descomprimido supera el límite de {limite // (1024 * 1024)} MB")
+
+    try:
+        stream = archivo_zip.open(miembros[0])
+    except (RuntimeError, NotImplementedError) as e:
+        archivo_zip.close()
+        raise ErrorReporteComprimido(f"No se puede leer el archivo .zip: {str(e)}") from e
+    logger.debug(f"Leyendo {miembros[0].filename} desde el archivo .zip")
+    return _LectorLimitado(stream, limite, cerrar=[stream, archivo_zip])
+
+def es_comprimido(filepath: str) -> bool:
+    """Indica si el archivo es un gzip, xz o zip según su firma"""
+    with open(filepath, 'rb') as f:
+        firma = f.read(len(FIRMA_XZ))
+    return firma.startswith((FIRMA_GZIP, FIRMA_XZ, FIRMA_ZIP))
+
+def abrir_reporte(filepath: str, limite: Optional[int] = None) -> BinaryIO:
+    """
+    Abre un reporte en modo binario. Si está comprimido (gzip, xz o zip,
+    detectado por su firma) retorna un flujo que lo descomprime a medida que
+    se lee, sin escribirlo en disco ni cargarlo completo en memoria.
+    """
+    limite = REPORTE_MAX_DESCOMPRIMIDO if limite is None else limite
+    with open(filepath, 'rb') as f:
+        firma = f.read(len(FIRMA_XZ))
+
+    if firma.startswith(FIRMA_GZIP):
+        lector = _LectorLimitado(gzip.open(filepath, 'rb'), limite)
+    elif firma.startswith(FIRMA_XZ):
+        lector = _LectorLimitado(lzma.open(filepath, 'rb'), limite)
+    elif firma.startswith(FIRMA_ZIP):
+        lector = _abrir_zip(filepath, limite)
+    else:
+        return open(filepath, 'rb')
+    return io.BufferedReader(lector)
+
+def abrir_texto(filepath: str, encoding: str = 'utf-8', newline: Optional[str] = None) -> io.TextIOWrapper:
+    """Como abrir_reporte, pero decodificando el contenido como texto"""
+    return io.TextIOWrapper(abrir_reporte(filepath), encoding=encoding, newline=newline)
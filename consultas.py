@@ -0,0 +1,297 @@
+import logging
+import os
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import and_, case, exists, func, or_, select, tuple_
+from sqlalchemy.engine import Row
+
+from database import db
+from models import SEVERIDADES, Escaneo, EscaneoResumen, Host, NvtCatalogo, Sede, Vulnerabilidad
+from resumen import COLUMNAS_NIVEL
+
+logger = logging.getLogger(__name__)
+
+# Filas que se traen del cursor del servidor en cada viaje a la base de datos
+STREAMING_LOTE = int(os.environ.get('STREAMING_LOTE', '1000'))
+# Hosts por página en la vista de hosts
+PAGINA_HOSTS = int(os.environ.get('PAGINA_HOSTS', '200'))
+# Filas por página en la tabla de vulnerabilidades (la página puede pedir otra cantidad hasta el máximo)
+PAGINA_VULNERABILIDADES = int(os.environ.get('PAGINA_VULNERABILIDADES', '50'))
+PAGINA_VULNERABILIDADES_MAX = 500
+# Escaneos por sede en la página de configuración (los demás se piden con "Ver más")
+PAGINA_ESCANEOS = int(os.environ.get('PAGINA_ESCANEOS', '20'))
+
+# Textos largos del catálogo de NVTs que se agregan a las filas de vulnerabilidades con detalle
+TEXTOS_NVT = ('resumen', 'impacto', 'solucion', 'metodo_deteccion', 'referencias')
+
+def iterar_filas(consulta, lote: int = STREAMING_LOTE) -> Iterator[Row]:
+    """
+    Ejecuta la consulta con un cursor del lado del servidor (yield_per implica
+    stream_results) y entrega las filas a medida que llegan, de a `lote` por
+    viaje: la memoria usada no depende del tamaño del resultado.
+    """
+    resultado = db.session.execute(consulta.execution_options(yield_per=lote))
+    try:
+        yield from resultado
+    finally:
+        resultado.close()
+
+def _filtrar(consulta, sede: Optional[str], fecha_inicio: Optional[date], fecha_fin: Optional[date],
+             columna_fecha):
+    if sede and sede != 'Todas las sedes':
+        consulta = consulta.where(Sede.nombre == sede)
+    if fecha_inicio:
+        consulta = consulta.where(columna_fecha >= fecha_inicio)
+    if fecha_fin:
+        consulta = consulta.where(columna_fecha <= fecha_fin)
+    return consulta
+
+def consulta_vulnerabilidades(sede: Optional[str] = None, fecha_inicio: Optional[date] = None,
+                              fecha_fin: Optional[date] = None, riesgo: Optional[str] = None,
+                              estado: Optional[str] = None, cvss_min: Optional[float] = None,
+                              detalle: Union[bool, Sequence[str]] = True, host_id: Optional[int] = None):
+    """
+    SELECT de las vulnerabilidades que cumplen los filtros como filas planas
+    (sede, escaneo, fecha, host y textos del NVT), ordenadas por host, fecha y
+    escaneo, así que las de un mismo host en un escaneo quedan contiguas. Con
+    detalle=False no se traen los textos largos del catálogo y con una lista
+    de nombres de TEXTOS_NVT solo esos; con host_id, solo las de ese host escaneado.
+    """
+    columnas = [
+        Vulnerabilidad.id,
+        Sede.nombre.label('sede'),
+        Host.escaneo_id,
+        Vulnerabilidad.fecha_escaneo,
+        Host.ip,
+        Host.nombre_host,
+        Vulnerabilidad.oid,
+        func.coalesce(NvtCatalogo.nvt, Vulnerabilidad.oid).label('nvt'),
+        Vulnerabilidad.nivel_amenaza,
+        Vulnerabilidad.cvss,
+        Vulnerabilidad.puerto,
+        Vulnerabilidad.estado,
+    ]
+    if detalle is True:
+        detalle = TEXTOS_NVT
+    columnas += [getattr(NvtCatalogo, texto) for texto in detalle or ()]
+
+    consulta = select(*columnas)\
+        .select_from(Vulnerabilidad)\
+        .join(Host, Host.id == Vulnerabilidad.host_id)\
+        .join(Escaneo, Escaneo.id == Host.escaneo_id)\
+        .join(Sede, Sede.id == Escaneo.sede_id)\
+        .outerjoin(NvtCatalogo, NvtCatalogo.oid == Vulnerabilidad.oid)
+    consulta = _filtrar(consulta, sede, fecha_inicio, fecha_fin, Vulnerabilidad.fecha_escaneo)
+    if host_id is not None:
+        consulta = consulta.where(Vulnerabilidad.host_id == host_id)
+    if riesgo and riesgo != 'all':
+        consulta = consulta.where(Vulnerabilidad.nivel_amenaza == riesgo)
+    if estado and estado != 'all':
+        consulta = consulta.where(Vulnerabilidad.estado == estado)
+    if cvss_min is not None:
+        consulta = consulta.where(Vulnerabilidad.cvss >= cvss_min)
+    return consulta.order_by(Host.ip, Vulnerabilidad.fecha_escaneo.desc(), Host.escaneo_id, Vulnerabilidad.id)
+
+def consulta_hosts(sede: Optional[str] = None, fecha_inicio: Optional[date] = None,
+                   fecha_fin: Optional[date] = None, riesgo: Optional[str] = None):
+    """
+    SELECT con una fila por host escaneado y sus conteos por nivel, calculados
+    en la base de datos. Con un riesgo se cuentan solo las de ese nivel y se
+    omiten los hosts que no tienen ninguna.
+    """
+    union = Vulnerabilidad.host_id == Host.id
+    if riesgo and riesgo != 'all':
+        union = and_(union, Vulnerabilidad.nivel_amenaza == riesgo)
+    total = func.count(Vulnerabilidad.id)
+
+    consulta = select(
+            Sede.nombre.label('sede'),
+            Escaneo.fecha_escaneo,
+            Host.ip,
+            Host.nombre_host,
+            *[func.count(case((Vulnerabilidad.severidad == SEVERIDADES[nivel], 1))).label(columna)
+              for nivel, columna in COLUMNAS_NIVEL.items()],
+            total.label('total'))\
+        .select_from(Host)\
+        .join(Escaneo, Escaneo.id == Host.escaneo_id)\
+        .join(Sede, Sede.id == Escaneo.sede_id)\
+        .outerjoin(Vulnerabilidad, union)
+    consulta = _filtrar(consulta, sede, fecha_inicio, fecha_fin, Escaneo.fecha_escaneo)
+    consulta = consulta.group_by(Host.id, Escaneo.id, Sede.id)
+    if riesgo and riesgo != 'all':
+        consulta = consulta.having(total > 0)
+    return consulta.order_by(Escaneo.fecha_escaneo.desc(), Escaneo.id.desc(), Host.ip)
+
+def pagina_hosts(sede: Optional[str] = None, fecha_inicio: Optional[date] = None,
+                 fecha_fin: Optional[date] = None, riesgo: Optional[str] = None,
+                 despues: Optional[Tuple[int, str]] = None,
+                 limite: int = PAGINA_HOSTS) -> Tuple[List[Dict], Optional[Tuple[int, str]]]:
+    """
+    Una página de hosts escaneados en el orden de consulta_hosts, con sus
+    conteos por nivel. Se pagina por clave (escaneo_id, ip) del último host de
+    la página anterior en lugar de OFFSET, así que el costo no crece con el
+    número de página. Se hacen dos consultas acotadas a la página: los hosts
+    y, para esos hosts, los conteos agrupados. Retorna (hosts, clave de la
+    página siguiente o None si es la última).
+    """
+    consulta = select(Host.id, Host.ip, Host.nombre_host, Escaneo.id.label('escaneo_id'),
+                      Escaneo.fecha_escaneo, Sede.nombre.label('sede'))\
+        .select_from(Host)\
+        .join(Escaneo, Escaneo.id == Host.escaneo_id)\
+        .join(Sede, Sede.id == Escaneo.sede_id)
+    consulta = _filtrar(consulta, sede, fecha_inicio, fecha_fin, Escaneo.fecha_escaneo)
+    if riesgo and riesgo != 'all':
+        consulta = consulta.where(exists().where(Vulnerabilidad.host_id == Host.id,
+                                                 Vulnerabilidad.nivel_amenaza == riesgo))
+    if despues:
+        escaneo_id, ip = despues
+        fecha = select(Escaneo.fecha_escaneo).where(Escaneo.id == escaneo_id).scalar_subquery()
+        consulta = consulta.where(or_(
+            tuple_(Escaneo.fecha_escaneo, Escaneo.id) < tuple_(fecha, escaneo_id),
+            and_(Escaneo.id == escaneo_id, Host.ip > ip),
+        ))
+    # Un host de más indica si hay otra página
+    filas = db.session.execute(consulta.order_by(Escaneo.fecha_escaneo.desc(), Escaneo.id.desc(), Host.ip)
+                               .limit(limite + 1)).all()
+    siguiente = (filas[limite - 1].escaneo_id, filas[limite - 1].ip) if len(filas) > limite else None
+    hosts = [fila._asdict() for fila in filas[:limite]]
+
+    union = Vulnerabilidad.host_id.in_([h['id'] for h in hosts])
+    if riesgo and riesgo != 'all':
+        union = and_(union, Vulnerabilidad.nivel_amenaza == riesgo)
+    conteos = {fila.host_id: fila for fila in db.session.execute(
+        select(Vulnerabilidad.host_id,
+               *[func.count(case((Vulnerabilidad.severidad == SEVERIDADES[nivel], 1))).label(columna)
+                 for nivel, columna in COLUMNAS_NIVEL.items()],
+               func.count(Vulnerabilidad.id).label('total'))
+        .where(union)
+        .group_by(Vulnerabilidad.host_id)
+    )} if hosts else {}
+    for host in hosts:
+        conteo = conteos.get(host['id'])
+        for columna in (*COLUMNAS_NIVEL.values(), 'total'):
+            host[columna] = getattr(conteo, columna) if conteo else 0
+    return hosts, siguiente
+
+# Columnas por las que se puede ordenar la tabla de vulnerabilidades (el nivel, por su rango numérico)
+ORDEN_VULNERABILIDADES = {
+    'ip': Host.ip,
+    'nvt': func.coalesce(NvtCatalogo.nvt, Vulnerabilidad.oid),
+    'nivel_amenaza': Vulnerabilidad.severidad,
+    'fecha_escaneo': Vulnerabilidad.fecha_escaneo,
+    'cvss': Vulnerabilidad.cvss,
+    'estado': Vulnerabilidad.estado,
+}
+
+def pagina_vulnerabilidades(sede: Optional[str] = None, fecha_inicio: Optional[date] = None,
+                            fecha_fin: Optional[date] = None, riesgo: Optional[str] = None,
+                            estado: Optional[str] = None, cvss_min: Optional[float] = None,
+                            buscar: Optional[str] = None, orden: Optional[str] = None,
+                            descendente: bool = False, pagina: int = 1,
+                            por_pagina: int = PAGINA_VULNERABILIDADES) -> Tuple[List[Row], int]:
+    """
+    Una página de la tabla de vulnerabilidades con los filtros, la búsqueda
+    de texto (IP, nombre del host, NVT u OID) y el orden pedidos, sin los
+    textos largos del catálogo. Retorna (filas, total de filas que cumplen
+    los filtros).
+    """
+    consulta = consulta_vulnerabilidades(sede, fecha_inicio, fecha_fin, riesgo, estado, cvss_min,
+                                         detalle=False)
+    if buscar:
+        consulta = consulta.where(or_(
+            Host.ip.icontains(buscar, autoescape=True),
+            Host.nombre_host.icontains(buscar, autoescape=True),
+            func.coalesce(NvtCatalogo.nvt, Vulnerabilidad.oid).icontains(buscar, autoescape=True),
+            Vulnerabilidad.oid.icontains(buscar, autoescape=True),
+        ))
+    total = db.session.scalar(select(func.count()).select_from(consulta.order_by(None).subquery()))
+
+    if orden in ORDEN_VULNERABILIDADES:
+        columna = ORDEN_VULNERABILIDADES[orden]
+        consulta = consulta.order_by(None).order_by(columna.desc() if descendente else columna,
+                                                    Vulnerabilidad.id)
+    por_pagina = max(1, min(por_pagina, PAGINA_VULNERABILIDADES_MAX))
+    pagina = max(1, pagina)
+    filas = db.session.execute(consulta.limit(por_pagina).offset((pagina - 1) * por_pagina)).all()
+    return filas, total
+
+def detalle_vulnerabilidad(vulnerabilidad_id: int, fecha_escaneo: Optional[date] = None) -> Optional[Row]:
+    """
+    Textos del NVT de una vulnerabilidad, pedidos al expandir su fila. Con la
+    fecha del escaneo la búsqueda se limita a la partición de ese mes.
+    """
+    consulta = select(NvtCatalogo.resumen, NvtCatalogo.impacto, NvtCatalogo.solucion,
+                      NvtCatalogo.metodo_deteccion, NvtCatalogo.referencias)\
+        .select_from(Vulnerabilidad)\
+        .outerjoin(NvtCatalogo, NvtCatalogo.oid == Vulnerabilidad.oid)\
+        .where(Vulnerabilidad.id == vulnerabilidad_id)
+    if fecha_escaneo:
+        consulta = consulta.where(Vulnerabilidad.fecha_escaneo == fecha_escaneo)
+    return db.session.execute(consulta).first()
+
+def _escaneo_a_dict(fila: Row) -> Dict:
+    return {
+        'id': fila.id,
+        'fecha': fila.fecha_escaneo.strftime('%Y-%m-%d'),
+        'total_hosts': fila.hosts or 0,
+        'total_vulnerabilidades': fila.vulnerabilidades or 0,
+        'archivado': fila.archivo is not None
+    }
+
+def inventario_escaneos(limite: int = PAGINA_ESCANEOS) -> Dict[str, Dict]:
+    """
+    Inventario de escaneos de la página de configuración en una sola consulta:
+    por cada sede con escaneos, los `limite` más recientes con sus conteos de
+    escaneo_resumen y el total de escaneos de la sede (funciones de ventana).
+    Retorna {nombre de la sede: {'sede_id', 'total', 'escaneos', 'siguiente'}},
+    donde 'siguiente' es la clave para pagina_escaneos o None.
+    """
+    orden = (Escaneo.fecha_escaneo.desc(), Escaneo.id.desc())
+    numerados = select(
+            Sede.id.label('sede_id'),
+            Sede.nombre.label('sede'),
+            Escaneo.id,
+            Escaneo.fecha_escaneo,
+            Escaneo.archivo,
+            EscaneoResumen.hosts,
+            EscaneoResumen.vulnerabilidades,
+            func.row_number().over(partition_by=Escaneo.sede_id, order_by=orden).label('posicion'),
+            func.count().over(partition_by=Escaneo.sede_id).label('total'))\
+        .select_from(Escaneo)\
+        .join(Sede, Sede.id == Escaneo.sede_id)\
+        .outerjoin(EscaneoResumen, EscaneoResumen.escaneo_id == Escaneo.id)\
+        .subquery()
+    consulta = select(numerados)\
+        .where(numerados.c.posicion <= limite)\
+        .order_by(numerados.c.sede, numerados.c.posicion)
+
+    inventario = {}
+    for fila in db.session.execute(consulta):
+        sede = inventario.setdefault(fila.sede, {'sede_id': fila.sede_id, 'total': fila.total,
+                                                 'escaneos': [], 'siguiente': None})
+        sede['escaneos'].append(_escaneo_a_dict(fila))
+        if fila.posicion == limite and fila.total > limite:
+            sede['siguiente'] = fila.id
+    return inventario
+
+def pagina_escaneos(sede_id: int, despues: int,
+                    limite: int = PAGINA_ESCANEOS) -> Tuple[List[Dict], Optional[int]]:
+    """
+    Escaneos de una sede que siguen al escaneo `despues` en el orden del
+    inventario (fecha e id descendentes), paginados por clave. Retorna
+    (escaneos, clave de la página siguiente o None).
+    """
+    fecha = select(Escaneo.fecha_escaneo).where(Escaneo.id == despues).scalar_subquery()
+    filas = db.session.execute(
+        select(Escaneo.id, Escaneo.fecha_escaneo, Escaneo.archivo,
+               EscaneoResumen.hosts, EscaneoResumen.vulnerabilidades)
+        .select_from(Escaneo)
+        .outerjoin(EscaneoResumen, EscaneoResumen.escaneo_id == Escaneo.id)
+        .where(Escaneo.sede_id == sede_id,
+               tuple_(Escaneo.fecha_escaneo, Escaneo.id) < tuple_(fecha, despues))
+        .order_by(Escaneo.fecha_escaneo.desc(), Escaneo.id.desc())
+        .limit(limite + 1)
+    ).all()
+    siguiente = filas[limite - 1].id if len(filas) > limite else None
+    return [_escaneo_a_dict(fila) for fila in filas[:limite]], siguiente
@@ -1,8 +1,12 @@
 import os
+import re
 import logging
 import time
+from contextlib import contextmanager
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Numeric, bindparam, inspect, insert, select, text
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.schema import CreateIndex
 
 # Configurar logging con codificación UTF-8
 logger = logging.getLogger(__name__)
@@ -16,6 +20,348 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+# Clave del advisory lock de PostgreSQL que serializa las migraciones entre procesos
+BLOQUEO_MIGRACIONES = 7421001
+
+# Columnas agregadas a tablas que ya existían. db.create_all() solo crea tablas
+# nuevas, así que en bases existentes se agregan en la migración 1
+COLUMNAS_AGREGADAS = [
+    ('escaneos', 'hash_contenido', 'VARCHAR(64)'),
+    ('trabajos_ingesta', 'hash_contenido', 'VARCHAR(64)'),
+    ('trabajos_ingesta', 'reemplazar', 'BOOLEAN DEFAULT FALSE'),
+]
+
+# Columnas de texto que pasaron de vulnerabilidades a nvt_catalog
+COLUMNAS_CATALOGO = ('nvt', 'resumen', 'impacto', 'solucion', 'metodo_deteccion', 'referencias')
+
+def migrar_catalogo_nvt():
+    """
+    Mueve los textos de cada NVT de la tabla vulnerabilidades a nvt_catalog
+    (una fila por OID, tomando la vulnerabilidad más reciente) y elimina las
+    columnas repetidas. Todo en una transacción; no hace nada si ya se migró.
+    """
+    from ingesta import OIDS_DESCONOCIDOS, clave_catalogo
+
+    columnas = {c['name'] for c in inspect(db.engine).get_columns('vulnerabilidades')}
+    if 'nvt' not in columnas:
+        return
+
+    logger.info("Migrando textos de vulnerabilidades a nvt_catalog...")
+    with db.engine.begin() as conexion:
+        # Las vulnerabilidades sin OID reciben la misma clave derivada que usa la ingesta
+        sin_oid = conexion.execute(text(
+            "SELECT DISTINCT nvt FROM vulnerabilidades WHERE oid IS NULL OR oid IN :desconocidos"
+        ).bindparams(bindparam('desconocidos', expanding=True)), {'desconocidos': list(OIDS_DESCONOCIDOS)})
+        for (nvt,) in sin_oid.fetchall():
+            conexion.execute(text(
+                "UPDATE vulnerabilidades SET oid = :clave WHERE nvt = :nvt AND (oid IS NULL OR oid IN :desconocidos)"
+            ).bindparams(bindparam('desconocidos', expanding=True)),
+                {'clave': clave_catalogo({'nvt': nvt}), 'nvt': nvt, 'desconocidos': list(OIDS_DESCONOCIDOS)})
+
+        lista = ', '.join(COLUMNAS_CATALOGO)
+        conexion.execute(text(f"""
+            INSERT INTO nvt_catalog (oid, {lista}, fecha_actualizacion)
+            SELECT v.oid, {', '.join('v.' + c for c in COLUMNAS_CATALOGO)}, CURRENT_TIMESTAMP
+            FROM vulnerabilidades v
+            WHERE v.id IN (SELECT MAX(id) FROM vulnerabilidades GROUP BY oid)
+              AND v.oid NOT IN (SELECT oid FROM nvt_catalog)
+        """))
+        for columna in COLUMNAS_CATALOGO:
+            conexion.execute(text(f"ALTER TABLE vulnerabilidades DROP COLUMN {columna}"))
+        if conexion.dialect.name == 'postgresql':
+            conexion.execute(text(
+                "ALTER TABLE vulnerabilidades ADD CONSTRAINT vulnerabilidades_oid_fkey "
+                "FOREIGN KEY (oid) REFERENCES nvt_catalog (oid)"
+            ))
+    logger.info("Migración a nvt_catalog completada")
+
+# Filas por transacción al completar columnas nuevas en tablas grandes
+MIGRACION_LOTE = int(os.environ.get('MIGRACION_LOTE', 50000))
+
+def _por_rangos_de_id(tabla: str, sql: str) -> None:
+    """
+    Ejecuta un UPDATE (con :desde y :hasta sobre id) por rangos de
+    MIGRACION_LOTE filas, cada rango en su propia transacción, para no
+    mantener bloqueada toda la tabla ni generar una sola transacción enorme.
+    """
+    with db.engine.connect() as conexion:
+        minimo, maximo = conexion.execute(text(f'SELECT MIN(id), MAX(id) FROM {tabla}')).one()
+    if minimo is None:
+        return
+    for desde in range(minimo, maximo + 1, MIGRACION_LOTE):
+        with db.engine.begin() as conexion:
+            conexion.execute(text(sql), {'desde': desde, 'hasta': desde + MIGRACION_LOTE})
+        logger.debug(f"{tabla}: ids {desde} a {min(desde + MIGRACION_LOTE, maximo + 1) - 1} completados")
+
+def migrar_cvss_severidad():
+    """
+    Agrega vulnerabilidades.severidad (rango numérico del nivel de amenaza) y
+    convierte vulnerabilidades.cvss de texto a NUMERIC(3,1). Los valores que no
+    son un puntaje entre 0 y 10 quedan en NULL. No hace nada si ya se migró.
+    """
+    from models import SEVERIDADES
+
+    columnas = {c['name']: c['type'] for c in inspect(db.engine).get_columns('vulnerabilidades')}
+    cvss_texto = not isinstance(columnas['cvss'], Numeric)
+    if 'severidad' in columnas and not cvss_texto:
+        return
+
+    logger.info("Migrando cvss a numérico y agregando severidad en vulnerabilidades...")
+    # La severidad se recalcula completa: si una ejecución anterior se interrumpió, quedó a medias
+    agregar_columnas([('vulnerabilidades', 'severidad', 'SMALLINT NOT NULL DEFAULT 0')])
+    casos = ' '.join(f"WHEN '{nivel}' THEN {rango}" for nivel, rango in SEVERIDADES.items())
+    asignaciones = [f"severidad = CASE nivel_amenaza {casos} ELSE 0 END"]
+    if cvss_texto:
+        agregar_columnas([('vulnerabilidades', 'cvss_numerico', 'NUMERIC(3,1)')])
+        # CASE anidado: el texto se convierte solo si tiene forma de número
+        if db.engine.dialect.name == 'postgresql':
+            numero = "CASE WHEN cvss ~ '^[0-9]{1,2}(\\.[0-9]+)?$' THEN CAST(cvss AS NUMERIC) END"
+        else:
+            numero = "CASE WHEN cvss GLOB '[0-9]*' AND cvss NOT GLOB '*[^0-9.]*' THEN CAST(cvss AS REAL) END"
+        asignaciones.append(f"cvss_numerico = CASE WHEN ({numero}) <= 10 THEN CAST(({numero}) AS NUMERIC(3,1)) END")
+
+    _por_rangos_de_id('vulnerabilidades', f"UPDATE vulnerabilidades SET {', '.join(asignaciones)} "
+                                          "WHERE id >= :desde AND id < :hasta")
+
+    if cvss_texto:
+        with db.engine.begin() as conexion:
+            # El índice por cvss pudo crearse sobre la columna de texto; se recrea en la migración 5
+            conexion.execute(text('DROP INDEX IF EXISTS ix_vulnerabilidades_cvss'))
+            conexion.execute(text('ALTER TABLE vulnerabilidades DROP COLUMN cvss'))
+            conexion.execute(text('ALTER TABLE vulnerabilidades RENAME COLUMN cvss_numerico TO cvss'))
+    logger.info("Migración de cvss y severidad completada")
+
+def agregar_columnas(columnas=COLUMNAS_AGREGADAS):
+    """Agrega las columnas (tabla, columna, tipo SQL) que falten"""
+    inspector = inspect(db.engine)
+    for tabla, columna, tipo in columnas:
+        if columna not in {c['name'] for c in inspector.get_columns(tabla)}:
+            with db.engine.begin() as conexion:
+                conexion.execute(text(f'ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}'))
+            logger.info(f"Columna {tabla}.{columna} agregada")
+
+def crear_indices():
+    """
+    Crea los índices declarados en los modelos que aún no existan. En PostgreSQL
+    usa CREATE INDEX CONCURRENTLY para no bloquear las escrituras mientras se
+    construyen sobre tablas grandes (requiere ejecutarse fuera de una transacción).
+    """
+    if db.engine.dialect.name != 'postgresql':
+        for tabla in db.metadata.sorted_tables:
+            for indice in tabla.indexes:
+                indice.create(db.engine, checkfirst=True)
+        return
+
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+        for tabla in db.metadata.sorted_tables:
+            for indice in tabla.indexes:
+                sql = str(CreateIndex(indice, if_not_exists=True).compile(dialect=conexion.dialect))
+                conexion.execute(text(re.sub(r'^CREATE (UNIQUE )?INDEX', r'CREATE \1INDEX CONCURRENTLY', sql)))
+                logger.debug(f"Índice {indice.name} verificado")
+
+def agregar_fecha_vulnerabilidades():
+    """Copia la fecha del escaneo en cada vulnerabilidad (clave de partición y filtro sin JOIN)"""
+    agregar_columnas([('vulnerabilidades', 'fecha_escaneo', 'DATE')])
+    _por_rangos_de_id('vulnerabilidades', """
+        UPDATE vulnerabilidades SET fecha_escaneo = (
+            SELECT e.fecha_escaneo FROM hosts h JOIN escaneos e ON e.id = h.escaneo_id
+            WHERE h.id = vulnerabilidades.host_id
+        )
+        WHERE id >= :desde AND id < :hasta AND fecha_escaneo IS NULL
+    """)
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as conexion:
+            conexion.execute(text('ALTER TABLE vulnerabilidades ALTER COLUMN fecha_escaneo SET NOT NULL'))
+
+def crear_resumenes():
+    """Calcula escaneo_resumen para los escaneos que aún no lo tienen, un lote por transacción"""
+    from cache import incrementar_version
+    from models import Escaneo, EscaneoResumen
+    from resumen import RESUMEN_LOTE, recalcular_resumenes
+
+    pendientes = list(db.session.scalars(
+        select(Escaneo.id).where(Escaneo.id.notin_(select(EscaneoResumen.escaneo_id))).order_by(Escaneo.id)
+    ))
+    for inicio in range(0, len(pendientes), RESUMEN_LOTE):
+        recalcular_resumenes(pendientes[inicio:inicio + RESUMEN_LOTE])
+        incrementar_version()
+        db.session.commit()
+    logger.info(f"Resúmenes calculados para {len(pendientes)} escaneos")
+
+def agregar_columnas_retencion():
+    """Retención por sede y datos del archivo de los escaneos archivados"""
+    agregar_columnas([
+        ('sedes', 'retencion_dias', 'INTEGER'),
+        ('escaneos', 'archivo', 'VARCHAR(500)'),
+        ('escaneos', 'fecha_archivado', 'TIMESTAMP'),
+    ])
+
+# Claves foráneas que pasan a ON DELETE CASCADE: (tabla, columna, tabla referida)
+CLAVES_EN_CASCADA = [
+    ('hosts', 'escaneo_id', 'escaneos'),
+    ('vulnerabilidades', 'host_id', 'hosts'),
+]
+
+def agregar_borrado_en_cascada():
+    """
+    Recrea como ON DELETE CASCADE las claves foráneas de CLAVES_EN_CASCADA
+    (PostgreSQL). Se agregan NOT VALID y se validan aparte, para no bloquear
+    las escrituras mientras se revisan las filas existentes; en la tabla
+    particionada no se admite NOT VALID. SQLite no permite modificar
+    restricciones: ahí solo las bases nuevas se crean con CASCADE.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    from particiones import esta_particionada
+
+    inspector = inspect(db.engine)
+    for tabla, columna, referida in CLAVES_EN_CASCADA:
+        for clave in inspector.get_foreign_keys(tabla):
+            if clave['constrained_columns'] != [columna] or \
+                    (clave.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+                continue
+            with db.engine.begin() as conexion:
+                validar = not (tabla == 'vulnerabilidades' and esta_particionada(conexion))
+                conexion.execute(text(
+                    f"ALTER TABLE {tabla} DROP CONSTRAINT {clave['name']}, "
+                    f"ADD CONSTRAINT {clave['name']} FOREIGN KEY ({columna}) REFERENCES {referida} (id) "
+                    f"ON DELETE CASCADE{' NOT VALID' if validar else ''}"
+                ))
+            if validar:
+                with db.engine.begin() as conexion:
+                    conexion.execute(text(f"ALTER TABLE {tabla} VALIDATE CONSTRAINT {clave['name']}"))
+            logger.info(f"Clave {clave['name']} recreada con ON DELETE CASCADE")
+
+def agregar_tipo_trabajo():
+    """Tipo de trabajo en la cola (ingesta o eliminación de un escaneo)"""
+    agregar_columnas([('trabajos_ingesta', 'tipo', "VARCHAR(20) DEFAULT 'ingesta'")])
+
+def crear_version_datos():
+    """Fila única del contador de versión de los datos que usa la caché de resultados"""
+    from models import VersionDatos
+
+    if db.session.get(VersionDatos, 1) is None:
+        db.session.add(VersionDatos(id=1, version=0))
+        db.session.commit()
+
+def crear_indice_unico_hash():
+    """
+    Convierte ix_escaneos_sede_hash en índice único, para que dos cargas simultáneas
+    del mismo archivo no guarden dos escaneos. De los duplicados que ya existan se
+    conserva el hash en el más reciente; los anteriores quedan sin hash.
+    """
+    indices = {i['name']: i for i in inspect(db.engine).get_indexes('escaneos')}
+    if indices.get('ix_escaneos_sede_hash', {}).get('unique'):
+        return
+
+    with db.engine.begin() as conexion:
+        resultado = conexion.execute(text("""
+            UPDATE escaneos SET hash_contenido = NULL
+            WHERE hash_contenido IS NOT NULL AND EXISTS (
+                SELECT 1 FROM escaneos posterior
+                WHERE posterior.sede_id = escaneos.sede_id
+                  AND posterior.hash_contenido = escaneos.hash_contenido
+                  AND posterior.id > escaneos.id
+            )
+        """))
+        if resultado.rowcount:
+            logger.info(f"Hash quitado de {resultado.rowcount} escaneos duplicados")
+
+    if 'ix_escaneos_sede_hash' in indices:
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+                conexion.execute(text('DROP INDEX CONCURRENTLY IF EXISTS ix_escaneos_sede_hash'))
+        else:
+            with db.engine.begin() as conexion:
+                conexion.execute(text('DROP INDEX IF EXISTS ix_escaneos_sede_hash'))
+    crear_indices()
+
+def crear_resumenes_nivel():
+    """
+    Calcula escaneo_resumen_nivel para los escaneos que aún no lo tienen: los que
+    están en línea desde sus vulnerabilidades, un lote por transacción, y los
+    archivados desde su archivo (ver retencion.py)
+    """
+    from cache import incrementar_version
+    from models import Escaneo, EscaneoResumenNivel
+    from resumen import RESUMEN_LOTE, recalcular_resumenes_nivel
+    from retencion import resumen_nivel_archivado
+
+    pendientes = db.session.execute(
+        select(Escaneo.id, Escaneo.archivo)
+        .where(Escaneo.id.notin_(select(EscaneoResumenNivel.escaneo_id))).order_by(Escaneo.id)
+    ).all()
+    en_linea = [p.id for p in pendientes if not p.archivo]
+    for inicio in range(0, len(en_linea), RESUMEN_LOTE):
+        recalcular_resumenes_nivel(en_linea[inicio:inicio + RESUMEN_LOTE])
+        incrementar_version()
+        db.session.commit()
+
+    for escaneo_id, archivo in ((p.id, p.archivo) for p in pendientes if p.archivo):
+        try:
+            filas = resumen_nivel_archivado(archivo)
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo leer el archivo del escaneo {escaneo_id}; "
+                           f"no contará en los totales por nivel: {str(e)}")
+            continue
+        if filas:
+            db.session.execute(insert(EscaneoResumenNivel), [{'escaneo_id': escaneo_id, **f} for f in filas])
+            db.session.commit()
+    logger.info(f"Resúmenes por nivel calculados para {len(pendientes)} escaneos")
+
+def agregar_latido_trabajos():
+    """Fecha del último latido de los trabajos en proceso de la cola"""
+    agregar_columnas([('trabajos_ingesta', 'fecha_actualizacion', 'TIMESTAMP')])
+
+# Migraciones versionadas: (versión, descripción, función). Se aplican en orden
+# las que no estén registradas en version_esquema; cada función es idempotente,
+# así que una base creada antes de existir esta tabla las pasa todas sin cambios
+MIGRACIONES = [
+    (1, 'Hash del archivo y modo reemplazo en escaneos y trabajos', agregar_columnas),
+    (2, 'Textos de NVT movidos a nvt_catalog', migrar_catalogo_nvt),
+    (3, 'Índices compuestos para filtros por sede, fecha, nivel y estado', crear_indices),
+    (4, 'cvss numérico y rango de severidad en vulnerabilidades', migrar_cvss_severidad),
+    (5, 'Índice por cvss', crear_indices),
+    (6, 'Resúmenes por escaneo en escaneo_resumen', crear_resumenes),
+    (7, 'Fecha del escaneo en vulnerabilidades', agregar_fecha_vulnerabilidades),
+    (8, 'Retención por sede y archivo de escaneos antiguos', agregar_columnas_retencion),
+    (9, 'ON DELETE CASCADE de escaneos a hosts y vulnerabilidades', agregar_borrado_en_cascada),
+    (10, 'Trabajos de eliminación de escaneos en la cola', agregar_tipo_trabajo),
+    (11, 'Versión de los datos para la caché de resultados', crear_version_datos),
+    (12, 'Índice único por sede y hash del archivo en escaneos', crear_indice_unico_hash),
+    (13, 'Resúmenes por nivel de amenaza en escaneo_resumen_nivel', crear_resumenes_nivel),
+    (14, 'Latido de los trabajos en proceso de la cola', agregar_latido_trabajos),
+]
+
+@contextmanager
+def _bloqueo_migraciones():
+    """En PostgreSQL evita que varios procesos de la aplicación migren a la vez"""
+    if db.engine.dialect.name != 'postgresql':
+        yield
+        return
+    with db.engine.connect() as conexion:
+        conexion.execute(text('SELECT pg_advisory_lock(:clave)'), {'clave': BLOQUEO_MIGRACIONES})
+        try:
+            yield
+        finally:
+            conexion.execute(text('SELECT pg_advisory_unlock(:clave)'), {'clave': BLOQUEO_MIGRACIONES})
+
+def actualizar_esquema():
+    """Aplica las migraciones pendientes sobre tablas creadas con versiones anteriores"""
+    from models import VersionEsquema
+
+    tabla = VersionEsquema.__table__
+    with _bloqueo_migraciones():
+        with db.engine.connect() as conexion:
+            aplicadas = set(conexion.scalars(select(tabla.c.version)))
+        for version, descripcion, migracion in MIGRACIONES:
+            if version in aplicadas:
+                continue
+            logger.info(f"Aplicando migración {version}: {descripcion}")
+            migracion()
+            with db.engine.begin() as conexion:
+                conexion.execute(insert(tabla).values(version=version, descripcion=descripcion))
+
 def init_db(app):
     """Initialize database with the Flask app"""
     max_retries = 5
@@ -38,10 +384,11 @@ def init_db(app):
 
             with app.app_context():
                 # Importar modelos aquí para evitar referencias circulares
-                from models import User, ActivityLog, Sede, Escaneo, Host, Vulnerabilidad
+                from models import User, ActivityLog, Sede, Escaneo, EscaneoResumen, EscaneoResumenNivel, Host, NvtCatalogo, Vulnerabilidad, TrabajoIngesta, VersionEsquema, VersionDatos, CacheResultado
 
                 # Crear todas las tablas según los modelos
                 db.create_all()
+                actualizar_esquema()
 
                 logger.info("Database initialized successfully")
                 return
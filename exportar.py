@@ -1,75 +1,61 @@
-import pandas as pd
+import csv
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
-from io import BytesIO
+from io import BytesIO, StringIO
 import logging
 from datetime import datetime
+from typing import Iterable, Iterator, Sequence
 
 logger = logging.getLogger(__name__)
 
-def exportar_a_csv(resultados, tipo_reporte):
+# Filas del CSV que se acumulan antes de entregar un bloque de la respuesta
+FILAS_POR_BLOQUE = 1000
+
+def escribir_csv(encabezado: Sequence[str], filas: Iterable[Sequence]) -> Iterator[str]:
+    """
+    Genera el CSV en bloques de texto a medida que se consumen las filas, sin
+    armar el archivo completo en memoria (para una respuesta en streaming).
+    """
+    buffer = StringIO()
+    escritor = csv.writer(buffer, lineterminator='\n')
+    escritor.writerow(encabezado)
+    for numero, fila in enumerate(filas, 1):
+        escritor.writerow(fila)
+        if numero % FILAS_POR_BLOQUE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def exportar_a_csv(filas, tipo_reporte):
     """
-    Exporta los resultados a un archivo CSV.
+    Exporta a CSV las filas de consultas.consulta_hosts o
+    consultas.consulta_vulnerabilidades; retorna un generador de bloques.
     """
     try:
         if tipo_reporte == 'hosts':
-            # Preparar datos para el formato de hosts
-            datos = []
-            for resultado in resultados:
-                for ip, host in resultado['hosts_detalle'].items():
-                    vulnerabilidades = {
-                        'Critical': 0, 'High': 0, 
-                        'Medium': 0, 'Low': 0
-                    }
-                    
-                    for vuln in host['vulnerabilidades']:
-                        vulnerabilidades[vuln['nivel_amenaza']] += 1
-                    
-                    datos.append({
-                        'Sede': resultado['sede'],
-                        'Fecha': resultado['fecha_escaneo'],
-                        'IP': ip,
-                        'Hostname': host['nombre_host'],
-                        'Críticas': vulnerabilidades['Critical'],
-                        'Altas': vulnerabilidades['High'],
-                        'Medias': vulnerabilidades['Medium'],
-                        'Bajas': vulnerabilidades['Low'],
-                        'Total': sum(vulnerabilidades.values())
-                    })
-            
-            df = pd.DataFrame(datos)
-            
+            encabezado = ['Sede', 'Fecha', 'IP', 'Hostname', 'Críticas', 'Altas', 'Medias', 'Bajas', 'Total']
+            datos = ((h.sede, h.fecha_escaneo.strftime('%Y-%m-%d'), h.ip, h.nombre_host,
+                      h.criticas, h.altas, h.medias, h.bajas, h.total) for h in filas)
         elif tipo_reporte == 'vulnerabilidades':
-            # Preparar datos para el formato de vulnerabilidades
-            datos = []
-            for vuln in resultados:
-                datos.append({
-                    'IP': vuln.host.ip,
-                    'Hostname': vuln.host.nombre_host,
-                    'Nivel': vuln.nivel_amenaza,
-                    'CVSS': vuln.cvss,
-                    'Puerto': vuln.puerto,
-                    'Estado': vuln.estado,
-                    'NVT': vuln.nvt,
-                    'Resumen': vuln.resumen
-                })
-            
-            df = pd.DataFrame(datos)
-        
-        output = BytesIO()
-        df.to_csv(output, index=False, encoding='utf-8')
-        output.seek(0)
-        return output
+            encabezado = ['IP', 'Hostname', 'Nivel', 'CVSS', 'Puerto', 'Estado', 'NVT', 'Resumen']
+            datos = ((v.ip, v.nombre_host, v.nivel_amenaza, v.cvss, v.puerto, v.estado, v.nvt, v.resumen)
+                     for v in filas)
+        else:
+            raise ValueError(f"Tipo de reporte no válido: {tipo_reporte}")
+
+        yield from escribir_csv(encabezado, datos)
 
     except Exception as e:
         logger.error(f"Error al exportar a CSV: {str(e)}", exc_info=True)
         raise
 
-def exportar_a_pdf(resultados, tipo_reporte):
+def exportar_a_pdf(filas, tipo_reporte):
     """
-    Exporta los resultados a un archivo PDF.
+    Exporta a PDF las filas de consultas.consulta_hosts o
+    consultas.consulta_vulnerabilidades.
     """
     try:
         buffer = BytesIO()
@@ -86,37 +72,19 @@ def exportar_a_pdf(resultados, tipo_reporte):
             # Preparar datos para la tabla de hosts
             data = [['Sede', 'IP', 'Hostname', 'Críticas', 'Altas', 'Medias', 'Bajas', 'Total']]
             
-            for resultado in resultados:
-                for ip, host in resultado['hosts_detalle'].items():
-                    vulnerabilidades = {
-                        'Critical': 0, 'High': 0, 
-                        'Medium': 0, 'Low': 0
-                    }
-                    
-                    for vuln in host['vulnerabilidades']:
-                        vulnerabilidades[vuln['nivel_amenaza']] += 1
-                    
-                    data.append([
-                        resultado['sede'],
-                        ip,
-                        host['nombre_host'],
-                        vulnerabilidades['Critical'],
-                        vulnerabilidades['High'],
-                        vulnerabilidades['Medium'],
-                        vulnerabilidades['Low'],
-                        sum(vulnerabilidades.values())
-                    ])
+            for h in filas:
+                data.append([h.sede, h.ip, h.nombre_host, h.criticas, h.altas, h.medias, h.bajas, h.total])
 
         elif tipo_reporte == 'vulnerabilidades':
             # Preparar datos para la tabla de vulnerabilidades
             data = [['IP', 'Hostname', 'Nivel', 'CVSS', 'Puerto', 'Estado', 'NVT']]
             
-            for vuln in resultados:
+            for vuln in filas:
                 data.append([
-                    vuln.host.ip,
-                    vuln.host.nombre_host,
+                    vuln.ip,
+                    vuln.nombre_host,
                     vuln.nivel_amenaza,
-                    vuln.cvss,
+                    vuln.cvss if vuln.cvss is not None else '',
                     vuln.puerto,
                     vuln.estado,
                     vuln.nvt
@@ -0,0 +1,101 @@
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import parser
+import parser_csv
+import parser_nessus
+import parser_xml
+from compresion import ErrorReporteComprimido, abrir_reporte
+
+logger = logging.getLogger(__name__)
+
+# Cantidad de bytes del inicio del archivo que se usan para reconocer el formato
+TAMANO_MUESTRA = 8 * 1024
+
+Registro = Tuple[str, str, Optional[parser.Vulnerabilidad]]
+
+@dataclass
+class FormatoReporte:
+    """Manejador de un formato de reporte de vulnerabilidades"""
+    nombre: str
+    detectar: Callable[[str], bool]
+    iterar: Callable[[str], Iterator[Registro]]
+    # Recibe la ruta y, opcionalmente, un callback de avance (parser.Progreso)
+    analizar: Optional[Callable[..., Optional[Dict]]] = None
+
+    def analizar_archivo(self, filepath: str, progreso: parser.Progreso = None) -> Optional[Dict]:
+        """Analiza el archivo con el analizador propio o consolidando sus registros"""
+        if self.analizar:
+            return self.analizar(filepath, progreso=progreso)
+        try:
+            return parser.consolidar_registros(self.iterar(filepath), progreso)
+        except ErrorReporteComprimido:
+            raise
+        except Exception as e:
+            logger.error(f"Error al analizar el reporte {self.nombre}: {str(e)}", exc_info=True)
+            return None
+
+FORMATOS: List[FormatoReporte] = []
+
+def registrar_formato(formato: FormatoReporte) -> FormatoReporte:
+    """Agrega un formato al registro; se evalúan en orden de registro"""
+    FORMATOS.append(formato)
+    return formato
+
+def leer_muestra(filepath: str) -> str:
+    """Lee el inicio del archivo (descomprimido si corresponde) como texto, sin BOM ni espacios iniciales"""
+    with abrir_reporte(filepath) as file:
+        muestra = file.read(TAMANO_MUESTRA)
+    return muestra.decode('utf-8', errors='replace').lstrip('\ufeff').lstrip()
+
+def detectar_formato(filepath: str) -> Optional[FormatoReporte]:
+    """Retorna el primer formato registrado que reconoce el contenido del archivo"""
+    muestra = leer_muestra(filepath)
+    for formato in FORMATOS:
+        if formato.detectar(muestra):
+            return formato
+    return None
+
+def analizar_reporte(filepath: str, progreso: parser.Progreso = None) -> Optional[Dict]:
+    """
+    Detecta el formato del reporte por su contenido y lo analiza con el
+    manejador correspondiente. Retorna la estructura hosts_detalle o None.
+    `progreso` recibe la cantidad de hosts analizados a medida que avanza.
+    """
+    formato = detectar_formato(filepath)
+    if formato is None:
+        logger.error(f"Formato de reporte no reconocido: {filepath}")
+        return None
+    logger.info(f"Formato de reporte detectado: {formato.nombre}")
+    return formato.analizar_archivo(filepath, progreso)
+
+def _es_xml(muestra: str) -> bool:
+    return muestra.startswith('<')
+
+def _es_nessus(muestra: str) -> bool:
+    return _es_xml(muestra) and '<NessusClientData_v2' in muestra
+
+def _es_gvm_xml(muestra: str) -> bool:
+    return _es_xml(muestra) and '<report' in muestra
+
+def _es_openvas_csv(muestra: str) -> bool:
+    cabecera = muestra.split('\n', 1)[0]
+    return ',' in cabecera and 'NVT OID' in cabecera and 'IP' in cabecera
+
+def _es_openvas_txt(muestra: str) -> bool:
+    return any(marca in muestra for marca in (
+        'Security Issues for Host',
+        'automatic security scan',
+        'Results per Host',
+        'Issue\n-----',
+    ))
+
+registrar_formato(FormatoReporte('Nessus', _es_nessus, parser_nessus.iterar_items,
+                                 analizar=parser_nessus.analizar_reporte_nessus))
+registrar_formato(FormatoReporte('GVM XML', _es_gvm_xml, parser_xml.iterar_resultados,
+                                 analizar=parser_xml.analizar_reporte_xml))
+registrar_formato(FormatoReporte('OpenVAS CSV', _es_openvas_csv, parser_csv.iterar_filas,
+                                 analizar=parser_csv.analizar_reporte_csv))
+registrar_formato(FormatoReporte('OpenVAS TXT', _es_openvas_txt, parser.iterar_registros,
+                                 analizar=parser.analizar_vulnerabilidades))
@@ -0,0 +1,120 @@
+"""
+Generador determinista de reportes OpenVAS en formato TXT para pruebas de
+rendimiento del parser. Con la misma semilla y parámetros produce siempre
+el mismo archivo.
+
+Uso:
+    python generador_reportes.py --hosts 1000 --salida /tmp/reporte_1k.txt
+"""
+import argparse
+import os
+import random
+from typing import Dict, List
+
+NIVELES = [('High', 7.0, 10.0), ('Medium', 4.0, 6.9), ('Low', 0.1, 3.9)]
+PESOS_NIVELES = [2, 5, 3]
+PUERTOS = ['22/tcp', '80/tcp', '135/tcp', '443/tcp', '445/tcp', '3389/tcp', '8443/tcp',
+           'general/tcp', 'general/icmp', 'general/udp']
+DOMINIOS = ['vestiditos', 'mimo.corp', 'sede.local']
+PALABRAS = ('remote host version vulnerable service protocol attacker allows certificate '
+            'cipher update security configuration detected server weak support end life '
+            'information disclosure denial execution code authentication bypass').split()
+TIPOS_SOLUCION = ['VendorFix', 'Mitigation', 'WillNotFix', 'Workaround']
+
+def _frase(r: random.Random, palabras: int) -> str:
+    return ' '.join(r.choice(PALABRAS) for _ in range(palabras)).capitalize() + '.'
+
+def _parrafo(r: random.Random, lineas: int) -> List[str]:
+    texto = [_frase(r, r.randint(8, 14)) for _ in range(lineas)]
+    return [texto[0]] + ['  ' + linea for linea in texto[1:]]
+
+def generar_issue(r: random.Random, ip: str) -> List[str]:
+    """Genera las líneas de un issue con las secciones que produce GVM"""
+    nivel, cvss_min, cvss_max = r.choices(NIVELES, weights=PESOS_NIVELES)[0]
+    cvss = round(r.uniform(cvss_min, cvss_max), 1)
+    nvt = ' '.join(r.choice(PALABRAS).capitalize() for _ in range(r.randint(3, 7)))
+
+    lineas = [
+        'Issue',
+        '-----',
+        f'NVT:    {nvt}',
+        f'OID:    1.3.6.1.4.1.25623.1.0.{r.randint(10000, 199999)}',
+        f'Threat: {nivel} (CVSS: {cvss})',
+        f'Port:   {r.choice(PUERTOS)}',
+        '',
+    ]
+    if r.random() < 0.3:
+        lineas += [f'Product detection result: cpe:/a:vendor:product:{r.randint(1, 9)}.{r.randint(0, 20)}',
+                   f'Detected by: {nvt} Detection (OID: 1.3.6.1.4.1.25623.1.0.{r.randint(10000, 99999)})', '']
+    lineas += ['Summary:'] + _parrafo(r, r.randint(1, 3)) + ['']
+    lineas += ['Vulnerability Detection Result:'] + _parrafo(r, r.randint(1, 4)) + ['']
+    if r.random() < 0.7:
+        lineas += ['Impact:'] + _parrafo(r, r.randint(1, 3)) + ['']
+    lineas += ['Solution:', f'Solution type: {r.choice(TIPOS_SOLUCION)}'] + _parrafo(r, r.randint(1, 2)) + ['']
+    if r.random() < 0.5:
+        lineas += ['Vulnerability Insight:'] + _parrafo(r, r.randint(1, 3)) + ['']
+    lineas += ['Vulnerability Detection Method:'] + _parrafo(r, 1)
+    lineas += [f'Details: {nvt} (OID: 1.3.6.1.4.1.25623.1.0.{r.randint(10000, 99999)})', '']
+    if r.random() < 0.6:
+        lineas += ['References:', f'cve: CVE-{r.randint(2010, 2025)}-{r.randint(1000, 49999)}', 'Other:']
+        lineas += [f'    https://www.example.org/advisory/{r.randint(1, 99999)}' for _ in range(r.randint(1, 3))]
+        lineas += ['']
+    lineas += ['']
+    return lineas
+
+def generar_reporte(ruta: str, hosts: int, issues_min: int = 1, issues_max: int = 5,
+                    semilla: int = 1234) -> Dict:
+    """
+    Escribe en `ruta` un reporte con `hosts` hosts y entre `issues_min` e
+    `issues_max` issues por host. Retorna las estadísticas del archivo generado.
+    """
+    r = random.Random(semilla)
+    ips = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(hosts)]
+    issues_por_host = [r.randint(issues_min, issues_max) for _ in ips]
+    total_issues = sum(issues_por_host)
+
+    with open(ruta, 'w', encoding='utf-8') as f:
+        f.write('I Summary\n=========\n\n'
+                'This document reports on the results of an automatic security scan.\n'
+                'The report first summarises the results found.\n\n'
+                'Scan started: Tue Mar 4 18:01:39 2025 UTC\n'
+                'Scan ended:   Tue Mar 4 23:03:37 2025 UTC\n'
+                'Task:         BENCHMARK\n\n'
+                'Host Summary\n************\n\n'
+                'Host            High  Medium  Low  Log  False Positive\n')
+        for ip, issues in zip(ips, issues_por_host):
+            fila = f'{ip:<16}{issues // 3:>4}{issues // 2:>8}{issues - issues // 3 - issues // 2:>5}    0               0'
+            if r.random() < 0.8:
+                fila += f'    host{ip.replace(".", "")}.{r.choice(DOMINIOS)}'
+            f.write(fila + '\n')
+        f.write(f'Total: {hosts}\n\n\nII Results per Host\n===================\n\n')
+
+        for ip, issues in zip(ips, issues_por_host):
+            f.write(f'Host {ip}\n{"*" * (5 + len(ip))}\n\n'
+                    f'Scanning of this host started at: Tue Mar 4 19:15:22 2025 UTC\n'
+                    f'Number of results: {issues}\n\n'
+                    f'Port Summary for Host {ip}\n{"-" * (22 + len(ip))}\n\n'
+                    'Service (Port)          Threat Level\n')
+            for _ in range(min(issues, 5)):
+                f.write(f'{r.choice(PUERTOS):<24}Medium\n')
+            f.write(f'\nSecurity Issues for Host {ip}\n{"-" * (25 + len(ip))}\n\n')
+            for _ in range(issues):
+                f.write('\n'.join(generar_issue(r, ip)) + '\n')
+
+    return {'hosts': hosts, 'issues': total_issues, 'bytes': os.path.getsize(ruta), 'semilla': semilla}
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Genera un reporte OpenVAS TXT sintético')
+    arg_parser.add_argument('--hosts', type=int, default=1000, help='Cantidad de hosts')
+    arg_parser.add_argument('--issues-min', type=int, default=1, help='Mínimo de issues por host')
+    arg_parser.add_argument('--issues-max', type=int, default=5, help='Máximo de issues por host')
+    arg_parser.add_argument('--semilla', type=int, default=1234, help='Semilla del generador')
+    arg_parser.add_argument('--salida', required=True, help='Ruta del archivo a generar')
+    args = arg_parser.parse_args()
+
+    stats = generar_reporte(args.salida, args.hosts, args.issues_min, args.issues_max, args.semilla)
+    print(f"✅ Reporte generado en {args.salida}: {stats['hosts']} hosts, "
+          f"{stats['issues']} issues, {stats['bytes'] / 1024 / 1024:.1f} MB")
+
+if __name__ == '__main__':
+    main()
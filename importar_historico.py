@@ -0,0 +1,247 @@
+"""
+Importador masivo de reportes históricos.
+
+Recorre un árbol de directorios, obtiene la sede y la fecha de escaneo de cada
+ruta con una expresión regular, analiza los archivos en un pool de procesos y
+los guarda con la ingesta por lotes (ingesta.guardar_escaneo). El avance se
+registra en un archivo JSONL para poder retomar una importación interrumpida,
+y los archivos ya cargados (mismo SHA-256 para la misma sede) se omiten.
+
+Uso:
+    python importar_historico.py /datos/openvas --dry-run
+    python importar_historico.py /datos/openvas --crear-sedes --workers 4
+    python importar_historico.py /datos --patron '(?P<sede>[^/]+)/(?P<fecha>\\d{8})' --formato-fecha %Y%m%d
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+import parser
+from formatos import analizar_reporte
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Sede = primer directorio; fecha = primer AAAA-MM-DD que aparezca después en la ruta
+PATRON_DEFECTO = r'^(?P<sede>[^/]+)/(?:.*/)?[^/]*?(?P<fecha>\d{4}-\d{2}-\d{2})'
+
+# Estados que no se vuelven a procesar al retomar una importación
+ESTADOS_TERMINADOS = ('importado', 'duplicado', 'sin_resultados')
+
+@dataclass
+class Archivo:
+    ruta: str
+    relativa: str
+    sede: str
+    fecha: date
+    bytes: int
+
+def recorrer(directorio: str, patron: re.Pattern, formato_fecha: str,
+             extensiones: Set[str]) -> Tuple[List[Archivo], List[str]]:
+    """
+    Retorna los reportes del árbol cuya ruta relativa coincide con el patrón,
+    ordenados por fecha, y la lista de rutas que no se pudieron mapear.
+    """
+    archivos, ignorados = [], []
+    for raiz, dirs, nombres in os.walk(directorio):
+        dirs.sort()
+        for nombre in sorted(nombres):
+            if '.' not in nombre or nombre.rsplit('.', 1)[1].lower() not in extensiones:
+                continue
+            ruta = os.path.join(raiz, nombre)
+            relativa = os.path.relpath(ruta, directorio).replace(os.sep, '/')
+            coincidencia = patron.search(relativa)
+            try:
+                fecha = datetime.strptime(coincidencia.group('fecha'), formato_fecha).date()
+                sede = coincidencia.group('sede')
+            except (AttributeError, IndexError, ValueError):
+                ignorados.append(relativa)
+                continue
+            archivos.append(Archivo(ruta, relativa, sede, fecha, os.path.getsize(ruta)))
+    archivos.sort(key=lambda a: (a.fecha, a.sede, a.relativa))
+    return archivos, ignorados
+
+def leer_estado(ruta_estado: str) -> Set[str]:
+    """Rutas relativas ya terminadas según el archivo de avance"""
+    terminados = set()
+    if os.path.exists(ruta_estado):
+        with open(ruta_estado, encoding='utf-8') as f:
+            for linea in f:
+                if linea.strip():
+                    registro = json.loads(linea)
+                    if registro.get('estado') in ESTADOS_TERMINADOS:
+                        terminados.add(registro['relativa'])
+    return terminados
+
+def _inicializar_worker() -> None:
+    # Cada archivo ya se analiza en su propio proceso; sin pools anidados
+    parser.PARSER_WORKERS = 1
+    logging.getLogger().setLevel(logging.WARNING)
+
+def _hash_archivo(ruta: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        while bloque := f.read(MB):
+            sha256.update(bloque)
+    return sha256.hexdigest()
+
+def _analizar_archivo(ruta: str) -> Dict:
+    """Se ejecuta en los procesos del pool: hash y análisis de un reporte"""
+    inicio = time.perf_counter()
+    try:
+        return {
+            'hash': _hash_archivo(ruta),
+            'resultados': analizar_reporte(ruta),
+            'error': None,
+            'segundos': time.perf_counter() - inicio,
+        }
+    except Exception as e:
+        return {'hash': None, 'resultados': None, 'error': str(e), 'segundos': time.perf_counter() - inicio}
+
+def _sedes(nombres: Set[str], crear: bool, dry_run: bool) -> Dict[str, int]:
+    """Ids de las sedes por nombre, creando las que falten si se pidió"""
+    from database import db
+    from models import Sede
+
+    existentes = {s.nombre: s.id for s in Sede.query.filter(Sede.nombre.in_(nombres))}
+    for nombre in sorted(nombres - set(existentes)):
+        if crear and not dry_run:
+            sede = Sede(nombre=nombre, descripcion='Creada por el importador histórico', activa=True)
+            db.session.add(sede)
+            db.session.commit()
+            existentes[nombre] = sede.id
+            print(f"Sede creada: {nombre}")
+        elif crear:
+            print(f"Se crearía la sede: {nombre}")
+        else:
+            print(f"⚠️  La sede '{nombre}' no existe; use --crear-sedes para crearla")
+    return existentes
+
+def importar(args) -> Dict:
+    # La aplicación (y su conexión a la base de datos) se importa solo en el
+    # proceso principal; los procesos del pool únicamente analizan archivos
+    from app import ALLOWED_EXTENSIONS, app
+
+    patron = re.compile(args.patron)
+    archivos, ignorados = recorrer(args.directorio, patron, args.formato_fecha, ALLOWED_EXTENSIONS)
+    for relativa in ignorados:
+        logger.warning(f"Ruta sin sede/fecha según el patrón, se omite: {relativa}")
+
+    terminados = set() if args.dry_run else leer_estado(args.estado)
+    pendientes = [a for a in archivos if a.relativa not in terminados]
+    print(f"{len(archivos)} reportes encontrados, {len(archivos) - len(pendientes)} ya importados, "
+          f"{len(pendientes)} pendientes, {len(ignorados)} rutas sin sede/fecha")
+
+    totales = {'archivos': 0, 'bytes': 0, 'hosts': 0, 'vulnerabilidades': 0,
+               'segundos_ingesta': 0.0, 'estados': {}}
+    inicio = time.perf_counter()
+    with app.app_context():
+        sedes = _sedes({a.sede for a in pendientes}, args.crear_sedes, args.dry_run)
+        estado = None if args.dry_run else open(args.estado, 'a', encoding='utf-8')
+        try:
+            # spawn: los procesos del pool no heredan las conexiones abiertas del proceso principal
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_inicializar_worker,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                analisis = parser.mapear_en_orden(executor, _analizar_archivo,
+                                                  (a.ruta for a in pendientes), args.workers * 2)
+                for archivo, analizado in zip(pendientes, analisis):
+                    registro = _guardar(archivo, analizado, sedes.get(archivo.sede), args.dry_run)
+                    totales['archivos'] += 1
+                    totales['bytes'] += archivo.bytes
+                    totales['hosts'] += registro.get('hosts', 0)
+                    totales['vulnerabilidades'] += registro.get('vulnerabilidades', 0)
+                    totales['segundos_ingesta'] += registro.get('segundos_ingesta', 0.0)
+                    totales['estados'][registro['estado']] = totales['estados'].get(registro['estado'], 0) + 1
+                    print(f"[{totales['archivos']}/{len(pendientes)}] {archivo.relativa}: {registro['estado']}"
+                          + (f" ({registro['hosts']} hosts, {registro['vulnerabilidades']} vulnerabilidades)"
+                             if 'hosts' in registro else '')
+                          + (f" - {registro['error']}" if registro.get('error') else ''))
+                    if estado:
+                        estado.write(json.dumps(registro, ensure_ascii=False) + '\n')
+                        estado.flush()
+        finally:
+            if estado:
+                estado.close()
+
+    totales['segundos'] = time.perf_counter() - inicio
+    return totales
+
+def _guardar(archivo: Archivo, analizado: Dict, sede_id: Optional[int], dry_run: bool) -> Dict:
+    """Guarda (o en dry-run solo evalúa) un reporte ya analizado y retorna su registro de avance"""
+    from database import db
+    from ingesta import EscaneoDuplicado, buscar_duplicado, guardar_escaneo
+
+    registro = {'relativa': archivo.relativa, 'sede': archivo.sede,
+                'fecha_escaneo': archivo.fecha.strftime('%Y-%m-%d'), 'hash': analizado['hash']}
+    if analizado['error']:
+        return {**registro, 'estado': 'error', 'error': analizado['error']}
+    if sede_id is None and not dry_run:
+        return {**registro, 'estado': 'sin_sede'}
+
+    resultados = analizado['resultados']
+    if not resultados:
+        return {**registro, 'estado': 'sin_resultados'}
+    if sede_id is not None and buscar_duplicado(sede_id, analizado['hash']):
+        return {**registro, 'estado': 'duplicado'}
+
+    hosts_detalle = resultados['hosts_detalle']
+    if dry_run:
+        return {**registro, 'estado': 'se_importaria', 'hosts': len(hosts_detalle),
+                'vulnerabilidades': sum(len(h['vulnerabilidades']) for h in hosts_detalle.values())}
+
+    try:
+        ingesta = guardar_escaneo(sede_id, archivo.fecha, resultados, hash_contenido=analizado['hash'])
+    except EscaneoDuplicado:
+        db.session.rollback()
+        return {**registro, 'estado': 'duplicado'}
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error al guardar {archivo.relativa}: {str(e)}", exc_info=True)
+        return {**registro, 'estado': 'error', 'error': str(e)}
+    return {**registro, 'estado': 'importado', 'escaneo_id': ingesta.escaneo_id, 'hosts': ingesta.hosts,
+            'vulnerabilidades': ingesta.vulnerabilidades, 'segundos_ingesta': round(ingesta.segundos, 3)}
+
+def imprimir_resumen(totales: Dict, dry_run: bool) -> None:
+    segundos = totales['segundos'] or 1e-9
+    filas = totales['hosts'] + totales['vulnerabilidades']
+    print(f"\n{'Simulación' if dry_run else 'Importación'} terminada en {totales['segundos']:.1f}s")
+    for estado, cantidad in sorted(totales['estados'].items()):
+        print(f"  {estado:<15} {cantidad:>7}")
+    print(f"  Archivos: {totales['archivos']} ({totales['archivos'] / segundos:.2f}/s), "
+          f"{totales['bytes'] / MB:.1f} MB ({totales['bytes'] / MB / segundos:.2f} MB/s)")
+    print(f"  Hosts: {totales['hosts']}, vulnerabilidades: {totales['vulnerabilidades']} "
+          f"({filas / segundos:.0f} filas/s en total"
+          + (f", {filas / totales['segundos_ingesta']:.0f} filas/s en la ingesta" if totales['segundos_ingesta'] else '')
+          + ')')
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Importa en lote reportes históricos organizados por sede y fecha')
+    arg_parser.add_argument('directorio', help='Directorio raíz de los reportes')
+    arg_parser.add_argument('--patron', default=PATRON_DEFECTO,
+                            help='Expresión regular sobre la ruta relativa, con grupos (?P<sede>) y (?P<fecha>)')
+    arg_parser.add_argument('--formato-fecha', default='%Y-%m-%d', help='Formato strptime del grupo fecha')
+    arg_parser.add_argument('--crear-sedes', action='store_true', help='Crear las sedes que no existan')
+    arg_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Procesos para analizar los reportes')
+    arg_parser.add_argument('--estado', default='importacion_estado.jsonl',
+                            help='Archivo de avance para retomar la importación')
+    arg_parser.add_argument('--dry-run', action='store_true',
+                            help='Analizar y mostrar lo que se importaría sin escribir en la base de datos')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    totales = importar(args)
+    imprimir_resumen(totales, args.dry_run)
+
+if __name__ == '__main__':
+    main()
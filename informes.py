@@ -1,6 +1,6 @@
-import pandas as pd
 from io import BytesIO
 from datetime import datetime
+from itertools import groupby
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.pagesizes import letter, landscape
@@ -8,9 +8,12 @@ from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, Tabl
 from reportlab.lib.units import inch
 import matplotlib.pyplot as plt
 
+from exportar import escribir_csv
+
 def generar_informe_ejecutivo(datos, tipo='pdf'):
     """
-    Genera un informe ejecutivo con datos resumidos y gráficos
+    Genera un informe ejecutivo con datos resumidos y gráficos.
+    datos: sede, fechas, 'total_hosts' y 'niveles' (conteo por nivel de amenaza)
     """
     return generar_pdf_ejecutivo(datos)
 
@@ -88,20 +91,15 @@ def generar_pdf_ejecutivo(datos):
 
     # Resumen ejecutivo
     story.append(Paragraph("Resumen Ejecutivo", styles["Heading2"]))
-    total_vulnerabilidades = sum(len(host['vulnerabilidades']) for host in datos['hosts_detalle'].values())
-    total_hosts = len(datos['hosts_detalle'])
+    niveles = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0, **datos['niveles']}
+    total_vulnerabilidades = sum(niveles.values())
+    total_hosts = datos['total_hosts']
     story.append(Paragraph(f"Total de hosts analizados: {total_hosts}", styles["Normal"]))
     story.append(Paragraph(f"Total de vulnerabilidades identificadas: {total_vulnerabilidades}", styles["Normal"]))
     story.append(Spacer(1, 12))
 
     # Tabla de resumen
     data = [['Nivel', 'Cantidad', '% del Total']]
-    niveles = {'Critical': 0, 'High': 0, 'Medium': 0, 'Low': 0}
-
-    for host_data in datos['hosts_detalle'].values():
-        for vuln in host_data['vulnerabilidades']:
-            niveles[vuln['nivel_amenaza']] += 1
-
     for nivel, cantidad in niveles.items():
         porcentaje = (cantidad / total_vulnerabilidades * 100) if total_vulnerabilidades > 0 else 0
         data.append([nivel, str(cantidad), f"{porcentaje:.1f}%"])
@@ -162,7 +160,10 @@ def generar_pdf_ejecutivo(datos):
 
 def generar_informe_tecnico(datos, tipo='pdf'):
     """
-    Genera un informe técnico detallado
+    Genera un informe técnico detallado.
+    datos: sede, fechas y 'vulnerabilidades', un iterable de filas de
+    consultas.consulta_vulnerabilidades (ordenadas por host, fecha y escaneo).
+    Para CSV retorna un generador de bloques de texto.
     """
     if tipo == 'pdf':
         return generar_pdf_tecnico(datos)
@@ -216,23 +217,28 @@ def generar_pdf_tecnico(datos):
     story.append(Paragraph(f"Fecha del informe: {datetime.now().strftime('%Y-%m-%d')}", context_style))
     story.append(Spacer(1, 12))
 
-    # Contenido detallado por host
-    for ip, host_data in datos['hosts_detalle'].items():
+    # Contenido detallado por host, un bloque por cada escaneo del host (dos sedes
+    # o dos cargas del mismo día son escaneos distintos aunque compartan la fecha)
+    for (_, ip), filas in groupby(datos['vulnerabilidades'], key=lambda v: (v.escaneo_id, v.ip)):
+        vulnerabilidades = list(filas)
+        fecha_escaneo = vulnerabilidades[0].fecha_escaneo
         # Información del host
         story.append(Paragraph(f"Host: {ip}", styles["Heading2"]))
-        if host_data.get('nombre_host'):
-            story.append(Paragraph(f"Nombre: {host_data['nombre_host']}", styles["Normal"]))
+        if vulnerabilidades[0].nombre_host:
+            story.append(Paragraph(f"Nombre: {vulnerabilidades[0].nombre_host}", styles["Normal"]))
+        story.append(Paragraph(f"Escaneo: {vulnerabilidades[0].sede} - {fecha_escaneo.strftime('%Y-%m-%d')}",
+                               styles["Normal"]))
         story.append(Spacer(1, 12))
 
         # Tabla de vulnerabilidades
         vuln_data = [['Vulnerabilidad', 'Nivel', 'CVSS', 'Puerto', 'Estado']]
-        for vuln in host_data['vulnerabilidades']:
+        for vuln in vulnerabilidades:
             vuln_data.append([
-                vuln['nvt'],
-                vuln['nivel_amenaza'],
-                vuln['cvss'],
-                vuln['puerto'],
-                vuln.get('estado', 'No especificado')
+                vuln.nvt,
+                vuln.nivel_amenaza,
+                vuln.cvss if vuln.cvss is not None else '',
+                vuln.puerto,
+                vuln.estado or 'No especificado'
             ])
 
         table = Table(vuln_data, repeatRows=1)
@@ -255,14 +261,14 @@ def generar_pdf_tecnico(datos):
         story.append(Spacer(1, 20))
 
         # Detalles de cada vulnerabilidad
-        for vuln in host_data['vulnerabilidades']:
-            story.append(Paragraph(f"Detalle de Vulnerabilidad: {vuln['nvt']}", styles["Heading3"]))
-            story.append(Paragraph(f"Resumen: {vuln.get('resumen', 'No disponible')}", styles["Normal"]))
-            story.append(Paragraph(f"Impacto: {vuln.get('impacto', 'No disponible')}", styles["Normal"]))
-            story.append(Paragraph(f"Solución: {vuln.get('solucion', 'No disponible')}", styles["Normal"]))
-            if vuln.get('referencias'):
+        for vuln in vulnerabilidades:
+            story.append(Paragraph(f"Detalle de Vulnerabilidad: {vuln.nvt}", styles["Heading3"]))
+            story.append(Paragraph(f"Resumen: {vuln.resumen or 'No disponible'}", styles["Normal"]))
+            story.append(Paragraph(f"Impacto: {vuln.impacto or 'No disponible'}", styles["Normal"]))
+            story.append(Paragraph(f"Solución: {vuln.solucion or 'No disponible'}", styles["Normal"]))
+            if vuln.referencias:
                 story.append(Paragraph("Referencias:", styles["Normal"]))
-                for ref in vuln['referencias']:
+                for ref in vuln.referencias:
                     story.append(Paragraph(f"• {ref}", styles["Normal"]))
             story.append(Spacer(1, 12))
 
@@ -272,31 +278,13 @@ def generar_pdf_tecnico(datos):
 
 def generar_csv_tecnico(datos):
     """
-    Genera un CSV con información técnica detallada
+    Genera un CSV con información técnica detallada, en bloques a medida que
+    se leen las filas
     """
-    buffer = BytesIO()
-
-    # Preparar datos para el DataFrame
-    rows = []
-    for ip, host_data in datos['hosts_detalle'].items():
-        for vuln in host_data['vulnerabilidades']:
-            rows.append({
-                'IP': ip,
-                'Nombre Host': host_data.get('nombre_host', ''),
-                'Vulnerabilidad': vuln['nvt'],
-                'OID': vuln.get('oid', ''),
-                'Nivel': vuln['nivel_amenaza'],
-                'CVSS': vuln['cvss'],
-                'Puerto': vuln['puerto'],
-                'Resumen': vuln.get('resumen', ''),
-                'Impacto': vuln.get('impacto', ''),
-                'Solución': vuln.get('solucion', ''),
-                'Método Detección': vuln.get('metodo_deteccion', ''),
-                'Referencias': '; '.join(vuln.get('referencias', [])),
-                'Estado': vuln.get('estado', 'No especificado')
-            })
-
-    df = pd.DataFrame(rows)
-    df.to_csv(buffer, index=False, encoding='utf-8')
-    buffer.seek(0)
-    return buffer
\ No newline at end of file
+    encabezado = ['IP', 'Nombre Host', 'Vulnerabilidad', 'OID', 'Nivel', 'CVSS', 'Puerto', 'Resumen',
+                  'Impacto', 'Solución', 'Método Detección', 'Referencias', 'Estado']
+    filas = ((v.ip, v.nombre_host or '', v.nvt, v.oid, v.nivel_amenaza, v.cvss, v.puerto,
+              v.resumen or '', v.impacto or '', v.solucion or '', v.metodo_deteccion or '',
+              '; '.join(v.referencias or []), v.estado or 'No especificado')
+             for v in datos['vulnerabilidades'])
+    return escribir_csv(encabezado, filas)
@@ -0,0 +1,299 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from cache import incrementar_version
+from database import db
+from particiones import asegurar_particion
+from models import SEVERIDADES, Escaneo, EscaneoResumen, EscaneoResumenNivel, Host, NvtCatalogo, Vulnerabilidad
+from resumen import recalcular_resumenes
+
+logger = logging.getLogger(__name__)
+
+# Filas por sentencia (o por bloque COPY) al insertar hosts y vulnerabilidades
+INGESTA_LOTE = int(os.environ.get('INGESTA_LOTE', 5000))
+# 'insert' (multi-row INSERT, cualquier motor) o 'copy' (COPY FROM STDIN, solo PostgreSQL)
+INGESTA_METODO = os.environ.get('INGESTA_METODO', 'insert').lower()
+# Hosts (con sus vulnerabilidades) por transacción al eliminar un escaneo grande por lotes
+ELIMINACION_LOTE = int(os.environ.get('ELIMINACION_LOTE', 1000))
+
+COLUMNAS_VULNERABILIDAD = ('host_id', 'fecha_escaneo', 'oid', 'nivel_amenaza', 'severidad', 'cvss', 'puerto', 'estado')
+COLUMNAS_CATALOGO = ('nvt', 'resumen', 'impacto', 'solucion', 'metodo_deteccion', 'referencias')
+# Valores que usan los parsers cuando el reporte no trae el OID del NVT
+OIDS_DESCONOCIDOS = ('', 'No especificado')
+
+class EscaneoDuplicado(Exception):
+    """Otra carga del mismo archivo ya guardó el escaneo de la sede (índice único sede/hash)"""
+
+@dataclass
+class ResultadoIngesta:
+    escaneo_id: int
+    hosts: int
+    vulnerabilidades: int
+    segundos: float
+    metodo: str
+
+    @property
+    def filas_por_segundo(self) -> float:
+        filas = self.hosts + self.vulnerabilidades
+        return filas / self.segundos if self.segundos else 0.0
+
+def _lotes(filas: Iterable, tamano: int) -> Iterator[List]:
+    iterador = iter(filas)
+    while lote := list(islice(iterador, tamano)):
+        yield lote
+
+def clave_catalogo(vuln_data: Dict) -> str:
+    """
+    OID con el que se guarda el NVT en el catálogo. Si el reporte no trae OID
+    se usa una clave derivada del nombre, para no mezclar NVTs distintos.
+    """
+    oid = (vuln_data.get('oid') or '').strip()
+    if oid not in OIDS_DESCONOCIDOS:
+        return oid
+    nombre = vuln_data.get('nvt') or ''
+    return f"sin-oid-{hashlib.sha1(nombre.encode('utf-8')).hexdigest()[:20]}"
+
+def cvss_a_numero(cvss) -> Optional[float]:
+    """Puntaje CVSS del parser (texto) como número entre 0 y 10, o None si no es válido"""
+    try:
+        valor = round(float(cvss), 1)
+    except (TypeError, ValueError):
+        return None
+    return valor if 0 <= valor <= 10 else None
+
+def _entrada_catalogo(oid: str, vuln_data: Dict) -> Dict:
+    """Convierte una vulnerabilidad del parser en una fila de nvt_catalog"""
+    return {
+        'oid': oid,
+        'nvt': vuln_data.get('nvt', ''),
+        'resumen': vuln_data.get('resumen', ''),
+        'impacto': vuln_data.get('impacto', ''),
+        'solucion': vuln_data.get('solucion', ''),
+        'metodo_deteccion': vuln_data.get('metodo_deteccion', ''),
+        'referencias': vuln_data.get('referencias', []),
+        'fecha_actualizacion': datetime.utcnow(),
+    }
+
+def _fila_vulnerabilidad(host_id: int, fecha_escaneo: date, vuln_data: Dict) -> Dict:
+    """Convierte una vulnerabilidad del parser en una fila de la tabla vulnerabilidades"""
+    return {
+        'host_id': host_id,
+        'fecha_escaneo': fecha_escaneo,
+        'oid': clave_catalogo(vuln_data),
+        'nivel_amenaza': vuln_data.get('nivel_amenaza', ''),
+        'severidad': SEVERIDADES.get(vuln_data.get('nivel_amenaza'), 0),
+        'cvss': cvss_a_numero(vuln_data.get('cvss')),
+        'puerto': vuln_data.get('puerto', ''),
+        'estado': 'ACTIVA',
+    }
+
+def _insertar_catalogo(hosts_detalle: Dict) -> int:
+    """
+    Inserta o actualiza (upsert) en nvt_catalog los NVTs del reporte, una fila
+    por OID. Si un NVT ya existe, sus textos se reemplazan por los más recientes.
+    """
+    entradas = {}
+    for host_data in hosts_detalle.values():
+        for vuln_data in host_data.get('vulnerabilidades', []):
+            oid = clave_catalogo(vuln_data)
+            entradas[oid] = _entrada_catalogo(oid, vuln_data)
+    if not entradas:
+        return 0
+
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insert_dialecto
+    elif dialecto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as insert_dialecto
+    else:
+        insert_dialecto = None
+
+    # Orden fijo por OID para que dos ingestas simultáneas bloqueen las filas en el mismo orden
+    filas = [entradas[oid] for oid in sorted(entradas)]
+    tabla = NvtCatalogo.__table__
+    for lote in _lotes(filas, INGESTA_LOTE):
+        if insert_dialecto is None:
+            existentes = set(db.session.scalars(select(tabla.c.oid).where(tabla.c.oid.in_([f['oid'] for f in lote]))))
+            lote = [f for f in lote if f['oid'] not in existentes]
+            if lote:
+                db.session.execute(insert(tabla), lote)
+            continue
+        sentencia = insert_dialecto(tabla)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=[tabla.c.oid],
+            set_={c: sentencia.excluded[c] for c in COLUMNAS_CATALOGO + ('fecha_actualizacion',)}
+        )
+        db.session.execute(sentencia, lote)
+    return len(filas)
+
+def insertar_hosts(escaneo_id: int, hosts_detalle: Dict) -> Dict[str, int]:
+    """Inserta los hosts por lotes y retorna el id asignado a cada IP (INSERT ... RETURNING)"""
+    tabla = Host.__table__
+    sentencia = insert(tabla).returning(tabla.c.id, sort_by_parameter_order=True)
+    ids = {}
+    for lote in _lotes(hosts_detalle.items(), INGESTA_LOTE):
+        filas = [{'ip': ip, 'nombre_host': datos.get('nombre_host', ''), 'escaneo_id': escaneo_id}
+                 for ip, datos in lote]
+        for (ip, _), host_id in zip(lote, db.session.execute(sentencia, filas).scalars()):
+            ids[ip] = host_id
+    return ids
+
+def insertar_vulnerabilidades(filas: Iterable[Dict]) -> int:
+    """Inserta las vulnerabilidades con INSERT de múltiples filas por lote"""
+    total = 0
+    sentencia = insert(Vulnerabilidad.__table__)
+    for lote in _lotes(filas, INGESTA_LOTE):
+        db.session.execute(sentencia, lote)
+        total += len(lote)
+    return total
+
+def _copiar_vulnerabilidades(filas: Iterable[Dict], cursor) -> int:
+    """Carga las vulnerabilidades con COPY FROM STDIN en formato CSV (PostgreSQL)"""
+    total = 0
+    # FORCE_NULL: un cvss vacío (aunque vaya entre comillas) se carga como NULL
+    sql = (f"COPY {Vulnerabilidad.__tablename__} ({', '.join(COLUMNAS_VULNERABILIDAD)}) "
+           "FROM STDIN WITH (FORMAT csv, FORCE_NULL (cvss))")
+    for lote in _lotes(filas, INGESTA_LOTE):
+        buffer = io.StringIO()
+        # QUOTE_ALL para que COPY lea las cadenas vacías como '' y no como NULL
+        escritor = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+        for fila in lote:
+            escritor.writerow([fila[c] for c in COLUMNAS_VULNERABILIDAD])
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+        total += len(lote)
+    return total
+
+def _cursor_copy():
+    """Retorna un cursor DBAPI con soporte de COPY en la transacción actual, o None"""
+    conexion = db.session.connection()
+    if conexion.dialect.name != 'postgresql':
+        return None
+    cursor = conexion.connection.cursor()
+    return cursor if hasattr(cursor, 'copy_expert') else None
+
+def eliminar_detalle(escaneo_ids: Sequence[int]) -> None:
+    """Borra los hosts y vulnerabilidades de los escaneos, conservando el escaneo y su resumen"""
+    hosts = select(Host.id).where(Host.escaneo_id.in_(escaneo_ids))
+    db.session.execute(delete(Vulnerabilidad).where(Vulnerabilidad.host_id.in_(hosts)))
+    db.session.execute(delete(Host).where(Host.escaneo_id.in_(escaneo_ids)))
+
+def eliminar_escaneos(escaneo_ids: Sequence[int]) -> None:
+    """Borra escaneos con sus hosts y vulnerabilidades con DELETEs por conjunto, sin cargar objetos"""
+    if not escaneo_ids:
+        return
+    eliminar_detalle(escaneo_ids)
+    db.session.execute(delete(EscaneoResumenNivel).where(EscaneoResumenNivel.escaneo_id.in_(escaneo_ids)))
+    db.session.execute(delete(EscaneoResumen).where(EscaneoResumen.escaneo_id.in_(escaneo_ids)))
+    db.session.execute(delete(Escaneo).where(Escaneo.id.in_(escaneo_ids)))
+
+def eliminar_escaneo_por_lotes(escaneo_id: int) -> int:
+    """
+    Borra un escaneo grande en transacciones cortas en lugar de una sola: primero
+    su resumen (los totales dejan de contarlo de inmediato), luego sus hosts y
+    vulnerabilidades de a ELIMINACION_LOTE hosts y al final el escaneo. Si se
+    interrumpe, volver a llamarla continúa donde quedó. Hace commit en cada lote
+    y retorna la cantidad de hosts borrados.
+    """
+    db.session.execute(delete(EscaneoResumenNivel).where(EscaneoResumenNivel.escaneo_id == escaneo_id))
+    db.session.execute(delete(EscaneoResumen).where(EscaneoResumen.escaneo_id == escaneo_id))
+    incrementar_version()
+    db.session.commit()
+    total = 0
+    while hosts := list(db.session.scalars(select(Host.id).where(Host.escaneo_id == escaneo_id)
+                                           .order_by(Host.id).limit(ELIMINACION_LOTE))):
+        db.session.execute(delete(Vulnerabilidad).where(Vulnerabilidad.host_id.in_(hosts)))
+        db.session.execute(delete(Host).where(Host.id.in_(hosts)))
+        db.session.commit()
+        total += len(hosts)
+    db.session.execute(delete(Escaneo).where(Escaneo.id == escaneo_id))
+    incrementar_version()
+    db.session.commit()
+    return total
+
+def buscar_duplicado(sede_id: int, hash_contenido: str) -> Optional[Escaneo]:
+    """Retorna el escaneo de la sede cargado desde un archivo idéntico, si existe"""
+    return Escaneo.query.filter_by(sede_id=sede_id, hash_contenido=hash_contenido).first()
+
+def escaneos_a_reemplazar(sede_id: int, fecha_escaneo: date, hash_contenido: Optional[str]) -> List[int]:
+    """Ids de los escaneos de la sede que reemplaza una nueva carga: misma fecha o mismo archivo"""
+    condicion = Escaneo.fecha_escaneo == fecha_escaneo
+    if hash_contenido:
+        condicion = condicion | (Escaneo.hash_contenido == hash_contenido)
+    return list(db.session.scalars(select(Escaneo.id).where(Escaneo.sede_id == sede_id, condicion)))
+
+def guardar_escaneo(sede_id: int, fecha_escaneo: date, resultados: Dict,
+                    metodo: str = None, hash_contenido: Optional[str] = None,
+                    reemplazar_ids: Sequence[int] = ()) -> ResultadoIngesta:
+    """
+    Guarda un escaneo con sus hosts, vulnerabilidades y resumen en una sola
+    transacción usando inserciones por lotes en lugar de objetos ORM uno a uno.
+    Los escaneos de `reemplazar_ids` se borran en la misma transacción, así que
+    el reemplazo es atómico. Hace commit al terminar; si algo falla, la excepción se propaga
+    y el llamador debe hacer rollback. Si otra carga guardó el mismo archivo para la
+    sede después de la verificación del llamador, lanza EscaneoDuplicado.
+    """
+    metodo = (metodo or INGESTA_METODO).lower()
+    inicio = time.perf_counter()
+    asegurar_particion(fecha_escaneo)
+
+    if reemplazar_ids:
+        eliminar_escaneos(reemplazar_ids)
+        logger.info(f"Reemplazando escaneos {list(reemplazar_ids)} de la sede {sede_id}")
+
+    escaneo = Escaneo(sede_id=sede_id, fecha_escaneo=fecha_escaneo, hash_contenido=hash_contenido)
+    db.session.add(escaneo)
+    try:
+        db.session.flush()
+    except IntegrityError as e:
+        if hash_contenido is None:
+            raise
+        raise EscaneoDuplicado(f'El archivo {hash_contenido} ya está guardado para la sede {sede_id}') from e
+    logger.debug(f"Escaneo creado con ID: {escaneo.id}")
+
+    hosts_detalle = resultados['hosts_detalle']
+    total_nvts = _insertar_catalogo(hosts_detalle)
+    logger.debug(f"{total_nvts} NVTs actualizados en el catálogo")
+    ids = insertar_hosts(escaneo.id, hosts_detalle)
+    filas = (_fila_vulnerabilidad(ids[ip], fecha_escaneo, vuln_data)
+             for ip, host_data in hosts_detalle.items()
+             for vuln_data in host_data.get('vulnerabilidades', []))
+
+    cursor = _cursor_copy() if metodo == 'copy' else None
+    if metodo == 'copy' and cursor is None:
+        logger.warning("COPY solo está disponible con PostgreSQL y psycopg2, se usará INSERT por lotes")
+        metodo = 'insert'
+
+    if cursor is not None:
+        try:
+            total_vulns = _copiar_vulnerabilidades(filas, cursor)
+        finally:
+            cursor.close()
+    else:
+        total_vulns = insertar_vulnerabilidades(filas)
+
+    recalcular_resumenes([escaneo.id])
+    incrementar_version()
+    db.session.commit()
+    resultado = ResultadoIngesta(
+        escaneo_id=escaneo.id,
+        hosts=len(ids),
+        vulnerabilidades=total_vulns,
+        segundos=time.perf_counter() - inicio,
+        metodo=metodo
+    )
+    logger.info(f"Ingesta [{resultado.metodo}] del escaneo {resultado.escaneo_id}: {resultado.hosts} hosts, "
+                f"{resultado.vulnerabilidades} vulnerabilidades en {resultado.segundos:.2f}s "
+                f"({resultado.filas_por_segundo:.0f} filas/s)")
+    return resultado
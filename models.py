@@ -3,6 +3,9 @@ from database import db
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# Rango numérico de cada nivel de amenaza, para ordenar y agregar en SQL (0 = otro)
+SEVERIDADES = {'Critical': 4, 'High': 3, 'Medium': 2, 'Low': 1}
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
@@ -53,6 +56,8 @@ class Sede(db.Model):
     descripcion = db.Column(db.Text)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
     activa = db.Column(db.Boolean, default=True)
+    # Días que los hallazgos de un escaneo quedan en línea antes de archivarse (ver retencion.py); NULL = sin límite
+    retencion_dias = db.Column(db.Integer)
 
     def __repr__(self):
         return f'<Sede {self.nombre}>'
@@ -64,8 +69,19 @@ class Escaneo(db.Model):
     sede_id = db.Column(db.Integer, db.ForeignKey('sedes.id'), nullable=False)
     fecha_escaneo = db.Column(db.Date, nullable=False)
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    hash_contenido = db.Column(db.String(64))  # SHA-256 del archivo subido
+    # Archivo .jsonl.gz con los hosts y vulnerabilidades si el escaneo está archivado (ver retencion.py)
+    archivo = db.Column(db.String(500))
+    fecha_archivado = db.Column(db.DateTime)
     hosts = db.relationship('Host', backref='escaneo', lazy=True, cascade='all, delete-orphan')
     sede = db.relationship('Sede', backref='escaneos', lazy=True)
+    resumen = db.relationship('EscaneoResumen', uselist=False, lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (
+        # Un mismo archivo se guarda una sola vez por sede, aunque dos cargas lleguen a la vez
+        db.Index('ix_escaneos_sede_hash', 'sede_id', 'hash_contenido', unique=True),
+        db.Index('ix_escaneos_sede_fecha', 'sede_id', 'fecha_escaneo'),
+    )
 
     def __repr__(self):
         return f'<Escaneo {self.fecha_escaneo}>'
@@ -76,28 +92,183 @@ class Host(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ip = db.Column(db.String(50), nullable=False)
     nombre_host = db.Column(db.String(200))
-    escaneo_id = db.Column(db.Integer, db.ForeignKey('escaneos.id'), nullable=False)
+    escaneo_id = db.Column(db.Integer, db.ForeignKey('escaneos.id', ondelete='CASCADE'), nullable=False)
     vulnerabilidades = db.relationship('Vulnerabilidad', backref='host', lazy=True, cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_hosts_escaneo_ip', 'escaneo_id', 'ip'),
+        db.Index('ix_hosts_ip', 'ip'),
+    )
+
     def __repr__(self):
         return f'<Host {self.ip}>'
 
-class Vulnerabilidad(db.Model):
-    __tablename__ = 'vulnerabilidades'
+class EscaneoResumen(db.Model):
+    """Conteos precalculados de un escaneo (ver resumen.py); se mantienen al guardar y al cambiar estados"""
+    __tablename__ = 'escaneo_resumen'
 
-    id = db.Column(db.Integer, primary_key=True)
-    oid = db.Column(db.String(100), nullable=False)
+    escaneo_id = db.Column(db.Integer, db.ForeignKey('escaneos.id', ondelete='CASCADE'), primary_key=True)
+    hosts = db.Column(db.Integer, nullable=False, default=0)
+    vulnerabilidades = db.Column(db.Integer, nullable=False, default=0)
+    criticas = db.Column(db.Integer, nullable=False, default=0)
+    altas = db.Column(db.Integer, nullable=False, default=0)
+    medias = db.Column(db.Integer, nullable=False, default=0)
+    bajas = db.Column(db.Integer, nullable=False, default=0)
+    activas = db.Column(db.Integer, nullable=False, default=0)
+    mitigadas = db.Column(db.Integer, nullable=False, default=0)
+    asumidas = db.Column(db.Integer, nullable=False, default=0)
+    cvss_suma = db.Column(db.Float, nullable=False, default=0)
+    cvss_cantidad = db.Column(db.Integer, nullable=False, default=0)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<EscaneoResumen {self.escaneo_id}>'
+
+class EscaneoResumenNivel(db.Model):
+    """Los conteos de escaneo_resumen restringidos a un nivel de amenaza, para los totales filtrados por riesgo"""
+    __tablename__ = 'escaneo_resumen_nivel'
+
+    escaneo_id = db.Column(db.Integer, db.ForeignKey('escaneos.id', ondelete='CASCADE'), primary_key=True)
+    severidad = db.Column(db.SmallInteger, primary_key=True)  # SEVERIDADES[nivel_amenaza]
+    hosts = db.Column(db.Integer, nullable=False, default=0)
+    vulnerabilidades = db.Column(db.Integer, nullable=False, default=0)
+    activas = db.Column(db.Integer, nullable=False, default=0)
+    mitigadas = db.Column(db.Integer, nullable=False, default=0)
+    asumidas = db.Column(db.Integer, nullable=False, default=0)
+    cvss_suma = db.Column(db.Float, nullable=False, default=0)
+    cvss_cantidad = db.Column(db.Integer, nullable=False, default=0)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<EscaneoResumenNivel {self.escaneo_id} {self.severidad}>'
+
+class NvtCatalogo(db.Model):
+    """Textos de cada NVT (test de vulnerabilidad), guardados una sola vez por OID"""
+    __tablename__ = 'nvt_catalog'
+
+    oid = db.Column(db.String(100), primary_key=True)
     nvt = db.Column(db.String(500), nullable=False)
-    nivel_amenaza = db.Column(db.String(50), nullable=False)
-    cvss = db.Column(db.String(10))
-    puerto = db.Column(db.String(50))
     resumen = db.Column(db.Text)
     impacto = db.Column(db.Text)
     solucion = db.Column(db.Text)
     metodo_deteccion = db.Column(db.Text)
     referencias = db.Column(db.JSON)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<NvtCatalogo {self.oid}>'
+
+class Vulnerabilidad(db.Model):
+    __tablename__ = 'vulnerabilidades'
+
+    id = db.Column(db.Integer, primary_key=True)
+    oid = db.Column(db.String(100), db.ForeignKey('nvt_catalog.oid'), nullable=False)
+    nivel_amenaza = db.Column(db.String(50), nullable=False)
+    severidad = db.Column(db.SmallInteger, nullable=False, default=0)  # SEVERIDADES[nivel_amenaza]
+    cvss = db.Column(db.Numeric(3, 1, asdecimal=False))  # NULL si el reporte no trae un puntaje válido
+    puerto = db.Column(db.String(50))
     estado = db.Column(db.String(20), default='ACTIVA')
-    host_id = db.Column(db.Integer, db.ForeignKey('hosts.id'), nullable=False)
+    host_id = db.Column(db.Integer, db.ForeignKey('hosts.id', ondelete='CASCADE'), nullable=False)
+    # Copia de Escaneo.fecha_escaneo: clave de partición (ver particiones.py) y filtro por fecha sin JOIN
+    fecha_escaneo = db.Column(db.Date, nullable=False)
+    # selectin: una sola consulta por página con los OID distintos, no un JOIN que repita el texto por fila
+    catalogo = db.relationship('NvtCatalogo', lazy='selectin')
+
+    __table_args__ = (
+        db.Index('ix_vulnerabilidades_host_oid', 'host_id', 'oid'),
+        db.Index('ix_vulnerabilidades_nivel_estado', 'nivel_amenaza', 'estado'),
+        db.Index('ix_vulnerabilidades_cvss', 'cvss'),
+    )
+
+    # Los textos del NVT se leen del catálogo
+    @property
+    def nvt(self):
+        return self.catalogo.nvt if self.catalogo else self.oid
+
+    @property
+    def resumen(self):
+        return self.catalogo.resumen if self.catalogo else None
+
+    @property
+    def impacto(self):
+        return self.catalogo.impacto if self.catalogo else None
+
+    @property
+    def solucion(self):
+        return self.catalogo.solucion if self.catalogo else None
+
+    @property
+    def metodo_deteccion(self):
+        return self.catalogo.metodo_deteccion if self.catalogo else None
+
+    @property
+    def referencias(self):
+        return self.catalogo.referencias if self.catalogo else []
+
+    def __repr__(self):
+        return f'<Vulnerabilidad {self.oid}>'
+
+class VersionEsquema(db.Model):
+    """Migraciones de esquema ya aplicadas (ver database.MIGRACIONES)"""
+    __tablename__ = 'version_esquema'
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    descripcion = db.Column(db.String(200))
+    fecha_aplicacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<VersionEsquema {self.version}>'
+
+class VersionDatos(db.Model):
+    """Contador que sube con cada cambio de escaneos, estados o sedes; forma parte de la clave de cache.py"""
+    __tablename__ = 'version_datos'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<VersionDatos {self.version}>'
+
+class CacheResultado(db.Model):
+    """Resultado agregado guardado por el backend 'base_datos' de cache.py"""
+    __tablename__ = 'cache_resultados'
+
+    clave = db.Column(db.String(64), primary_key=True)
+    valor = db.Column(db.LargeBinary, nullable=False)
+    fecha_acceso = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<CacheResultado {self.clave}>'
+
+class TrabajoIngesta(db.Model):
+    """Reporte subido pendiente de analizar y guardar en segundo plano"""
+    __tablename__ = 'trabajos_ingesta'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # 'ingesta' (analizar y guardar un reporte) o 'eliminacion' (borrar por lotes el escaneo escaneo_id)
+    tipo = db.Column(db.String(20), default='ingesta')
+    sede_id = db.Column(db.Integer, db.ForeignKey('sedes.id', ondelete='CASCADE'), nullable=False)
+    fecha_escaneo = db.Column(db.Date, nullable=False)
+    archivo = db.Column(db.String(500), nullable=False)
+    nombre_archivo = db.Column(db.String(255))
+    hash_contenido = db.Column(db.String(64))
+    reemplazar = db.Column(db.Boolean, default=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
+    estado = db.Column(db.String(20), default='PENDIENTE', nullable=False, index=True)
+    etapa = db.Column(db.String(50), default='en_cola')
+    hosts_procesados = db.Column(db.Integer, default=0)
+    vulnerabilidades_procesadas = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    intentos = db.Column(db.Integer, default=0)
+    escaneo_id = db.Column(db.Integer, db.ForeignKey('escaneos.id', ondelete='SET NULL'))
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_inicio = db.Column(db.DateTime)
+    fecha_fin = db.Column(db.DateTime)
+    # Latido del trabajo en proceso: lo renueva el proceso que lo ejecuta (ver trabajos._latido)
+    fecha_actualizacion = db.Column(db.DateTime)
+
+    sede = db.relationship('Sede', lazy=True)
 
     def __repr__(self):
-        return f'<Vulnerabilidad {self.nvt}>'
\ No newline at end of file
+        return f'<TrabajoIngesta {self.id} {self.estado}>'
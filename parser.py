@@ -1,10 +1,30 @@
+import os
 import re
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from itertools import chain
+from typing import Callable, List, Dict, Optional, Iterable, Iterator, Tuple
+
+from compresion import ErrorReporteComprimido, abrir_texto
 
 logger = logging.getLogger(__name__)
 
+# Paralelismo del análisis: número de procesos y tamaño mínimo del reporte
+# descomprimido (en caracteres) a partir del cual se reparte el trabajo entre ellos
+PARSER_WORKERS = int(os.environ.get('PARSER_WORKERS', os.cpu_count() or 1))
+PARSER_UMBRAL_PARALELO = int(os.environ.get('PARSER_UMBRAL_PARALELO', 4 * 1024 * 1024))
+TAMANO_FRAGMENTO = 1024 * 1024
+
+# Callback opcional de avance: recibe la cantidad de hosts analizados hasta el momento
+Progreso = Optional[Callable[[int], None]]
+
+# Niveles de amenaza que se almacenan; Log, Debug y False Positive se descartan
+NIVELES_VALIDOS = ('Critical', 'High', 'Medium', 'Low')
+
 @dataclass
 class Vulnerabilidad:
     nvt: str
@@ -24,6 +44,51 @@ class HostAnalisis:
     nombre_host: str
     vulnerabilidades: List[Vulnerabilidad]
 
+RE_CABECERA_HOST = re.compile(r'Security Issues for Host ([\d\.]+)$')
+RE_SEPARADOR = re.compile(r'-+$')
+RE_HOST_INFORMATION = re.compile(r'Host Information: ([\d\.]+)\s+\((.*?)\)')
+RE_FILA_RESUMEN = re.compile(r'([\d\.]+)\s+\d+\s+\d+\s+\d+\s+\d+\s+\d+(?:\s+([\w\-\.]+))?')
+
+def limpiar_nombre_host(nombre_host: str) -> str:
+    """Elimina caracteres inválidos y descarta nombres vacíos o que son una IP"""
+    nombre_host = re.sub(r'[^\w\-\.]', '', nombre_host)
+    if not nombre_host or nombre_host.isspace() or nombre_host.replace('.', '').isdigit():
+        return ""
+    return nombre_host
+
+@dataclass
+class IndiceNombres:
+    """Nombres de host declarados en el reporte, indexados por IP"""
+    host_information: Dict[str, str] = field(default_factory=dict)
+    tabla_resumen: Dict[str, str] = field(default_factory=dict)
+
+    def registrar_linea(self, linea: str) -> None:
+        """Registra el nombre de host si la línea pertenece a un bloque conocido"""
+        if 'Host Information:' in linea:
+            match = RE_HOST_INFORMATION.search(linea)
+            if match:
+                self.host_information.setdefault(match.group(1), match.group(2).strip())
+        elif linea[:1].isdigit():
+            match = RE_FILA_RESUMEN.match(linea)
+            if match:
+                self.tabla_resumen.setdefault(match.group(1), (match.group(2) or '').strip())
+
+    @classmethod
+    def desde_texto(cls, contenido: str) -> 'IndiceNombres':
+        """Construye el índice recorriendo una sola vez el contenido del reporte"""
+        indice = cls()
+        for linea in contenido.splitlines():
+            indice.registrar_linea(linea)
+        return indice
+
+    def nombre(self, ip: str) -> str:
+        """Retorna el nombre limpio del host o cadena vacía si no se conoce"""
+        if ip in self.host_information:
+            nombre_host = self.host_information[ip]
+        else:
+            nombre_host = self.tabla_resumen.get(ip, '')
+        return limpiar_nombre_host(nombre_host)
+
 def extraer_vulnerabilidad(texto: str) -> Vulnerabilidad:
     """Extrae los detalles de una vulnerabilidad del texto proporcionado"""
     logger.debug(f"Extrayendo vulnerabilidad del texto: {texto[:100]}...")  # Primeros 100 caracteres
@@ -62,14 +127,283 @@ def extraer_vulnerabilidad(texto: str) -> Vulnerabilidad:
     logger.debug(f"Vulnerabilidad extraída: {vulnerabilidad.nvt} - {vulnerabilidad.nivel_amenaza}")
     return vulnerabilidad
 
-def analizar_vulnerabilidades(filepath: str) -> Optional[Dict]:
+def vulnerabilidad_a_dict(v: Vulnerabilidad) -> Dict:
+    """Convierte una vulnerabilidad al formato usado en hosts_detalle"""
+    return {
+        'nvt': v.nvt,
+        'oid': v.oid,
+        'nivel_amenaza': v.nivel_amenaza,
+        'cvss': v.cvss,
+        'puerto': v.puerto,
+        'resumen': v.resumen,
+        'impacto': v.impacto,
+        'solucion': v.solucion,
+        'metodo_deteccion': v.metodo_deteccion,
+        'referencias': v.referencias
+    }
+
+def consolidar_registros(registros: Iterable[Tuple[str, str, Optional[Vulnerabilidad]]],
+                         progreso: Progreso = None) -> Optional[Dict]:
+    """
+    Agrupa registros (ip, nombre_host, vulnerabilidad) en la estructura
+    hosts_detalle. Un registro sin vulnerabilidad solo aporta el nombre del
+    host; para cada IP se conserva el primer nombre no vacío recibido.
+    """
+    hosts_detalle = {}
+    nombres = {}
+    total_registros = 0
+
+    for ip, nombre_host, vuln in registros:
+        if not ip:
+            continue
+        if nombre_host:
+            nombres.setdefault(ip, nombre_host)
+        if vuln is None:
+            continue
+
+        total_registros += 1
+        if vuln.nivel_amenaza not in NIVELES_VALIDOS:
+            continue
+
+        if ip not in hosts_detalle:
+            hosts_detalle[ip] = {'nombre_host': '', 'vulnerabilidades': []}
+            if progreso:
+                progreso(len(hosts_detalle))
+        hosts_detalle[ip]['vulnerabilidades'].append(vulnerabilidad_a_dict(vuln))
+
+    for ip, host_data in hosts_detalle.items():
+        host_data['nombre_host'] = limpiar_nombre_host(nombres.get(ip, ''))
+        logger.info(f"Host {ip} procesado con {len(host_data['vulnerabilidades'])} vulnerabilidades")
+
+    if not hosts_detalle:
+        logger.warning("No se encontraron hosts con vulnerabilidades")
+        return None
+
+    logger.info(f"Análisis completado: {total_registros} resultados, {len(hosts_detalle)} hosts")
+    return {'hosts_detalle': hosts_detalle}
+
+def _extraer_seguro(lineas_issue: List[str]) -> Optional[Vulnerabilidad]:
+    """Extrae una vulnerabilidad registrando el error en lugar de propagarlo"""
+    try:
+        vuln = extraer_vulnerabilidad('\n'.join(lineas_issue))
+        logger.debug(f"Vulnerabilidad procesada: {vuln.nvt} ({vuln.nivel_amenaza})")
+        return vuln
+    except Exception as e:
+        logger.error(f"Error procesando vulnerabilidad: {str(e)}")
+        return None
+
+def iterar_hosts(lineas: Iterable[str], indice: Optional[IndiceNombres] = None) -> Iterator[HostAnalisis]:
+    """
+    Recorre el reporte TXT línea a línea y produce cada sección
+    'Security Issues for Host' a medida que se completa.
+    Solo mantiene en memoria el host en curso. Los nombres de host se
+    registran en `indice` durante la misma pasada.
+    """
+    if indice is None:
+        indice = IndiceNombres()
+
+    ip_actual = None          # host cuya sección se está leyendo
+    vulnerabilidades = []
+    lineas_issue = None       # None: buscando el siguiente 'Issue'
+    anterior = None
+    cabecera_ip = None        # cabecera de host pendiente de confirmar
+    cabecera_paso = 0
+
+    def cerrar_host():
+        if lineas_issue is not None:
+            vuln = _extraer_seguro(lineas_issue)
+            if vuln:
+                vulnerabilidades.append(vuln)
+        return HostAnalisis(ip=ip_actual, nombre_host=indice.nombre(ip_actual),
+                            vulnerabilidades=vulnerabilidades)
+
+    for linea in lineas:
+        linea = linea.rstrip('\n')
+        indice.registrar_linea(linea)
+
+        # Confirmar la cabecera: una línea de guiones seguida de una línea vacía
+        if cabecera_ip is not None:
+            if cabecera_paso == 1 and RE_SEPARADOR.match(linea):
+                cabecera_paso = 2
+                continue
+            if cabecera_paso == 2 and linea == '':
+                ip_actual, vulnerabilidades, lineas_issue = cabecera_ip, [], None
+                cabecera_ip, anterior = None, None
+                logger.debug(f"Procesando host {ip_actual}")
+                continue
+            cabecera_ip = None
+
+        if linea.startswith('Security Issues for Host'):
+            if ip_actual is not None:
+                yield cerrar_host()
+                ip_actual = None
+            match = RE_CABECERA_HOST.match(linea)
+            if match:
+                cabecera_ip, cabecera_paso = match.group(1), 1
+            continue
+
+        if ip_actual is None:
+            continue
+
+        if anterior == 'Issue' and linea.startswith('-----'):
+            if lineas_issue is None:
+                lineas_issue = [] if linea == '-----' else None
+            elif len(lineas_issue) >= 3 and lineas_issue[-2] == '':
+                # El issue anterior termina antes de la línea vacía que precede a 'Issue'
+                vuln = _extraer_seguro(lineas_issue[:-2])
+                if vuln:
+                    vulnerabilidades.append(vuln)
+                lineas_issue = [] if linea == '-----' else None
+            else:
+                lineas_issue.append(linea)
+        elif lineas_issue is not None:
+            lineas_issue.append(linea)
+        anterior = linea
+
+    if ip_actual is not None:
+        yield cerrar_host()
+
+def iterar_registros(filepath: str) -> Iterator[Tuple[str, str, Optional[Vulnerabilidad]]]:
+    """Produce los registros (ip, nombre_host, vulnerabilidad) de un reporte TXT"""
+    with abrir_texto(filepath) as file:
+        for host in iterar_hosts(file):
+            for vuln in host.vulnerabilidades:
+                yield host.ip, host.nombre_host, vuln
+
+def _resultado(hosts_detalle: Dict, indice: IndiceNombres, host_count: int) -> Optional[Dict]:
+    """Aplica los nombres de host del índice y arma el resultado final"""
+    # Un bloque 'Host Information' puede aparecer después de la sección del host
+    for ip, host_data in hosts_detalle.items():
+        host_data['nombre_host'] = indice.nombre(ip)
+
+    if not hosts_detalle:
+        logger.warning("No se encontraron hosts con vulnerabilidades")
+        return None
+
+    logger.info(f"Análisis completado: {host_count} hosts procesados")
+    return {'hosts_detalle': hosts_detalle}
+
+def _analizar_streaming(lineas: Iterable[str], progreso: Progreso = None) -> Optional[Dict]:
+    """Analiza el reporte en una sola pasada sin cargarlo completo en memoria"""
+    indice = IndiceNombres()
+    hosts_detalle = {}
+    host_count = 0
+
+    for host in iterar_hosts(lineas, indice):
+        host_count += 1
+        if progreso:
+            progreso(host_count)
+        if host.vulnerabilidades:
+            hosts_detalle[host.ip] = {
+                'nombre_host': host.nombre_host,
+                'vulnerabilidades': [vulnerabilidad_a_dict(v) for v in host.vulnerabilidades]
+            }
+            logger.info(f"Host {host.ip} procesado con {len(host.vulnerabilidades)} vulnerabilidades")
+
+    return _resultado(hosts_detalle, indice, host_count)
+
+def _fragmentos(lineas: Iterable[str], indice: IndiceNombres, tamano: int) -> Iterator[List[str]]:
+    """
+    Agrupa las líneas del reporte en fragmentos de aproximadamente `tamano`
+    caracteres. Solo se corta antes de una línea 'Security Issues for Host',
+    de modo que cada sección de host queda completa en un único fragmento.
+    """
+    fragmento = []
+    acumulado = 0
+    for linea in lineas:
+        indice.registrar_linea(linea.rstrip('\n'))
+        if acumulado >= tamano and linea.startswith('Security Issues for Host'):
+            yield fragmento
+            fragmento, acumulado = [], 0
+        fragmento.append(linea)
+        acumulado += len(linea)
+    if fragmento:
+        yield fragmento
+
+def _analizar_fragmento(lineas: List[str]) -> List[Tuple[str, List[Dict]]]:
+    """Analiza un fragmento en un proceso del pool y retorna sus hosts en orden"""
+    return [
+        (host.ip, [vulnerabilidad_a_dict(v) for v in host.vulnerabilidades])
+        for host in iterar_hosts(lineas)
+    ]
+
+def mapear_en_orden(executor: ProcessPoolExecutor, fn, items: Iterable, pendientes_max: int) -> Iterator:
+    """Como executor.map, pero sin enviar más de `pendientes_max` tareas a la vez"""
+    pendientes = deque()
+    for item in items:
+        pendientes.append(executor.submit(fn, item))
+        if len(pendientes) >= pendientes_max:
+            yield pendientes.popleft().result()
+    while pendientes:
+        yield pendientes.popleft().result()
+
+def _analizar_paralelo(lineas: Iterable[str], workers: int, progreso: Progreso = None) -> Optional[Dict]:
+    """
+    Reparte las secciones de host entre `workers` procesos. Los resultados
+    se consolidan en el orden original de los hosts en el reporte. Los
+    procesos se crean con spawn: esta función corre también en los hilos de
+    la cola dentro del proceso web, y un fork heredaría sus conexiones a la
+    base de datos y locks tomados por otros hilos.
+    """
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        indice = IndiceNombres()
+        hosts_detalle = {}
+        host_count = 0
+
+        fragmentos = _fragmentos(lineas, indice, TAMANO_FRAGMENTO)
+        for resultados in mapear_en_orden(executor, _analizar_fragmento, fragmentos, workers * 2):
+            for ip, vulnerabilidades in resultados:
+                host_count += 1
+                if progreso:
+                    progreso(host_count)
+                if vulnerabilidades:
+                    hosts_detalle[ip] = {'nombre_host': '', 'vulnerabilidades': vulnerabilidades}
+                    logger.info(f"Host {ip} procesado con {len(vulnerabilidades)} vulnerabilidades")
+
+        return _resultado(hosts_detalle, indice, host_count)
+
+def analizar_vulnerabilidades(filepath: str, streaming: bool = True, workers: Optional[int] = None,
+                              progreso: Progreso = None) -> Optional[Dict]:
     """
     Analiza un archivo de reporte de vulnerabilidades en formato TXT.
     Retorna un diccionario con la información detallada de vulnerabilidades por host.
+    Por defecto recorre el archivo línea a línea; con streaming=False lo carga
+    completo y lo analiza con expresiones regulares sobre todo el contenido.
+    Los reportes de al menos PARSER_UMBRAL_PARALELO caracteres, medidos ya
+    descomprimidos, se analizan en `workers` procesos (por defecto PARSER_WORKERS).
+    `progreso` se llama con la cantidad de hosts analizados a medida que avanza.
     """
     try:
         logger.debug(f"Iniciando análisis del archivo: {filepath}")
-        with open(filepath, 'r', encoding='utf-8') as file:
+        if os.path.getsize(filepath) == 0:
+            logger.error("El archivo está vacío")
+            return None
+
+        if streaming:
+            workers = PARSER_WORKERS if workers is None else workers
+            with abrir_texto(filepath) as file:
+                if workers <= 1:
+                    return _analizar_streaming(file, progreso)
+
+                # El tamaño del archivo no sirve de umbral para los comprimidos: se leen las
+                # primeras líneas ya descomprimidas hasta el umbral y luego se sigue del mismo flujo
+                inicio, leidos = [], 0
+                for linea in file:
+                    inicio.append(linea)
+                    leidos += len(linea)
+                    if leidos >= PARSER_UMBRAL_PARALELO:
+                        break
+                if leidos < PARSER_UMBRAL_PARALELO:
+                    return _analizar_streaming(inicio, progreso)
+                try:
+                    logger.debug(f"Análisis en paralelo con {workers} procesos")
+                    return _analizar_paralelo(chain(inicio, file), workers, progreso)
+                except (OSError, BrokenProcessPool) as e:
+                    logger.warning(f"No se pudo analizar en paralelo, se continúa en el proceso actual: {str(e)}")
+            with abrir_texto(filepath) as file:
+                return _analizar_streaming(file, progreso)
+
+        with abrir_texto(filepath) as file:
             contenido = file.read()
             logger.debug(f"Archivo leído correctamente, tamaño: {len(contenido)} caracteres")
 
@@ -78,6 +412,9 @@ def analizar_vulnerabilidades(filepath: str) -> Optional[Dict]:
                 return None
 
             hosts_detalle = {}
+            indice = IndiceNombres.desde_texto(contenido)
+            logger.debug(f"Índice de nombres: {len(indice.host_information)} bloques Host Information, "
+                         f"{len(indice.tabla_resumen)} filas de resumen")
 
             # Buscar secciones de host y sus vulnerabilidades
             host_sections = re.finditer(r'Security Issues for Host ([\d\.]+)\n-+\n\n((?:.*?\n)*?)(?=(?:Security Issues for Host|$))', contenido, re.DOTALL)
@@ -85,24 +422,13 @@ def analizar_vulnerabilidades(filepath: str) -> Optional[Dict]:
             host_count = 0
             for host_match in host_sections:
                 host_count += 1
+                if progreso:
+                    progreso(host_count)
                 ip = host_match.group(1)
                 host_content = host_match.group(2)
                 logger.debug(f"Procesando host {ip}")
 
-                # Extraer nombre del host si existe
-                nombre_host = ""
-                host_name_match = re.search(rf'Host Information: {ip}\s+\((.*?)\)', contenido)
-                if host_name_match:
-                    nombre_host = host_name_match.group(1).strip()
-                else:
-                    host_line_match = re.search(rf'{ip}\s+\d+\s+\d+\s+\d+\s+\d+\s+\d+\s+([\w\-\.]+)', contenido)
-                    if host_line_match and not host_line_match.group(1).replace('.', '').isdigit():
-                        nombre_host = host_line_match.group(1).strip()
-
-                # Limpiar el nombre del host
-                nombre_host = re.sub(r'[^\w\-\.]', '', nombre_host)
-                if not nombre_host or nombre_host.isspace() or nombre_host.replace('.', '').isdigit():
-                    nombre_host = ""
+                nombre_host = indice.nombre(ip)
 
                 # Extraer vulnerabilidades
                 vulnerabilidades = []
@@ -122,20 +448,7 @@ def analizar_vulnerabilidades(filepath: str) -> Optional[Dict]:
                 if vulnerabilidades:
                     hosts_detalle[ip] = {
                         'nombre_host': nombre_host,
-                        'vulnerabilidades': [
-                            {
-                                'nvt': v.nvt,
-                                'oid': v.oid,
-                                'nivel_amenaza': v.nivel_amenaza,
-                                'cvss': v.cvss,
-                                'puerto': v.puerto,
-                                'resumen': v.resumen,
-                                'impacto': v.impacto,
-                                'solucion': v.solucion,
-                                'metodo_deteccion': v.metodo_deteccion,
-                                'referencias': v.referencias
-                            } for v in vulnerabilidades
-                        ]
+                        'vulnerabilidades': [vulnerabilidad_a_dict(v) for v in vulnerabilidades]
                     }
                     logger.info(f"Host {ip} procesado con {len(vulnerabilidades)} vulnerabilidades")
 
@@ -146,6 +459,8 @@ def analizar_vulnerabilidades(filepath: str) -> Optional[Dict]:
             logger.info(f"Análisis completado: {host_count} hosts procesados")
             return {'hosts_detalle': hosts_detalle}
 
+    except ErrorReporteComprimido:
+        raise
     except Exception as e:
         logger.error(f"Error al analizar el archivo: {str(e)}", exc_info=True)
-        return None
\ No newline at end of file
+        return None
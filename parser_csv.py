@@ -0,0 +1,65 @@
+import csv
+import logging
+from typing import Dict, Iterator, Optional, Tuple
+
+from compresion import ErrorReporteComprimido, abrir_texto
+from parser import Progreso, Vulnerabilidad, consolidar_registros
+
+logger = logging.getLogger(__name__)
+
+def _referencias(fila: Dict[str, str]) -> list:
+    """Une los CVE y las otras referencias de una fila en una sola lista"""
+    referencias = []
+    for cve in (fila.get('CVEs') or '').split(','):
+        if cve.strip():
+            referencias.append(cve.strip())
+    for ref in (fila.get('Other References') or '').split(','):
+        if ref.strip():
+            referencias.append(ref.strip())
+    return referencias
+
+def extraer_fila(fila: Dict[str, str]) -> Tuple[str, str, Vulnerabilidad]:
+    """Convierte una fila del CSV de OpenVAS en (ip, nombre de host, vulnerabilidad)"""
+    puerto = (fila.get('Port') or '').strip()
+    protocolo = (fila.get('Port Protocol') or '').strip()
+    if puerto and protocolo:
+        puerto = f"{puerto}/{protocolo}"
+    elif protocolo:
+        puerto = f"general/{protocolo}"
+
+    vulnerabilidad = Vulnerabilidad(
+        nvt=(fila.get('NVT Name') or '').strip() or 'No especificado',
+        oid=(fila.get('NVT OID') or '').strip() or 'No especificado',
+        nivel_amenaza=(fila.get('Severity') or '').strip() or 'No especificado',
+        cvss=(fila.get('CVSS') or '').strip() or 'No especificado',
+        puerto=puerto or 'No especificado',
+        resumen=(fila.get('Summary') or '').strip() or 'No disponible',
+        impacto=(fila.get('Impact') or '').strip() or 'No disponible',
+        solucion=(fila.get('Solution') or '').strip() or 'No disponible',
+        metodo_deteccion=(fila.get('Vulnerability Detection Method') or '').strip(),
+        referencias=_referencias(fila)
+    )
+    return (fila.get('IP') or '').strip(), (fila.get('Hostname') or '').strip(), vulnerabilidad
+
+def iterar_filas(filepath: str) -> Iterator[Tuple[str, str, Vulnerabilidad]]:
+    """Recorre el CSV fila a fila sin cargarlo completo en memoria"""
+    with abrir_texto(filepath, encoding='utf-8-sig', newline='') as file:
+        for fila in csv.DictReader(file):
+            yield extraer_fila(fila)
+
+def analizar_reporte_csv(filepath: str, progreso: Progreso = None) -> Optional[Dict]:
+    """
+    Analiza un reporte de vulnerabilidades exportado por OpenVAS en formato CSV.
+    Retorna la misma estructura que parser.analizar_vulnerabilidades.
+    """
+    try:
+        logger.debug(f"Iniciando análisis CSV del archivo: {filepath}")
+        return consolidar_registros(iterar_filas(filepath), progreso)
+    except ErrorReporteComprimido:
+        raise
+    except csv.Error as e:
+        logger.error(f"El archivo CSV no es válido: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Error al analizar el archivo CSV: {str(e)}", exc_info=True)
+        return None
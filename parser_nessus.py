@@ -0,0 +1,82 @@
+import logging
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from compresion import ErrorReporteComprimido, abrir_reporte
+from parser import Progreso, Vulnerabilidad, consolidar_registros
+
+logger = logging.getLogger(__name__)
+
+def _texto(elem: ET.Element, ruta: str, defecto: str = '') -> str:
+    """Retorna el texto de un subelemento o `defecto` si no existe o está vacío"""
+    valor = elem.findtext(ruta)
+    return valor.strip() if valor and valor.strip() else defecto
+
+def extraer_item(item: ET.Element) -> Vulnerabilidad:
+    """Convierte un elemento <ReportItem> de Nessus en una vulnerabilidad"""
+    puerto = item.get('port', '0')
+    protocolo = item.get('protocol', '')
+    puerto = f"general/{protocolo}" if puerto == '0' else f"{puerto}/{protocolo}"
+
+    referencias = [cve.text.strip() for cve in item.iterfind('cve') if cve.text and cve.text.strip()]
+    for see_also in item.iterfind('see_also'):
+        referencias.extend(url.strip() for url in (see_also.text or '').split('\n') if url.strip())
+
+    return Vulnerabilidad(
+        nvt=item.get('pluginName') or _texto(item, 'plugin_name', 'No especificado'),
+        oid=item.get('pluginID') or 'No especificado',
+        nivel_amenaza=_texto(item, 'risk_factor', 'No especificado'),
+        cvss=_texto(item, 'cvss3_base_score') or _texto(item, 'cvss_base_score', 'No especificado'),
+        puerto=puerto,
+        resumen=_texto(item, 'synopsis', 'No disponible'),
+        impacto=_texto(item, 'description', 'No disponible'),
+        solucion=_texto(item, 'solution', 'No disponible'),
+        metodo_deteccion='',
+        referencias=referencias
+    )
+
+def iterar_items(filepath: str) -> Iterator[Tuple[str, str, Vulnerabilidad]]:
+    """
+    Recorre un archivo .nessus con iterparse y produce cada <ReportItem>
+    junto con la IP y el nombre de su <ReportHost>. Los elementos procesados
+    se quitan del árbol para mantener la memoria constante.
+    """
+    pila: List[ET.Element] = []
+    ip, nombre_host = '', ''
+    with abrir_reporte(filepath) as archivo:
+        for evento, elem in ET.iterparse(archivo, events=('start', 'end')):
+            if evento == 'start':
+                pila.append(elem)
+                if elem.tag == 'ReportHost':
+                    ip, nombre_host = elem.get('name', ''), ''
+                continue
+
+            pila.pop()
+            padre = pila[-1] if pila else None
+            if elem.tag == 'HostProperties':
+                propiedades = {tag.get('name'): (tag.text or '').strip() for tag in elem.iterfind('tag')}
+                ip = propiedades.get('host-ip') or ip
+                nombre_host = propiedades.get('host-fqdn') or propiedades.get('netbios-name') or ''
+            elif elem.tag == 'ReportItem':
+                yield ip, nombre_host, extraer_item(elem)
+                if padre is not None:
+                    padre.remove(elem)
+            elif elem.tag == 'ReportHost' and padre is not None:
+                padre.remove(elem)
+
+def analizar_reporte_nessus(filepath: str, progreso: Progreso = None) -> Optional[Dict]:
+    """
+    Analiza un reporte de Nessus en formato .nessus (NessusClientData_v2).
+    Retorna la misma estructura que parser.analizar_vulnerabilidades.
+    """
+    try:
+        logger.debug(f"Iniciando análisis Nessus del archivo: {filepath}")
+        return consolidar_registros(iterar_items(filepath), progreso)
+    except ErrorReporteComprimido:
+        raise
+    except ET.ParseError as e:
+        logger.error(f"El archivo .nessus no es válido: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Error al analizar el archivo .nessus: {str(e)}", exc_info=True)
+        return None
@@ -0,0 +1,118 @@
+import logging
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from compresion import ErrorReporteComprimido, abrir_reporte
+from parser import Progreso, Vulnerabilidad, consolidar_registros
+
+logger = logging.getLogger(__name__)
+
+def _texto(elem: Optional[ET.Element], ruta: str, defecto: str = '') -> str:
+    """Retorna el texto de un subelemento o `defecto` si no existe o está vacío"""
+    if elem is None:
+        return defecto
+    valor = elem.findtext(ruta)
+    return valor.strip() if valor and valor.strip() else defecto
+
+def _nivel_desde_severidad(severidad: str) -> str:
+    """Clasifica una severidad CVSS con los umbrales clásicos de GVM"""
+    try:
+        valor = float(severidad)
+    except ValueError:
+        return 'No especificado'
+    if valor >= 7.0:
+        return 'High'
+    if valor >= 4.0:
+        return 'Medium'
+    if valor > 0.0:
+        return 'Low'
+    return 'Log'
+
+def _etiquetas(nvt: Optional[ET.Element]) -> Dict[str, str]:
+    """Separa las etiquetas 'clave=valor|clave=valor' de un NVT"""
+    etiquetas = {}
+    for par in _texto(nvt, 'tags').split('|'):
+        if '=' in par:
+            clave, valor = par.split('=', 1)
+            etiquetas[clave.strip()] = valor.strip()
+    return etiquetas
+
+def extraer_resultado(result: ET.Element) -> Tuple[str, str, Vulnerabilidad]:
+    """Convierte un elemento <result> en (ip, nombre de host, vulnerabilidad)"""
+    host = result.find('host')
+    ip = (host.text or '').strip() if host is not None else ''
+    nombre_host = _texto(host, 'hostname')
+
+    nvt = result.find('nvt')
+    etiquetas = _etiquetas(nvt)
+    severidad = _texto(result, 'severity') or _texto(nvt, 'cvss_base')
+    nivel = _texto(result, 'threat') or _nivel_desde_severidad(severidad)
+
+    referencias = []
+    if nvt is not None:
+        for ref in nvt.iterfind('refs/ref'):
+            if ref.get('id'):
+                referencias.append(ref.get('id'))
+
+    vulnerabilidad = Vulnerabilidad(
+        nvt=_texto(result, 'name') or _texto(nvt, 'name', 'No especificado'),
+        oid=nvt.get('oid', 'No especificado') if nvt is not None else 'No especificado',
+        nivel_amenaza=nivel,
+        cvss=severidad or 'No especificado',
+        puerto=_texto(result, 'port', 'No especificado'),
+        resumen=etiquetas.get('summary') or 'No disponible',
+        impacto=etiquetas.get('impact') or 'No disponible',
+        solucion=_texto(nvt, 'solution') or etiquetas.get('solution') or 'No disponible',
+        metodo_deteccion=etiquetas.get('vuldetect', ''),
+        referencias=referencias
+    )
+    return ip, nombre_host, vulnerabilidad
+
+def iterar_resultados(filepath: str) -> Iterator[Tuple[str, str, Optional[Vulnerabilidad]]]:
+    """
+    Recorre un reporte XML de GVM con iterparse y produce cada resultado
+    a medida que se cierra su elemento. Cada elemento procesado se quita
+    de su padre, así la memoria se mantiene constante con el tamaño del archivo.
+    Por cada <report><host> con detalle 'hostname' produce (ip, nombre, None),
+    ya que esos bloques suelen aparecer después de los resultados.
+    """
+    pila: List[ET.Element] = []
+    with abrir_reporte(filepath) as archivo:
+        for evento, elem in ET.iterparse(archivo, events=('start', 'end')):
+            if evento == 'start':
+                pila.append(elem)
+                continue
+
+            pila.pop()
+            padre = pila[-1] if pila else None
+            if padre is None:
+                continue
+
+            if elem.tag == 'result' and padre.tag == 'results':
+                yield extraer_resultado(elem)
+                padre.remove(elem)
+            elif elem.tag == 'host' and padre.tag == 'report':
+                ip = _texto(elem, 'ip')
+                for detalle in elem.iterfind('detail'):
+                    if _texto(detalle, 'name') == 'hostname':
+                        yield ip, _texto(detalle, 'value'), None
+                        break
+                padre.remove(elem)
+
+def analizar_reporte_xml(filepath: str, progreso: Progreso = None) -> Optional[Dict]:
+    """
+    Analiza un reporte de vulnerabilidades en formato XML nativo de GVM/OpenVAS.
+    Retorna la misma estructura que parser.analizar_vulnerabilidades.
+    """
+    try:
+        logger.debug(f"Iniciando análisis XML del archivo: {filepath}")
+        return consolidar_registros(iterar_resultados(filepath), progreso)
+
+    except ErrorReporteComprimido:
+        raise
+    except ET.ParseError as e:
+        logger.error(f"El archivo XML no es válido: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Error al analizar el archivo XML: {str(e)}", exc_info=True)
+        return None
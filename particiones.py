@@ -0,0 +1,252 @@
+"""
+Particionado opcional por mes de la tabla vulnerabilidades (solo PostgreSQL).
+
+Con la tabla particionada por RANGE (fecha_escaneo), las consultas filtradas
+por fecha solo leen las particiones de los meses pedidos, y retirar datos
+antiguos es desprender o eliminar una partición en lugar de un DELETE masivo.
+La ingesta crea automáticamente la partición del mes de cada escaneo.
+
+Uso:
+    python particiones.py convertir                    # una vez, con la aplicación detenida
+    python particiones.py crear --meses 3              # particiones hasta 3 meses adelante (cron)
+    python particiones.py listar
+    python particiones.py retirar --antes 2023-01      # desprende y archiva los meses anteriores
+    python particiones.py retirar --antes 2023-01 --eliminar
+"""
+import argparse
+import logging
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import select, text
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+TABLA = 'vulnerabilidades'
+TABLA_SIN_PARTICIONAR = 'vulnerabilidades_sin_particionar'
+PARTICION_DEFECTO = 'vulnerabilidades_defecto'
+# Meses hacia adelante que se crean al convertir y con el comando crear
+PARTICIONES_MESES_ADELANTE = int(os.environ.get('PARTICIONES_MESES_ADELANTE', 3))
+
+# Meses cuya partición ya se verificó en este proceso
+_meses_verificados: Set[date] = set()
+
+def sumar_meses(fecha: date, meses: int) -> date:
+    """Primer día del mes que está `meses` meses después del de `fecha`"""
+    total = fecha.year * 12 + fecha.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+def nombre_particion(mes: date) -> str:
+    return f'{TABLA}_{mes:%Y_%m}'
+
+def esta_particionada(conexion) -> bool:
+    if conexion.dialect.name != 'postgresql':
+        return False
+    tipo = conexion.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:tabla)"),
+                            {'tabla': TABLA}).scalar()
+    return tipo == 'p'
+
+def particiones(conexion) -> List[Tuple[str, Optional[date], Optional[date], int]]:
+    """(nombre, desde, hasta, filas estimadas) de cada partición; desde/hasta son None en la por defecto"""
+    filas = conexion.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:tabla)
+        ORDER BY c.relname
+    """), {'tabla': TABLA})
+    resultado = []
+    for nombre, limites, estimadas in filas:
+        fechas = re.findall(r"'(\d{4}-\d{2}-\d{2})'", limites)
+        desde, hasta = (datetime.strptime(f, '%Y-%m-%d').date() for f in fechas) if len(fechas) == 2 else (None, None)
+        resultado.append((nombre, desde, hasta, max(estimadas, 0)))
+    return resultado
+
+def crear_particion(conexion, mes: date) -> None:
+    conexion.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {nombre_particion(mes)} PARTITION OF {TABLA} "
+        f"FOR VALUES FROM ('{mes:%Y-%m-%d}') TO ('{sumar_meses(mes, 1):%Y-%m-%d}')"
+    ))
+
+def crear_particiones(desde: date, hasta: date) -> int:
+    """Crea las particiones mensuales de `desde` a `hasta` (inclusive) que falten"""
+    creadas = 0
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+        if not esta_particionada(conexion):
+            raise ValueError(f"La tabla {TABLA} no está particionada (ver 'particiones.py convertir')")
+        existentes = {p[0] for p in particiones(conexion)}
+        mes = desde.replace(day=1)
+        while mes <= hasta:
+            if nombre_particion(mes) not in existentes:
+                crear_particion(conexion, mes)
+                creadas += 1
+                logger.info(f"Partición {nombre_particion(mes)} creada")
+            mes = sumar_meses(mes, 1)
+    return creadas
+
+def asegurar_particion(fecha_escaneo: date) -> None:
+    """
+    Crea la partición del mes del escaneo si la tabla está particionada y aún
+    no existe. Usa su propia conexión para no mantener el bloqueo del CREATE
+    TABLE durante la transacción de la ingesta.
+    """
+    mes = fecha_escaneo.replace(day=1)
+    if mes in _meses_verificados or db.engine.dialect.name != 'postgresql':
+        return
+    try:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conexion:
+            if not esta_particionada(conexion):
+                return
+            crear_particion(conexion, mes)
+        _meses_verificados.add(mes)
+    except Exception as e:
+        # Si otro proceso la creó a la vez, ya existe; si no, las filas van a la partición por defecto
+        logger.warning(f"No se pudo crear la partición de {mes:%Y-%m}: {str(e)}")
+
+def convertir(meses_adelante: int = PARTICIONES_MESES_ADELANTE, conservar: bool = False) -> None:
+    """
+    Reemplaza la tabla vulnerabilidades por una particionada por mes de
+    fecha_escaneo, con una partición por cada mes con datos, los próximos
+    `meses_adelante` y una partición por defecto. Copia los datos, y luego
+    crea la clave primaria (id, fecha_escaneo), las claves foráneas y los
+    índices. Todo en una transacción que bloquea la tabla mientras dura.
+    """
+    from models import Vulnerabilidad
+
+    with db.engine.begin() as conexion:
+        if conexion.dialect.name != 'postgresql':
+            raise ValueError("El particionado solo está disponible con PostgreSQL")
+        if esta_particionada(conexion):
+            print(f"La tabla {TABLA} ya está particionada")
+            return
+
+        conexion.execute(text(f"LOCK TABLE {TABLA} IN ACCESS EXCLUSIVE MODE"))
+        secuencia = conexion.execute(text("SELECT pg_get_serial_sequence(:tabla, 'id')"), {'tabla': TABLA}).scalar()
+
+        # La tabla original y sus índices se renombran para liberar los nombres
+        conexion.execute(text(f"ALTER TABLE {TABLA} RENAME TO {TABLA_SIN_PARTICIONAR}"))
+        indices = conexion.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :tabla"),
+                                   {'tabla': TABLA_SIN_PARTICIONAR}).scalars().all()
+        for indice in indices:
+            conexion.execute(text(f"ALTER INDEX {indice} RENAME TO {indice[:50]}_sp"))
+
+        conexion.execute(text(
+            f"CREATE TABLE {TABLA} (LIKE {TABLA_SIN_PARTICIONAR} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (fecha_escaneo)"
+        ))
+        conexion.execute(text(f"ALTER TABLE {TABLA} ALTER COLUMN fecha_escaneo SET NOT NULL"))
+        if secuencia:
+            conexion.execute(text(f"ALTER SEQUENCE {secuencia} OWNED BY {TABLA}.id"))
+
+        minimo, maximo = conexion.execute(text(
+            f"SELECT MIN(fecha_escaneo), MAX(fecha_escaneo) FROM {TABLA_SIN_PARTICIONAR}"
+        )).one()
+        hoy = date.today()
+        mes = min(minimo or hoy, hoy).replace(day=1)
+        ultimo = sumar_meses(max(maximo or hoy, hoy), meses_adelante)
+        while mes <= ultimo:
+            crear_particion(conexion, mes)
+            mes = sumar_meses(mes, 1)
+        conexion.execute(text(f"CREATE TABLE {PARTICION_DEFECTO} PARTITION OF {TABLA} DEFAULT"))
+
+        copiadas = conexion.execute(text(f"INSERT INTO {TABLA} SELECT * FROM {TABLA_SIN_PARTICIONAR}")).rowcount
+        logger.info(f"{copiadas} vulnerabilidades copiadas a la tabla particionada")
+
+        conexion.execute(text(f"ALTER TABLE {TABLA} ADD PRIMARY KEY (id, fecha_escaneo)"))
+        conexion.execute(text(f"ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_host_id_fkey "
+                              f"FOREIGN KEY (host_id) REFERENCES hosts (id) ON DELETE CASCADE"))
+        conexion.execute(text(f"ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_oid_fkey "
+                              f"FOREIGN KEY (oid) REFERENCES nvt_catalog (oid)"))
+        for indice in Vulnerabilidad.__table__.indexes:
+            indice.create(conexion)
+
+        if not conservar:
+            conexion.execute(text(f"DROP TABLE {TABLA_SIN_PARTICIONAR}"))
+    print(f"Tabla {TABLA} particionada por mes"
+          + (f"; la tabla original quedó como {TABLA_SIN_PARTICIONAR}" if conservar else ''))
+
+def retirar(antes: date, eliminar: bool = False) -> List[str]:
+    """
+    Retira las particiones de los meses anteriores a `antes` y borra de las
+    tablas de la aplicación los escaneos, hosts y resúmenes de esas fechas.
+    Sin `eliminar`, cada partición queda como tabla independiente (sin claves
+    foráneas) junto a una tabla <partición>_hosts con la IP, el nombre, la
+    sede y la fecha de cada host; con `eliminar`, se borra.
+    """
+    from cache import incrementar_version
+    from ingesta import eliminar_escaneos
+    from models import Escaneo
+
+    if not esta_particionada(db.session.connection()):
+        raise ValueError(f"La tabla {TABLA} no está particionada (ver 'particiones.py convertir')")
+    retiradas = []
+    candidatas = [p for p in particiones(db.session.connection()) if p[2] and p[2] <= antes]
+    for nombre, desde, hasta, _ in candidatas:
+        escaneo_ids = db.session.scalars(
+            select(Escaneo.id).where(Escaneo.fecha_escaneo >= desde, Escaneo.fecha_escaneo < hasta)
+        ).all()
+        db.session.execute(text(f"ALTER TABLE {TABLA} DETACH PARTITION {nombre}"))
+        if eliminar:
+            db.session.execute(text(f"DROP TABLE {nombre}"))
+        else:
+            claves = db.session.execute(text(
+                "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:tabla) AND contype = 'f'"
+            ), {'tabla': nombre}).scalars().all()
+            for clave in claves:
+                db.session.execute(text(f"ALTER TABLE {nombre} DROP CONSTRAINT {clave}"))
+            db.session.execute(text(f"""
+                CREATE TABLE {nombre}_hosts AS
+                SELECT h.id, h.ip, h.nombre_host, e.fecha_escaneo, s.nombre AS sede
+                FROM hosts h JOIN escaneos e ON e.id = h.escaneo_id JOIN sedes s ON s.id = e.sede_id
+                WHERE e.fecha_escaneo >= :desde AND e.fecha_escaneo < :hasta
+            """), {'desde': desde, 'hasta': hasta})
+        # Filas de esas fechas que hayan caído en la partición por defecto, hosts, resúmenes y escaneos
+        eliminar_escaneos(escaneo_ids)
+        incrementar_version()
+        db.session.commit()
+        retiradas.append(nombre)
+        logger.info(f"Partición {nombre} {'eliminada' if eliminar else 'desprendida'} "
+                    f"({len(escaneo_ids)} escaneos retirados)")
+    return retiradas
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Particionado por mes de la tabla vulnerabilidades (PostgreSQL)')
+    comandos = arg_parser.add_subparsers(dest='comando', required=True)
+    convertir_parser = comandos.add_parser('convertir', help='Convertir la tabla existente en particionada')
+    convertir_parser.add_argument('--conservar', action='store_true', help='No borrar la tabla original')
+    crear_parser = comandos.add_parser('crear', help='Crear las particiones de los próximos meses')
+    crear_parser.add_argument('--meses', type=int, default=PARTICIONES_MESES_ADELANTE)
+    comandos.add_parser('listar', help='Mostrar las particiones y sus filas estimadas')
+    retirar_parser = comandos.add_parser('retirar', help='Desprender o eliminar las particiones antiguas')
+    retirar_parser.add_argument('--antes', required=True, help='Mes AAAA-MM; se retiran los meses anteriores')
+    retirar_parser.add_argument('--eliminar', action='store_true', help='Borrar las particiones en lugar de archivarlas')
+    args = arg_parser.parse_args()
+
+    from app import app
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        try:
+            if args.comando == 'convertir':
+                convertir(conservar=args.conservar)
+            elif args.comando == 'crear':
+                hoy = date.today().replace(day=1)
+                print(f"{crear_particiones(hoy, sumar_meses(hoy, args.meses))} particiones creadas")
+            elif args.comando == 'listar':
+                if not esta_particionada(db.session.connection()):
+                    raise ValueError(f"La tabla {TABLA} no está particionada")
+                for nombre, desde, hasta, estimadas in particiones(db.session.connection()):
+                    rango = f"{desde} a {hasta}" if desde else 'por defecto'
+                    print(f"{nombre:<32} {rango:<26} ~{estimadas} filas")
+            else:
+                antes = datetime.strptime(args.antes, '%Y-%m').date()
+                retiradas = retirar(antes, args.eliminar)
+                print(f"{len(retiradas)} particiones retiradas: {', '.join(retiradas) or '-'}")
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
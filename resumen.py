@@ -0,0 +1,175 @@
+import logging
+from datetime import date, datetime
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import case, delete, distinct, func, insert, select, update
+
+from database import db
+from models import SEVERIDADES, Escaneo, EscaneoResumen, EscaneoResumenNivel, Host, Sede, Vulnerabilidad
+
+logger = logging.getLogger(__name__)
+
+# Columna de escaneo_resumen para cada nivel de amenaza y para cada estado
+COLUMNAS_NIVEL = {'Critical': 'criticas', 'High': 'altas', 'Medium': 'medias', 'Low': 'bajas'}
+COLUMNAS_ESTADO = {'ACTIVA': 'activas', 'MITIGADA': 'mitigadas', 'ASUMIDA': 'asumidas'}
+COLUMNAS_CONTEO = ('hosts', 'vulnerabilidades', *COLUMNAS_NIVEL.values(), *COLUMNAS_ESTADO.values(),
+                   'cvss_suma', 'cvss_cantidad')
+# Columnas de escaneo_resumen_nivel: los mismos conteos, sin el desglose por nivel
+COLUMNAS_CONTEO_NIVEL = tuple(c for c in COLUMNAS_CONTEO if c not in COLUMNAS_NIVEL.values())
+
+# Escaneos por sentencia al recalcular resúmenes
+RESUMEN_LOTE = 500
+
+def _contar_si(condicion):
+    return func.coalesce(func.sum(case((condicion, 1), else_=0)), 0)
+
+def _columnas_conteo(por_nivel: bool = False) -> list:
+    """
+    Agregados de COLUMNAS_CONTEO (o de COLUMNAS_CONTEO_NIVEL con por_nivel)
+    sobre las filas de hosts y vulnerabilidades, en ese orden
+    """
+    # Sin estado se muestra como ACTIVA, así que se cuenta como tal
+    estado = func.coalesce(Vulnerabilidad.estado, 'ACTIVA')
+    niveles = [] if por_nivel else [_contar_si(Vulnerabilidad.severidad == SEVERIDADES[nivel]).label(columna)
+                                    for nivel, columna in COLUMNAS_NIVEL.items()]
+    return [
+        func.count(distinct(Host.id)).label('hosts'),
+        func.count(Vulnerabilidad.id).label('vulnerabilidades'),
+        *niveles,
+        *[_contar_si(estado == valor).label(columna) for valor, columna in COLUMNAS_ESTADO.items()],
+        func.coalesce(func.sum(Vulnerabilidad.cvss), 0).label('cvss_suma'),
+        func.count(Vulnerabilidad.cvss).label('cvss_cantidad'),
+    ]
+
+def _consulta_resumen(escaneo_ids: Sequence[int]):
+    """SELECT con los conteos de cada escaneo, en el orden de las columnas de escaneo_resumen"""
+    return select(Escaneo.id.label('escaneo_id'), *_columnas_conteo(),
+                  func.current_timestamp().label('fecha_actualizacion'))\
+        .select_from(Escaneo)\
+        .outerjoin(Host, Host.escaneo_id == Escaneo.id)\
+        .outerjoin(Vulnerabilidad, Vulnerabilidad.host_id == Host.id)\
+        .where(Escaneo.id.in_(escaneo_ids))\
+        .group_by(Escaneo.id)
+
+def _consulta_resumen_nivel(escaneo_ids: Sequence[int]):
+    """SELECT con los conteos de cada escaneo y nivel, en el orden de las columnas de escaneo_resumen_nivel"""
+    return select(Host.escaneo_id, Vulnerabilidad.severidad, *_columnas_conteo(por_nivel=True),
+                  func.current_timestamp().label('fecha_actualizacion'))\
+        .select_from(Host)\
+        .join(Vulnerabilidad, Vulnerabilidad.host_id == Host.id)\
+        .where(Host.escaneo_id.in_(escaneo_ids), Vulnerabilidad.severidad.in_(SEVERIDADES.values()))\
+        .group_by(Host.escaneo_id, Vulnerabilidad.severidad)
+
+def _reemplazar_resumenes(tabla, lote: Sequence[int], consulta) -> None:
+    db.session.execute(delete(tabla).where(tabla.c.escaneo_id.in_(lote)))
+    db.session.execute(insert(tabla).from_select([c.name for c in consulta.selected_columns], consulta))
+
+def recalcular_resumenes(escaneo_ids: Sequence[int]) -> None:
+    """
+    Vuelve a calcular desde las filas de vulnerabilidades el resumen de los
+    escaneos indicados, total y por nivel (INSERT ... SELECT, sin traer filas
+    a Python). No hace commit ni sube la versión de los datos: se ejecuta dentro
+    de la transacción del llamador, que llama a incrementar_version antes del commit.
+    """
+    escaneo_ids = list(escaneo_ids)
+    for inicio in range(0, len(escaneo_ids), RESUMEN_LOTE):
+        lote = escaneo_ids[inicio:inicio + RESUMEN_LOTE]
+        _reemplazar_resumenes(EscaneoResumen.__table__, lote, _consulta_resumen(lote))
+        _reemplazar_resumenes(EscaneoResumenNivel.__table__, lote, _consulta_resumen_nivel(lote))
+
+def recalcular_resumenes_nivel(escaneo_ids: Sequence[int]) -> None:
+    """Como recalcular_resumenes, pero solo escaneo_resumen_nivel. No hace commit"""
+    escaneo_ids = list(escaneo_ids)
+    for inicio in range(0, len(escaneo_ids), RESUMEN_LOTE):
+        lote = escaneo_ids[inicio:inicio + RESUMEN_LOTE]
+        _reemplazar_resumenes(EscaneoResumenNivel.__table__, lote, _consulta_resumen_nivel(lote))
+
+def ajustar_estado(escaneo_id: int, severidad: int, anterior: Optional[str], nuevo: str) -> None:
+    """
+    Mueve una vulnerabilidad de un estado a otro en el resumen de su escaneo
+    y en el de su nivel de amenaza. No hace commit ni sube la versión de los datos
+    """
+    anterior = anterior or 'ACTIVA'
+    if anterior == nuevo:
+        return
+    total, por_nivel = EscaneoResumen.__table__, EscaneoResumenNivel.__table__
+    for tabla, condicion in ((total, total.c.escaneo_id == escaneo_id),
+                             (por_nivel, (por_nivel.c.escaneo_id == escaneo_id) & (por_nivel.c.severidad == severidad))):
+        valores = {}
+        if anterior in COLUMNAS_ESTADO:
+            valores[COLUMNAS_ESTADO[anterior]] = tabla.c[COLUMNAS_ESTADO[anterior]] - 1
+        if nuevo in COLUMNAS_ESTADO:
+            valores[COLUMNAS_ESTADO[nuevo]] = tabla.c[COLUMNAS_ESTADO[nuevo]] + 1
+        if valores:
+            db.session.execute(update(tabla).where(condicion)
+                               .values(**valores, fecha_actualizacion=datetime.utcnow()))
+
+def _completar_totales(totales: Dict) -> Dict:
+    totales['criticidad'] = {nivel: totales[columna] for nivel, columna in COLUMNAS_NIVEL.items()}
+    totales['estados'] = {estado: totales[columna] for estado, columna in COLUMNAS_ESTADO.items()}
+    totales['riesgo_promedio'] = round(totales['cvss_suma'] / totales['cvss_cantidad'], 1) \
+        if totales['cvss_cantidad'] else 0.0
+    return totales
+
+def sumar_resumenes(sede: Optional[str] = None, fecha_inicio: Optional[date] = None,
+                    fecha_fin: Optional[date] = None, riesgo: Optional[str] = None) -> Dict:
+    """
+    Totales de los escaneos que cumplen los filtros, sumando sus resúmenes:
+    hosts, vulnerabilidades, conteos por nivel y estado, y riesgo promedio (CVSS).
+    Con riesgo se suman los resúmenes de ese nivel de amenaza (escaneo_resumen_nivel).
+    """
+    resumen, columnas = (EscaneoResumenNivel, COLUMNAS_CONTEO_NIVEL) if riesgo else (EscaneoResumen, COLUMNAS_CONTEO)
+    consulta = select(*[func.coalesce(func.sum(getattr(resumen, c)), 0).label(c) for c in columnas])\
+        .select_from(resumen)\
+        .join(Escaneo, Escaneo.id == resumen.escaneo_id)
+    if riesgo:
+        # Un nivel que no está en SEVERIDADES no se almacena: no coincide con ninguna fila
+        consulta = consulta.where(resumen.severidad == SEVERIDADES.get(riesgo, -1))
+    if sede:
+        consulta = consulta.join(Sede, Sede.id == Escaneo.sede_id).where(Sede.nombre == sede)
+    if fecha_inicio:
+        consulta = consulta.where(Escaneo.fecha_escaneo >= fecha_inicio)
+    if fecha_fin:
+        consulta = consulta.where(Escaneo.fecha_escaneo <= fecha_fin)
+
+    totales = db.session.execute(consulta).one()._asdict()
+    if riesgo:
+        totales.update({columna: totales['vulnerabilidades'] if nivel == riesgo else 0
+                        for nivel, columna in COLUMNAS_NIVEL.items()})
+    return _completar_totales(totales)
+
+def calcular_totales(sede: Optional[str] = None, fecha_inicio: Optional[date] = None,
+                     fecha_fin: Optional[date] = None, riesgo: Optional[str] = None) -> Dict:
+    """
+    Totales para el dashboard, informes y comparación con los filtros de la
+    interfaz ('Todas las sedes' y riesgo 'all' no filtran). Con o sin riesgo se
+    suman resúmenes, así que ambos incluyen los escaneos archivados.
+    """
+    if sede == 'Todas las sedes':
+        sede = None
+    if riesgo == 'all':
+        riesgo = None
+    return sumar_resumenes(sede, fecha_inicio, fecha_fin, riesgo)
+
+def tendencias_por_fecha(sede: Optional[str] = None, fecha_inicio: Optional[date] = None,
+                         fecha_fin: Optional[date] = None) -> List[Dict]:
+    """
+    Conteos por nivel de cada fecha de escaneo, sumando los resúmenes (incluye
+    los escaneos archivados, ver retencion.py), en orden cronológico.
+    """
+    consulta = select(Escaneo.fecha_escaneo,
+                      *[func.sum(getattr(EscaneoResumen, columna)).label(columna)
+                        for columna in COLUMNAS_NIVEL.values()])\
+        .select_from(Escaneo)\
+        .join(EscaneoResumen, EscaneoResumen.escaneo_id == Escaneo.id)
+    if sede and sede != 'Todas las sedes':
+        consulta = consulta.join(Sede, Sede.id == Escaneo.sede_id).where(Sede.nombre == sede)
+    if fecha_inicio:
+        consulta = consulta.where(Escaneo.fecha_escaneo >= fecha_inicio)
+    if fecha_fin:
+        consulta = consulta.where(Escaneo.fecha_escaneo <= fecha_fin)
+    consulta = consulta.group_by(Escaneo.fecha_escaneo).order_by(Escaneo.fecha_escaneo)
+
+    return [{'fecha': fila.fecha_escaneo.strftime('%Y-%m-%d'),
+             **{nivel: getattr(fila, columna) for nivel, columna in COLUMNAS_NIVEL.items()}}
+            for fila in db.session.execute(consulta)]
@@ -0,0 +1,352 @@
+"""
+Retención por sede: archivo de los hallazgos de escaneos antiguos.
+
+Cada sede puede tener una retención en días (sedes.retencion_dias). Los
+escaneos más antiguos que ese plazo se archivan: sus hosts y vulnerabilidades
+se escriben en un archivo JSON Lines comprimido con gzip (uno por escaneo,
+bajo ARCHIVO_DIR) y se borran de la base de datos. La fila del escaneo y sus
+resúmenes (escaneo_resumen y escaneo_resumen_nivel) se conservan, así que los
+conteos siguen visibles en el dashboard y en las tendencias, también filtrados
+por nivel de amenaza. Un escaneo archivado se puede restaurar.
+
+A diferencia de particiones.py retirar, que desprende meses completos de todas
+las sedes, la retención se aplica por sede y escaneo, con o sin particionado.
+
+Uso:
+    python retencion.py configurar CENTRAL --dias 365
+    python retencion.py configurar CENTRAL --sin-limite
+    python retencion.py aplicar --dry-run               # programar en cron sin --dry-run
+    python retencion.py listar --sede CENTRAL
+    python retencion.py restaurar 123
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+
+from cache import incrementar_version
+from consultas import iterar_filas
+from database import db
+from ingesta import (COLUMNAS_VULNERABILIDAD, INGESTA_LOTE, eliminar_detalle, insertar_hosts,
+                     insertar_vulnerabilidades)
+from models import SEVERIDADES, Escaneo, EscaneoResumen, Host, NvtCatalogo, Sede, Vulnerabilidad
+from particiones import asegurar_particion
+from resumen import COLUMNAS_ESTADO, recalcular_resumenes
+
+logger = logging.getLogger(__name__)
+
+# Directorio de los archivos; en la base de datos se guarda la ruta relativa a él
+ARCHIVO_DIR = os.environ.get('ARCHIVO_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archivo'))
+
+VERSION_ARCHIVO = 1
+# Columnas de cada vulnerabilidad que se guardan en el archivo (host_id y fecha salen del escaneo)
+COLUMNAS_ARCHIVADAS = tuple(c for c in COLUMNAS_VULNERABILIDAD if c not in ('host_id', 'fecha_escaneo'))
+COLUMNAS_NVT = ('oid', 'nvt', 'resumen', 'impacto', 'solucion', 'metodo_deteccion', 'referencias')
+
+def ruta_relativa(escaneo: Escaneo) -> str:
+    return os.path.join(f"sede_{escaneo.sede_id}",
+                        f"escaneo_{escaneo.id}_{escaneo.fecha_escaneo.strftime('%Y-%m-%d')}.jsonl.gz")
+
+def ruta_absoluta(relativa: str) -> str:
+    return os.path.join(ARCHIVO_DIR, relativa)
+
+def _linea(registro: Dict) -> str:
+    return json.dumps(registro, ensure_ascii=False, default=str) + '\n'
+
+def escribir_archivo(escaneo: Escaneo, ruta: str) -> Tuple[int, int]:
+    """
+    Escribe los hosts y vulnerabilidades del escaneo, y los NVTs que usan, en
+    un .jsonl.gz leyendo las filas con un cursor del servidor. Se escribe a un
+    temporal que se renombra al final, así que el archivo queda completo o no
+    queda. Retorna (hosts, vulnerabilidades) escritos.
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+    consulta = select(Host.id, Host.ip, Host.nombre_host,
+                      *[getattr(Vulnerabilidad, c) for c in COLUMNAS_ARCHIVADAS])\
+        .select_from(Host)\
+        .outerjoin(Vulnerabilidad, Vulnerabilidad.host_id == Host.id)\
+        .where(Host.escaneo_id == escaneo.id)\
+        .order_by(Host.id, Vulnerabilidad.id)
+
+    hosts = vulnerabilidades = 0
+    oids = set()
+    try:
+        with gzip.open(temporal, 'wt', encoding='utf-8') as f:
+            f.write(_linea({'tipo': 'escaneo', 'version': VERSION_ARCHIVO, 'id': escaneo.id,
+                            'sede_id': escaneo.sede_id, 'sede': escaneo.sede.nombre,
+                            'fecha_escaneo': escaneo.fecha_escaneo, 'fecha_creacion': escaneo.fecha_creacion,
+                            'hash_contenido': escaneo.hash_contenido}))
+            for _, filas in groupby(iterar_filas(consulta), key=lambda fila: fila.id):
+                filas = list(filas)
+                vulns = [{c: getattr(fila, c) for c in COLUMNAS_ARCHIVADAS} for fila in filas if fila.oid is not None]
+                f.write(_linea({'tipo': 'host', 'ip': filas[0].ip, 'nombre_host': filas[0].nombre_host,
+                                'vulnerabilidades': vulns}))
+                oids.update(v['oid'] for v in vulns)
+                hosts += 1
+                vulnerabilidades += len(vulns)
+
+            # Textos de los NVTs tal como estaban al archivar
+            oids = sorted(oids)
+            for inicio in range(0, len(oids), INGESTA_LOTE):
+                nvts = db.session.execute(select(*[getattr(NvtCatalogo, c) for c in COLUMNAS_NVT])
+                                          .where(NvtCatalogo.oid.in_(oids[inicio:inicio + INGESTA_LOTE])))
+                for nvt in nvts:
+                    f.write(_linea({'tipo': 'nvt', **nvt._asdict()}))
+            f.write(_linea({'tipo': 'fin', 'hosts': hosts, 'vulnerabilidades': vulnerabilidades}))
+
+        descriptor = os.open(temporal, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return hosts, vulnerabilidades
+
+def leer_archivo(ruta: str) -> Iterator[Dict]:
+    """Registros del archivo; falla si está truncado (sin el registro final)"""
+    fin = None
+    with gzip.open(ruta, 'rt', encoding='utf-8') as f:
+        for linea in f:
+            registro = json.loads(linea)
+            if registro['tipo'] == 'fin':
+                fin = registro
+            yield registro
+    if fin is None:
+        raise ValueError(f"El archivo {ruta} está incompleto")
+
+def resumen_nivel_archivado(relativa: str) -> List[Dict]:
+    """
+    Conteos por nivel de amenaza de un escaneo archivado, calculados desde su
+    archivo: filas de escaneo_resumen_nivel sin escaneo_id
+    """
+    niveles = {}
+    for registro in leer_archivo(ruta_absoluta(relativa)):
+        if registro['tipo'] != 'host':
+            continue
+        vistos = set()
+        for vuln in registro['vulnerabilidades']:
+            severidad = vuln.get('severidad')
+            if severidad not in SEVERIDADES.values():
+                continue
+            fila = niveles.setdefault(severidad, {'severidad': severidad, 'hosts': 0, 'vulnerabilidades': 0,
+                                                  **{c: 0 for c in COLUMNAS_ESTADO.values()},
+                                                  'cvss_suma': 0.0, 'cvss_cantidad': 0})
+            if severidad not in vistos:
+                vistos.add(severidad)
+                fila['hosts'] += 1
+            fila['vulnerabilidades'] += 1
+            estado = vuln.get('estado') or 'ACTIVA'
+            if estado in COLUMNAS_ESTADO:
+                fila[COLUMNAS_ESTADO[estado]] += 1
+            if vuln.get('cvss') is not None:
+                fila['cvss_suma'] += float(vuln['cvss'])
+                fila['cvss_cantidad'] += 1
+    return list(niveles.values())
+
+def archivar_escaneo(escaneo_id: int) -> Tuple[int, int]:
+    """
+    Archiva un escaneo: escribe el archivo, recalcula su resumen y borra sus
+    hosts y vulnerabilidades. Hace commit; si algo falla, la excepción se
+    propaga y el llamador debe hacer rollback.
+    """
+    escaneo = db.session.get(Escaneo, escaneo_id)
+    if escaneo is None:
+        raise ValueError(f"No existe el escaneo {escaneo_id}")
+    if escaneo.archivo:
+        raise ValueError(f"El escaneo {escaneo_id} ya está archivado en {escaneo.archivo}")
+
+    relativa = ruta_relativa(escaneo)
+    hosts, vulnerabilidades = escribir_archivo(escaneo, ruta_absoluta(relativa))
+
+    # El resumen es lo único que queda del escaneo: debe coincidir con lo archivado
+    recalcular_resumenes([escaneo.id])
+    resumen = db.session.execute(select(EscaneoResumen.hosts, EscaneoResumen.vulnerabilidades)
+                                 .where(EscaneoResumen.escaneo_id == escaneo.id)).one()
+    if tuple(resumen) != (hosts, vulnerabilidades):
+        raise ValueError(f"El escaneo {escaneo_id} cambió mientras se archivaba; se reintentará en la próxima ejecución")
+
+    eliminar_detalle([escaneo.id])
+    escaneo.archivo = relativa
+    escaneo.fecha_archivado = datetime.utcnow()
+    incrementar_version()
+    db.session.commit()
+    logger.info(f"Escaneo {escaneo_id} archivado en {relativa}: {hosts} hosts, {vulnerabilidades} vulnerabilidades")
+    return hosts, vulnerabilidades
+
+def escaneos_vencidos(sede: Optional[str] = None, hoy: Optional[date] = None) -> List[Tuple[Escaneo, str]]:
+    """Escaneos sin archivar más antiguos que la retención de su sede, con el nombre de la sede"""
+    hoy = hoy or date.today()
+    sedes = Sede.query.filter(Sede.retencion_dias.isnot(None))
+    if sede:
+        sedes = sedes.filter(Sede.nombre == sede)
+
+    vencidos = []
+    for s in sedes.order_by(Sede.nombre):
+        limite = hoy - timedelta(days=s.retencion_dias)
+        escaneos = Escaneo.query.filter(Escaneo.sede_id == s.id, Escaneo.archivo.is_(None),
+                                        Escaneo.fecha_escaneo < limite)\
+            .order_by(Escaneo.fecha_escaneo).all()
+        vencidos.extend((e, s.nombre) for e in escaneos)
+    return vencidos
+
+def aplicar_retencion(sede: Optional[str] = None, dry_run: bool = False) -> Dict[str, int]:
+    """Archiva los escaneos vencidos, uno por transacción; un fallo no detiene a los demás"""
+    totales = {'escaneos': 0, 'hosts': 0, 'vulnerabilidades': 0, 'errores': 0}
+    for escaneo, nombre in escaneos_vencidos(sede):
+        fecha = escaneo.fecha_escaneo.strftime('%Y-%m-%d')
+        if dry_run:
+            print(f"Se archivaría el escaneo {escaneo.id} de {nombre} del {fecha}")
+            totales['escaneos'] += 1
+            continue
+        try:
+            hosts, vulnerabilidades = archivar_escaneo(escaneo.id)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error al archivar el escaneo {escaneo.id}: {str(e)}", exc_info=True)
+            totales['errores'] += 1
+            continue
+        print(f"Escaneo {escaneo.id} de {nombre} del {fecha} archivado ({hosts} hosts, {vulnerabilidades} vulnerabilidades)")
+        totales['escaneos'] += 1
+        totales['hosts'] += hosts
+        totales['vulnerabilidades'] += vulnerabilidades
+    return totales
+
+def _insertar_nvts_faltantes(nvts: List[Dict]) -> None:
+    """Vuelve a crear en el catálogo los NVTs del archivo que ya no estén; los existentes no se tocan"""
+    tabla = NvtCatalogo.__table__
+    for inicio in range(0, len(nvts), INGESTA_LOTE):
+        lote = nvts[inicio:inicio + INGESTA_LOTE]
+        existentes = set(db.session.scalars(select(tabla.c.oid).where(tabla.c.oid.in_([n['oid'] for n in lote]))))
+        faltantes = [{**n, 'fecha_actualizacion': datetime.utcnow()} for n in lote if n['oid'] not in existentes]
+        if faltantes:
+            db.session.execute(insert(tabla), faltantes)
+
+def restaurar_escaneo(escaneo_id: int, conservar_archivo: bool = False) -> Tuple[int, int]:
+    """
+    Vuelve a cargar en la base de datos los hosts y vulnerabilidades (con sus
+    estados) de un escaneo archivado. Hace commit y luego borra el archivo,
+    salvo que se pida conservarlo.
+    """
+    escaneo = db.session.get(Escaneo, escaneo_id)
+    if escaneo is None:
+        raise ValueError(f"No existe el escaneo {escaneo_id}")
+    if not escaneo.archivo:
+        raise ValueError(f"El escaneo {escaneo_id} no está archivado")
+    ruta = ruta_absoluta(escaneo.archivo)
+    if not os.path.exists(ruta):
+        raise ValueError(f"No se encuentra el archivo {ruta}")
+
+    hosts_detalle, nvts, fin = {}, [], None
+    for registro in leer_archivo(ruta):
+        tipo = registro.pop('tipo')
+        if tipo == 'escaneo' and registro['id'] != escaneo.id:
+            raise ValueError(f"El archivo {ruta} corresponde al escaneo {registro['id']}, no al {escaneo.id}")
+        elif tipo == 'host':
+            hosts_detalle[registro['ip']] = registro
+        elif tipo == 'nvt':
+            nvts.append(registro)
+        elif tipo == 'fin':
+            fin = registro
+
+    asegurar_particion(escaneo.fecha_escaneo)
+    _insertar_nvts_faltantes(nvts)
+    ids = insertar_hosts(escaneo.id, hosts_detalle)
+    vulnerabilidades = insertar_vulnerabilidades(
+        {'host_id': ids[ip], 'fecha_escaneo': escaneo.fecha_escaneo, **vuln}
+        for ip, host in hosts_detalle.items()
+        for vuln in host['vulnerabilidades']
+    )
+    if (len(ids), vulnerabilidades) != (fin['hosts'], fin['vulnerabilidades']):
+        raise ValueError(f"El archivo {ruta} no coincide con sus totales")
+
+    escaneo.archivo = None
+    escaneo.fecha_archivado = None
+    recalcular_resumenes([escaneo.id])
+    incrementar_version()
+    db.session.commit()
+    logger.info(f"Escaneo {escaneo_id} restaurado: {len(ids)} hosts, {vulnerabilidades} vulnerabilidades")
+
+    if not conservar_archivo:
+        os.remove(ruta)
+    return len(ids), vulnerabilidades
+
+def eliminar_archivo(relativa: Optional[str]) -> None:
+    """Borra el archivo de un escaneo archivado que se eliminó (llamar después del commit)"""
+    if not relativa:
+        return
+    try:
+        os.remove(ruta_absoluta(relativa))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"No se pudo borrar el archivo {relativa}: {str(e)}")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Retención por sede y archivo de escaneos antiguos')
+    comandos = arg_parser.add_subparsers(dest='comando', required=True)
+    configurar_parser = comandos.add_parser('configurar', help='Definir la retención de una sede')
+    configurar_parser.add_argument('sede', help='Nombre de la sede')
+    limite = configurar_parser.add_mutually_exclusive_group(required=True)
+    limite.add_argument('--dias', type=int, help='Días que los hallazgos quedan en línea')
+    limite.add_argument('--sin-limite', action='store_true', help='No archivar los escaneos de la sede')
+    aplicar_parser = comandos.add_parser('aplicar', help='Archivar los escaneos más antiguos que la retención')
+    aplicar_parser.add_argument('--sede', help='Solo esta sede')
+    aplicar_parser.add_argument('--dry-run', action='store_true', help='Mostrar qué se archivaría sin hacerlo')
+    listar_parser = comandos.add_parser('listar', help='Mostrar la retención de cada sede y los escaneos archivados')
+    listar_parser.add_argument('--sede', help='Solo esta sede')
+    restaurar_parser = comandos.add_parser('restaurar', help='Volver a cargar un escaneo archivado')
+    restaurar_parser.add_argument('escaneo_id', type=int)
+    restaurar_parser.add_argument('--conservar-archivo', action='store_true',
+                                  help='No borrar el archivo después de restaurar')
+    args = arg_parser.parse_args()
+
+    from app import app
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        try:
+            if args.comando == 'configurar':
+                if args.dias is not None and args.dias < 1:
+                    raise ValueError("--dias debe ser al menos 1")
+                sede = Sede.query.filter_by(nombre=args.sede).first()
+                if sede is None:
+                    raise ValueError(f"No existe la sede {args.sede}")
+                sede.retencion_dias = None if args.sin_limite else args.dias
+                db.session.commit()
+                print(f"Retención de {sede.nombre}: {f'{sede.retencion_dias} días' if sede.retencion_dias else 'sin límite'}")
+            elif args.comando == 'aplicar':
+                totales = aplicar_retencion(args.sede, args.dry_run)
+                print(f"{totales['escaneos']} escaneos {'a archivar' if args.dry_run else 'archivados'}"
+                      + ('' if args.dry_run else f" ({totales['hosts']} hosts, {totales['vulnerabilidades']} "
+                                                 f"vulnerabilidades), {totales['errores']} con error"))
+                if totales['errores']:
+                    raise SystemExit(1)
+            elif args.comando == 'listar':
+                sedes = Sede.query.order_by(Sede.nombre)
+                if args.sede:
+                    sedes = sedes.filter(Sede.nombre == args.sede)
+                for sede in sedes:
+                    print(f"{sede.nombre}: retención {f'{sede.retencion_dias} días' if sede.retencion_dias else 'sin límite'}")
+                    archivados = Escaneo.query.filter(Escaneo.sede_id == sede.id, Escaneo.archivo.isnot(None))\
+                        .order_by(Escaneo.fecha_escaneo)
+                    for e in archivados:
+                        print(f"  {e.id:>8} {e.fecha_escaneo.strftime('%Y-%m-%d')}  {e.archivo}"
+                              f"  (archivado el {e.fecha_archivado.strftime('%Y-%m-%d')})")
+            else:
+                hosts, vulnerabilidades = restaurar_escaneo(args.escaneo_id, args.conservar_archivo)
+                print(f"Escaneo {args.escaneo_id} restaurado: {hosts} hosts, {vulnerabilidades} vulnerabilidades")
+        except ValueError as e:
+            print(f"Error: {str(e)}")
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,10 @@ document.addEventListener('DOMContentLoaded', function() {
     if (fileInput) {
         fileInput.addEventListener('change', function(e) {
             const file = e.target.files[0];
-            if (file && !file.name.toLowerCase().endsWith('.txt')) {
-                alert('Por favor, seleccione un archivo de texto (.txt)');
+            const extensiones = ['.txt', '.xml', '.csv', '.nessus', '.gz', '.zip', '.xz'];
+            const nombre = file ? file.name.toLowerCase() : '';
+            if (file && !extensiones.some(ext => nombre.endsWith(ext))) {
+                alert('Por favor, seleccione un reporte .txt, .xml, .csv o .nessus (o comprimido en .gz, .zip o .xz)');
                 e.target.value = '';
             }
         });
@@ -0,0 +1,121 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from typing import List, Optional
+
+from flask import Request, current_app
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+# Las subidas hasta este tamaño se mantienen en memoria; las mayores se escriben
+# directamente en un archivo temporal único mientras llegan
+SUBIDA_MAX_MEMORIA = int(os.environ.get('SUBIDA_MAX_MEMORIA', 1024 * 1024))
+
+class SpoolSubida(io.RawIOBase):
+    """
+    Destino de un archivo subido. Calcula el SHA-256 a medida que llegan los
+    datos y los guarda en memoria hasta `max_memoria` bytes; al superarlo los
+    vuelca a un archivo con nombre único (mkstemp) y sigue escribiendo ahí.
+    Así el cuerpo de la petición se escribe una sola vez, en su ubicación final.
+    """
+
+    def __init__(self, directorio: str, sufijo: str = '', max_memoria: int = SUBIDA_MAX_MEMORIA):
+        self._directorio = directorio
+        self._sufijo = sufijo
+        self._max_memoria = max_memoria
+        self._sha256 = hashlib.sha256()
+        self._buffer: Optional[io.BytesIO] = io.BytesIO()
+        self._archivo = None
+        self.ruta: Optional[str] = None
+        self.tamano = 0
+        self.persistido = False
+
+    @property
+    def _destino(self):
+        return self._archivo if self._archivo is not None else self._buffer
+
+    @property
+    def en_memoria(self) -> bool:
+        return self._archivo is None
+
+    @property
+    def hash(self) -> str:
+        return self._sha256.hexdigest()
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        self._sha256.update(datos)
+        self.tamano += len(datos)
+        if self._archivo is None and self.tamano > self._max_memoria:
+            self._volcar()
+        return self._destino.write(datos)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._destino.read(size)
+
+    def readinto(self, buffer) -> int:
+        return self._destino.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self._destino.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._destino.tell()
+
+    def _volcar(self) -> None:
+        fd, self.ruta = tempfile.mkstemp(prefix='reporte_', suffix=self._sufijo, dir=self._directorio)
+        self._archivo = os.fdopen(fd, 'w+b')
+        self._archivo.write(self._buffer.getvalue())
+        self._buffer = None
+        logger.debug(f"Subida mayor a {self._max_memoria} bytes, escribiendo en {self.ruta}")
+
+    def persistir(self) -> str:
+        """Deja el contenido en disco (si estaba en memoria) y retorna la ruta del archivo"""
+        if self._archivo is None:
+            self._volcar()
+        self._archivo.flush()
+        self._archivo.close()
+        self.persistido = True
+        return self.ruta
+
+    def descartar(self) -> None:
+        """Libera el contenido y borra el archivo temporal, salvo que ya se haya persistido"""
+        if self.persistido:
+            return
+        if self._archivo is not None:
+            self._archivo.close()
+        if self.ruta and os.path.exists(self.ruta):
+            os.remove(self.ruta)
+        self._buffer = None
+
+    def close(self) -> None:
+        if self._archivo is not None and not self._archivo.closed:
+            self._archivo.close()
+        super().close()
+
+class RequestSubida(Request):
+    """Request que recibe los archivos en un SpoolSubida en lugar del temporal de Werkzeug"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not hasattr(self, 'subidas'):
+            self.subidas: List[SpoolSubida] = []
+        sufijo = f'_{secure_filename(filename)}' if filename else ''
+        subida = SpoolSubida(current_app.config['UPLOAD_FOLDER'], sufijo)
+        self.subidas.append(subida)
+        return subida
+
+def descartar_subidas(request: Request) -> None:
+    """Borra las subidas de la petición que no se persistieron (validación fallida, duplicados, errores)"""
+    for subida in getattr(request, 'subidas', []):
+        subida.descartar()
@@ -0,0 +1,350 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func, update
+
+from compresion import ErrorReporteComprimido
+from database import db
+from formatos import analizar_reporte
+from ingesta import (EscaneoDuplicado, buscar_duplicado, eliminar_escaneo_por_lotes, escaneos_a_reemplazar,
+                     guardar_escaneo)
+from models import ActivityLog, Escaneo, TrabajoIngesta
+from retencion import eliminar_archivo
+
+logger = logging.getLogger(__name__)
+
+# Hilos que procesan la cola en cada proceso de la aplicación (0 = no procesar en este proceso)
+TRABAJOS_WORKERS = int(os.environ.get('TRABAJOS_WORKERS', 2))
+# Segundos de espera entre consultas a la cola cuando no hay trabajos pendientes
+TRABAJOS_INTERVALO = float(os.environ.get('TRABAJOS_INTERVALO', 2))
+# Segundos entre latidos de un trabajo en proceso
+TRABAJOS_LATIDO = int(os.environ.get('TRABAJOS_LATIDO', 60))
+# Un trabajo en proceso sin latido por más de este tiempo se considera interrumpido (proceso caído)
+TRABAJOS_TIMEOUT = int(os.environ.get('TRABAJOS_TIMEOUT', 600))
+TRABAJOS_MAX_INTENTOS = int(os.environ.get('TRABAJOS_MAX_INTENTOS', 3))
+# Cada cuántos hosts analizados se guarda el avance del trabajo durante el análisis
+TRABAJOS_PROGRESO_HOSTS = int(os.environ.get('TRABAJOS_PROGRESO_HOSTS', 100))
+# Escaneos con más vulnerabilidades que esto se eliminan en segundo plano, por lotes
+ELIMINACION_UMBRAL = int(os.environ.get('ELIMINACION_UMBRAL', 100000))
+
+ESTADOS_FINALES = ('COMPLETADO', 'ERROR')
+
+_iniciados = False
+_bloqueo = threading.Lock()
+_detener = threading.Event()
+
+def encolar_trabajo(sede_id: int, fecha_escaneo: date, archivo: str, nombre_archivo: str,
+                    user_id: Optional[int] = None, hash_contenido: Optional[str] = None,
+                    reemplazar: bool = False) -> TrabajoIngesta:
+    """Registra un reporte ya guardado en disco para procesarlo en segundo plano"""
+    trabajo = TrabajoIngesta(
+        sede_id=sede_id,
+        fecha_escaneo=fecha_escaneo,
+        archivo=archivo,
+        nombre_archivo=nombre_archivo,
+        user_id=user_id,
+        hash_contenido=hash_contenido,
+        reemplazar=reemplazar
+    )
+    db.session.add(trabajo)
+    db.session.commit()
+    logger.info(f"Trabajo {trabajo.id} en cola: {nombre_archivo}")
+    return trabajo
+
+def encolar_eliminacion(escaneo: Escaneo, user_id: Optional[int] = None) -> TrabajoIngesta:
+    """Registra la eliminación por lotes de un escaneo grande para hacerla en segundo plano"""
+    trabajo = TrabajoIngesta(
+        tipo='eliminacion',
+        sede_id=escaneo.sede_id,
+        fecha_escaneo=escaneo.fecha_escaneo,
+        archivo='',
+        nombre_archivo=f'Eliminación del escaneo {escaneo.id}',
+        user_id=user_id,
+        escaneo_id=escaneo.id,
+        hosts_procesados=escaneo.resumen.hosts if escaneo.resumen else 0,
+        vulnerabilidades_procesadas=escaneo.resumen.vulnerabilidades if escaneo.resumen else 0
+    )
+    db.session.add(trabajo)
+    db.session.commit()
+    logger.info(f"Trabajo {trabajo.id} en cola: eliminación del escaneo {escaneo.id}")
+    return trabajo
+
+def buscar_eliminacion_en_curso(escaneo_id: int) -> Optional[TrabajoIngesta]:
+    """Retorna la eliminación sin terminar del escaneo, si ya se pidió"""
+    return TrabajoIngesta.query\
+        .filter(TrabajoIngesta.tipo == 'eliminacion',
+                TrabajoIngesta.escaneo_id == escaneo_id,
+                TrabajoIngesta.estado.notin_(ESTADOS_FINALES))\
+        .first()
+
+def buscar_trabajo_en_curso(sede_id: int, hash_contenido: str) -> Optional[TrabajoIngesta]:
+    """Retorna un trabajo sin terminar de la sede con el mismo archivo, si existe"""
+    return TrabajoIngesta.query\
+        .filter(TrabajoIngesta.sede_id == sede_id,
+                TrabajoIngesta.hash_contenido == hash_contenido,
+                TrabajoIngesta.estado.notin_(ESTADOS_FINALES))\
+        .first()
+
+def trabajo_a_dict(trabajo: TrabajoIngesta) -> Dict:
+    return {
+        'id': trabajo.id,
+        'tipo': trabajo.tipo or 'ingesta',
+        'estado': trabajo.estado,
+        'etapa': trabajo.etapa,
+        'archivo': trabajo.nombre_archivo,
+        'sede': trabajo.sede.nombre if trabajo.sede else None,
+        'fecha_escaneo': trabajo.fecha_escaneo.strftime('%Y-%m-%d'),
+        'hosts': trabajo.hosts_procesados or 0,
+        'vulnerabilidades': trabajo.vulnerabilidades_procesadas or 0,
+        'error': trabajo.error,
+        'escaneo_id': trabajo.escaneo_id,
+        'reemplazar': bool(trabajo.reemplazar),
+        'finalizado': trabajo.estado in ESTADOS_FINALES,
+        'fecha_creacion': trabajo.fecha_creacion.isoformat() if trabajo.fecha_creacion else None,
+        'fecha_inicio': trabajo.fecha_inicio.isoformat() if trabajo.fecha_inicio else None,
+        'fecha_fin': trabajo.fecha_fin.isoformat() if trabajo.fecha_fin else None,
+    }
+
+def _reclamar_trabajo() -> Optional[int]:
+    """
+    Toma el trabajo pendiente más antiguo. El UPDATE condicionado al estado
+    garantiza que un trabajo lo tome un solo hilo aunque haya varios procesos
+    consultando la misma cola.
+    """
+    candidato = db.session.query(TrabajoIngesta.id)\
+        .filter_by(estado='PENDIENTE')\
+        .order_by(TrabajoIngesta.id)\
+        .first()
+    if not candidato:
+        return None
+
+    tomados = TrabajoIngesta.query.filter_by(id=candidato.id, estado='PENDIENTE').update({
+        'estado': 'PROCESANDO',
+        'etapa': 'analizando',
+        'fecha_inicio': datetime.utcnow(),
+        'fecha_actualizacion': datetime.utcnow(),
+        'intentos': TrabajoIngesta.intentos + 1,
+    }, synchronize_session=False)
+    db.session.commit()
+    return candidato.id if tomados else None
+
+def _finalizar(trabajo: TrabajoIngesta, estado: str, etapa: str, error: Optional[str] = None) -> None:
+    trabajo.estado = estado
+    trabajo.etapa = etapa
+    trabajo.error = error
+    trabajo.fecha_fin = datetime.utcnow()
+    db.session.commit()
+    if os.path.exists(trabajo.archivo):
+        os.remove(trabajo.archivo)
+
+def _finalizar_duplicado(trabajo: TrabajoIngesta, duplicado: Optional[Escaneo]) -> None:
+    fecha = f' del {duplicado.fecha_escaneo.strftime("%Y-%m-%d")}' if duplicado else ''
+    _finalizar(trabajo, 'ERROR', 'duplicado', f'El reporte ya fue cargado en el escaneo{fecha}')
+
+def _registrar_avance(trabajo_id: int) -> Callable[[int], None]:
+    """
+    Callback de avance para el análisis: cada TRABAJOS_PROGRESO_HOSTS hosts
+    guarda hosts_procesados en una transacción corta de una conexión propia,
+    para que /jobs/<id> muestre el avance sin tener abierta la sesión del trabajo.
+    """
+    def registrar(hosts: int) -> None:
+        if hosts % TRABAJOS_PROGRESO_HOSTS:
+            return
+        try:
+            with db.engine.begin() as conexion:
+                conexion.execute(update(TrabajoIngesta).where(TrabajoIngesta.id == trabajo_id)
+                                 .values(hosts_procesados=hosts, fecha_actualizacion=datetime.utcnow()))
+        except Exception as e:
+            logger.warning(f"No se pudo registrar el avance del trabajo {trabajo_id}: {str(e)}")
+    return registrar
+
+@contextmanager
+def _latido(trabajo_id: int):
+    """
+    Mientras dura el bloque, un hilo renueva fecha_actualizacion del trabajo cada
+    TRABAJOS_LATIDO segundos en una conexión propia, también durante la transacción
+    larga de la ingesta. recuperar_interrumpidos solo reencola los trabajos sin latido.
+    """
+    motor = db.engine
+    fin = threading.Event()
+
+    def latir() -> None:
+        while not fin.wait(TRABAJOS_LATIDO):
+            try:
+                with motor.begin() as conexion:
+                    conexion.execute(update(TrabajoIngesta).where(TrabajoIngesta.id == trabajo_id)
+                                     .values(fecha_actualizacion=datetime.utcnow()))
+            except Exception as e:
+                logger.warning(f"No se pudo registrar el latido del trabajo {trabajo_id}: {str(e)}")
+
+    hilo = threading.Thread(target=latir, name=f'latido-{trabajo_id}', daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        fin.set()
+        hilo.join()
+
+def _procesar_eliminacion(trabajo: TrabajoIngesta) -> None:
+    """Elimina por lotes el escaneo de un trabajo de eliminación ya reclamado"""
+    escaneo_id = trabajo.escaneo_id
+    escaneo = db.session.get(Escaneo, escaneo_id) if escaneo_id else None
+    if escaneo is None:
+        _finalizar(trabajo, 'COMPLETADO', 'completado')
+        return
+    archivo = escaneo.archivo
+    trabajo.etapa = 'eliminando'
+    db.session.commit()
+
+    hosts = eliminar_escaneo_por_lotes(escaneo_id)
+    eliminar_archivo(archivo)
+    if trabajo.user_id:
+        db.session.add(ActivityLog(
+            user_id=trabajo.user_id,
+            action='delete_scan',
+            details=f'Eliminó en segundo plano el escaneo {escaneo_id} de la sede ID {trabajo.sede_id} ({hosts} hosts)'
+        ))
+    _finalizar(trabajo, 'COMPLETADO', 'completado')
+    logger.info(f"Trabajo {trabajo.id} completado: escaneo {escaneo_id} eliminado")
+
+def procesar_trabajo(trabajo_id: int) -> None:
+    """Analiza el reporte de un trabajo ya reclamado y guarda el escaneo, o elimina uno"""
+    with _latido(trabajo_id):
+        _procesar_trabajo(trabajo_id)
+
+def _procesar_trabajo(trabajo_id: int) -> None:
+    trabajo = db.session.get(TrabajoIngesta, trabajo_id)
+    if trabajo.tipo == 'eliminacion':
+        try:
+            _procesar_eliminacion(trabajo)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error al procesar el trabajo {trabajo_id}: {str(e)}", exc_info=True)
+            _finalizar(trabajo, 'ERROR', 'error', f'Error al eliminar el escaneo: {str(e)}')
+        return
+
+    logger.info(f"Procesando trabajo {trabajo.id}: {trabajo.nombre_archivo}")
+    try:
+        # Se vuelve a verificar aquí por si otro trabajo guardó el mismo archivo mientras este esperaba
+        reemplazar_ids = []
+        if trabajo.reemplazar:
+            reemplazar_ids = escaneos_a_reemplazar(trabajo.sede_id, trabajo.fecha_escaneo, trabajo.hash_contenido)
+        elif trabajo.hash_contenido:
+            duplicado = buscar_duplicado(trabajo.sede_id, trabajo.hash_contenido)
+            if duplicado:
+                _finalizar_duplicado(trabajo, duplicado)
+                return
+
+        # El análisis puede tardar minutos: no se deja abierta una transacción mientras tanto.
+        # La ingesta abre la suya recién al guardar
+        db.session.commit()
+        resultados = analizar_reporte(trabajo.archivo, progreso=_registrar_avance(trabajo.id))
+        if not resultados:
+            _finalizar(trabajo, 'ERROR', 'error', 'No se encontraron vulnerabilidades en el archivo')
+            return
+
+        hosts_detalle = resultados['hosts_detalle']
+        trabajo.etapa = 'guardando'
+        trabajo.hosts_procesados = len(hosts_detalle)
+        trabajo.vulnerabilidades_procesadas = sum(len(h.get('vulnerabilidades', [])) for h in hosts_detalle.values())
+        db.session.commit()
+
+        ingesta = guardar_escaneo(trabajo.sede_id, trabajo.fecha_escaneo, resultados,
+                                  hash_contenido=trabajo.hash_contenido, reemplazar_ids=reemplazar_ids)
+        trabajo.escaneo_id = ingesta.escaneo_id
+        trabajo.hosts_procesados = ingesta.hosts
+        trabajo.vulnerabilidades_procesadas = ingesta.vulnerabilidades
+        if trabajo.user_id:
+            db.session.add(ActivityLog(
+                user_id=trabajo.user_id,
+                action='upload_report',
+                details=f'Subió reporte para sede ID {trabajo.sede_id}: {ingesta.hosts} hosts, '
+                        f'{ingesta.vulnerabilidades} vulnerabilidades'
+                        + (f' (reemplazó los escaneos {reemplazar_ids})' if reemplazar_ids else '')
+            ))
+        _finalizar(trabajo, 'COMPLETADO', 'completado')
+        logger.info(f"Trabajo {trabajo.id} completado: escaneo {ingesta.escaneo_id}")
+
+    except EscaneoDuplicado:
+        # Otro trabajo guardó el mismo archivo mientras este analizaba; el índice único lo impidió aquí
+        db.session.rollback()
+        logger.info(f"Trabajo {trabajo_id}: el reporte ya fue guardado por otra carga")
+        _finalizar_duplicado(trabajo, buscar_duplicado(trabajo.sede_id, trabajo.hash_contenido))
+    except ErrorReporteComprimido as e:
+        db.session.rollback()
+        logger.error(f"Trabajo {trabajo_id}: reporte comprimido rechazado: {str(e)}")
+        _finalizar(trabajo, 'ERROR', 'error', str(e))
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error al procesar el trabajo {trabajo_id}: {str(e)}", exc_info=True)
+        _finalizar(trabajo, 'ERROR', 'error', f'Error al procesar el reporte: {str(e)}')
+
+def recuperar_interrumpidos() -> int:
+    """
+    Vuelve a encolar los trabajos en proceso sin latido en los últimos
+    TRABAJOS_TIMEOUT segundos (por ejemplo, si se reinició el servidor). Un trabajo
+    largo pero vivo renueva su latido y no se toca. La ingesta es una sola
+    transacción, así que un trabajo interrumpido no dejó datos a medias; una
+    eliminación por lotes se retoma donde quedó.
+    """
+    limite = datetime.utcnow() - timedelta(seconds=TRABAJOS_TIMEOUT)
+    interrumpidos = TrabajoIngesta.query\
+        .filter(TrabajoIngesta.estado == 'PROCESANDO',
+                func.coalesce(TrabajoIngesta.fecha_actualizacion, TrabajoIngesta.fecha_inicio) < limite)\
+        .all()
+    for trabajo in interrumpidos:
+        sin_archivo = trabajo.tipo != 'eliminacion' and not os.path.exists(trabajo.archivo)
+        if (trabajo.intentos or 0) >= TRABAJOS_MAX_INTENTOS or sin_archivo:
+            trabajo.estado, trabajo.etapa = 'ERROR', 'error'
+            trabajo.error = 'El procesamiento se interrumpió y no se pudo reintentar'
+            trabajo.fecha_fin = datetime.utcnow()
+        else:
+            trabajo.estado, trabajo.etapa = 'PENDIENTE', 'en_cola'
+        logger.warning(f"Trabajo {trabajo.id} interrumpido, nuevo estado: {trabajo.estado}")
+    db.session.commit()
+    return len(interrumpidos)
+
+def _bucle(app) -> None:
+    while not _detener.is_set():
+        trabajo_id = None
+        with app.app_context():
+            try:
+                trabajo_id = _reclamar_trabajo()
+                if trabajo_id:
+                    procesar_trabajo(trabajo_id)
+                else:
+                    recuperar_interrumpidos()
+            except Exception as e:
+                logger.error(f"Error en la cola de trabajos: {str(e)}", exc_info=True)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+        if not trabajo_id:
+            _detener.wait(TRABAJOS_INTERVALO)
+
+def iniciar_trabajadores(app) -> None:
+    """Arranca (una sola vez por proceso) los hilos que consumen la cola de trabajos"""
+    global _iniciados
+    if _iniciados or TRABAJOS_WORKERS <= 0:
+        return
+    with _bloqueo:
+        if _iniciados:
+            return
+        for i in range(TRABAJOS_WORKERS):
+            threading.Thread(target=_bucle, args=(app,), name=f'trabajos-{i}', daemon=True).start()
+        _iniciados = True
+    logger.info(f"Cola de trabajos iniciada con {TRABAJOS_WORKERS} hilos")
+
+if __name__ == '__main__':
+    # Procesa la cola en primer plano, para usar con TRABAJOS_WORKERS=0 en los procesos web
+    from app import app
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Procesando la cola de trabajos (Ctrl+C para salir)")
+    try:
+        _bucle(app)
+    except KeyboardInterrupt:
+        _detener.set()
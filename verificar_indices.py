@@ -0,0 +1,89 @@
+"""
+Verifica con EXPLAIN que las consultas principales de la aplicación usan los
+índices compuestos de models.py (migración 3 de database.MIGRACIONES).
+
+Construye las mismas consultas que arman las rutas (dashboard, vulnerabilidades,
+actualizar_estado, gestión de escaneos), obtiene su plan con EXPLAIN (PostgreSQL)
+o EXPLAIN QUERY PLAN (SQLite) y comprueba que en él aparecen los índices
+esperados. En PostgreSQL se desactiva el seq scan dentro de la transacción para
+que el resultado no dependa de cuántas filas tenga la base.
+
+Uso:
+    DATABASE_URL=postgresql://... python verificar_indices.py
+    python verificar_indices.py --mostrar-planes
+
+Termina con código 1 si alguna consulta no usa sus índices.
+"""
+import argparse
+import logging
+import sys
+from datetime import date
+from typing import List, Tuple
+
+from sqlalchemy import select, text
+
+def consultas() -> List[Tuple[str, object, Tuple[str, ...]]]:
+    """(nombre, sentencia, índices que debe usar) de las consultas frecuentes"""
+    from models import Escaneo, Host, Sede, Vulnerabilidad
+
+    desde = date(2024, 1, 1)
+    return [
+        ('dashboard por sede y fecha',
+         Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
+         .filter(Sede.nombre == 'CENTRAL', Escaneo.fecha_escaneo >= desde).statement,
+         ('ix_escaneos_sede_fecha', 'ix_hosts_escaneo_ip', 'ix_vulnerabilidades_host_oid')),
+        ('vulnerabilidades por nivel y estado',
+         Vulnerabilidad.query.join(Host).join(Escaneo).join(Sede)
+         .filter(Vulnerabilidad.nivel_amenaza == 'High', Vulnerabilidad.estado == 'ACTIVA').statement,
+         ('ix_vulnerabilidades_nivel_estado',)),
+        ('escaneos de una sede',
+         Escaneo.query.filter_by(sede_id=1).order_by(Escaneo.fecha_escaneo.desc()).statement,
+         ('ix_escaneos_sede_fecha',)),
+        ('actualizar_estado: host por IP',
+         Host.query.filter_by(ip='192.168.1.10').statement,
+         ('ix_hosts_ip',)),
+        ('actualizar_estado: vulnerabilidad por host y OID',
+         Vulnerabilidad.query.filter_by(host_id=1, oid='1.3.6.1.4.1.25623.1.0.10330').statement,
+         ('ix_vulnerabilidades_host_oid',)),
+        ('vulnerabilidades de un escaneo',
+         select(Vulnerabilidad.id).where(
+             Vulnerabilidad.host_id.in_(select(Host.id).where(Host.escaneo_id == 1))),
+         ('ix_hosts_escaneo_ip', 'ix_vulnerabilidades_host_oid')),
+    ]
+
+def plan(conexion, sentencia) -> str:
+    sql = str(sentencia.compile(dialect=conexion.dialect, compile_kwargs={'literal_binds': True}))
+    if conexion.dialect.name == 'postgresql':
+        filas = conexion.execute(text(f'EXPLAIN {sql}'))
+        return '\n'.join(fila[0] for fila in filas)
+    if conexion.dialect.name == 'sqlite':
+        filas = conexion.execute(text(f'EXPLAIN QUERY PLAN {sql}'))
+        return '\n'.join(fila[-1] for fila in filas)
+    raise ValueError(f"Motor no soportado para la verificación: {conexion.dialect.name}")
+
+def verificar(mostrar_planes: bool = False) -> bool:
+    from app import app
+    from database import db
+
+    correcto = True
+    with app.app_context(), db.engine.connect() as conexion:
+        if conexion.dialect.name == 'postgresql':
+            conexion.execute(text('SET LOCAL enable_seqscan = off'))
+        for nombre, sentencia, indices in consultas():
+            texto = plan(conexion, sentencia)
+            faltantes = [i for i in indices if i not in texto]
+            correcto &= not faltantes
+            print(f"{'OK   ' if not faltantes else 'FALLA'} {nombre}"
+                  + (f" (no usa {', '.join(faltantes)})" if faltantes else ''))
+            if mostrar_planes or faltantes:
+                print('      ' + texto.replace('\n', '\n      '))
+        conexion.rollback()
+    return correcto
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Verifica con EXPLAIN el uso de índices de las consultas principales')
+    arg_parser.add_argument('--mostrar-planes', action='store_true', help='Imprimir el plan de todas las consultas')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(0 if verificar(args.mostrar_planes) else 1)